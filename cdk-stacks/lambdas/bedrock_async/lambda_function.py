@@ -1,10 +1,9 @@
 import os
 import json
 from aws_lambda_powertools import Logger, Metrics, Tracer
-from process_prompt import execute_agent_workflow, stream_pricing_message
-from utils.websocket_util import check_websocket_status, send_websocket_message
-from utils.chat_history_util import price_estimate_bedrock_flow, delete_conversation_history, load_conversation_history, query_existing_history, store_conversation_history
-from utils.fuel_station_util import query_latest_fuel_prices, query_historical_fuel_prices, query_stations, query_station_detail, query_ai_recommendation
+from utils.websocket_util import check_websocket_status, send_websocket_message, send_websocket_items
+from utils.metrics_util import set_message_type, timed
+from utils.fuel_station_util import query_latest_fuel_prices, query_historical_fuel_prices, query_stations, query_station_detail, query_ai_recommendation, query_dashboard, query_stations_page, query_price_rollup, invalidate_station_cache, parse_history_range, DEFAULT_STATIONS_PAGE_SIZE
 
 logger = Logger()
 metrics = Metrics()
@@ -15,6 +14,13 @@ user_pool_id = os.environ['USER_POOL_ID']
 user_pool_client_id = os.environ['USER_POOL_CLIENT_ID'] 
 region = os.environ['REGION']
 
+# Maximum number of stations of one dashboard request
+MAX_DASHBOARD_STATIONS = 50
+# Message types reported as metric dimension, any other type is handled as a prompt
+MESSAGE_TYPES = ('clear_conversation', 'load', 'price_estimate', 'fuel_prices', 'historical_fuel_prices',
+                 'price_rollup', 'stations', 'station_detail', 'ai_recommendation', 'dashboard')
+
+@metrics.log_metrics
 @tracer.capture_lambda_handler
 def lambda_handler(event, context):
     try:
@@ -31,8 +37,10 @@ def lambda_handler(event, context):
         try:
             # Check if the event is a WebSocket event
             if event['requestContext']['eventType'] == 'MESSAGE':
-                # Handle WebSocket message
-                process_websocket_message(event)
+                # Handle WebSocket message, every invocation publishes at least this metric so
+                # log_metrics also clears the message type dimension of invocations without others
+                with timed('MessageLatency'):
+                    process_websocket_message(event)
 
             return {'statusCode': 200}
         except Exception as e:    
@@ -51,6 +59,7 @@ def process_websocket_message(event):
     request_body = json.loads(event['body'])
     message_type = request_body.get('type', '')
     tracer.put_annotation(key="MessageType", value=message_type)
+    set_message_type(message_type if message_type in MESSAGE_TYPES else 'prompt')
     session_id = request_body.get('session_id', 'XYZ')
     tracer.put_annotation(key="SessionID", value=session_id)
     connection_id = event['requestContext']['connectionId']
@@ -61,12 +70,16 @@ def process_websocket_message(event):
     if not check_websocket_status(connection_id):
         return
 
+    # Conversation history and model modules are imported by the message types using them,
+    # so station and price requests of a cold container do not load them
     if message_type == 'clear_conversation':
+        from utils.chat_history_util import delete_conversation_history
         logger.info(f'Action: Clear Conversation {session_id}')
         # Delete the conversation history from DynamoDB
         delete_conversation_history(session_id)
         return
     elif message_type == 'load':
+        from utils.chat_history_util import load_conversation_history
         # Load conversation history from DynamoDB
         conversation_history_chunks = load_conversation_history(session_id)
         
@@ -78,6 +91,8 @@ def process_websocket_message(event):
             })
         return
     elif message_type == 'price_estimate':
+        from utils.chat_history_util import price_estimate_bedrock_flow
+        from process_prompt import stream_pricing_message
         # Trigger Bedrock Flow to estimate price
         prompt = request_body.get('prompt', '')
         price_estimate = price_estimate_bedrock_flow(session_id, prompt)
@@ -103,16 +118,55 @@ def process_websocket_message(event):
         # retrieve historical fuel prices for a station
         station = request_body.get('station', '')
         logger.info("historical_fuel_prices: " + station)
-        fuel_prices = query_historical_fuel_prices(station)
-        logger.info("response: " + json.dumps(fuel_prices))
+        resolution = request_body.get('resolution')
+        try:
+            start, end = parse_history_range(request_body.get('start'), request_body.get('end'), resolution)
+        except ValueError as e:
+            send_websocket_message(connection_id, {
+                    'type': 'error',
+                    'error': str(e)
+                })
+            return
+        fuel_prices = query_historical_fuel_prices(station, start, end, resolution)
+        logger.info(f"response: {len(fuel_prices or [])} records")
 
-        # Send fuel prices
-        send_websocket_message(connection_id, {
+        # Send fuel prices, raw ranges of up to MAX_RAW_ITEMS records take several frames
+        send_websocket_items(connection_id, {
                 'type': 'historical_fuel_prices',
+                'resolution': resolution or 'raw',
                 'prices': fuel_prices
+            }, 'prices')
+        return
+    elif message_type == 'price_rollup':
+        # retrieve the precomputed daily, weekly or monthly aggregates for a station
+        station = request_body.get('station', '')
+        resolution = request_body.get('resolution', 'daily')
+        rollup = query_price_rollup(station, resolution, request_body.get('timestamp'))
+
+        # Send price rollup
+        send_websocket_message(connection_id, {
+                'type': 'price_rollup',
+                'resolution': resolution,
+                'rollup': rollup
             })
         return
     elif message_type == 'stations':
+        # 'refresh' drops the cached station metadata, e.g. after create_stations added stations
+        if request_body.get('refresh'):
+            invalidate_station_cache()
+
+        if 'cursor' in request_body or 'page_size' in request_body:
+            # retrieve one page of the list of stations
+            page = query_stations_page(request_body.get('cursor'), request_body.get('page_size', DEFAULT_STATIONS_PAGE_SIZE))
+
+            # Send station page
+            send_websocket_message(connection_id, {
+                    'type': 'stations',
+                    'stations': page['stations'],
+                    'next_cursor': page['next_cursor']
+                })
+            return
+
         # retrieve list of stations
         stations = query_stations()
         logger.info ("stations: "+ json.dumps(stations))
@@ -124,8 +178,10 @@ def process_websocket_message(event):
             })
         return
     elif message_type == 'station_detail':
-        # retrieve station detail
+        # retrieve station detail, reloading it when 'refresh' is set
         station = request_body.get('station', '')
+        if request_body.get('refresh'):
+            invalidate_station_cache(station)
         station = query_station_detail(station)
         logger.info ("station: "+ json.dumps(station))
 
@@ -146,15 +202,30 @@ def process_websocket_message(event):
                 'recommendation': recommendation
             })
         return
+    elif message_type == 'dashboard':
+        # retrieve latest prices, detail and ai recommendation for a list of stations
+        station_names = request_body.get('stations') or [station['station'] for station in query_stations()]
+        dashboard = query_dashboard(station_names[:MAX_DASHBOARD_STATIONS])
+
+        # Send the stations in as few frames as fit, long recommendations take several frames
+        send_websocket_items(connection_id, {
+                'type': 'dashboard',
+                'stations': dashboard
+            }, 'stations')
+        return
     else:
         # Handle other message types (e.g., prompt)
+        from utils.chat_history_util import query_existing_history, store_conversation_history
+        from utils.context_window import build_model_history
+        from process_prompt import execute_agent_workflow
         try:
             logger.info("session_id: " + session_id )
             prompt = request_body.get('prompt', '')
             logger.info("prompt: " + prompt)
-            existing_history = query_existing_history(session_id)
+            existing_history, history_offset = query_existing_history(session_id)
             logger.info("hisotry: " + str(existing_history))
-            assistant_response = execute_agent_workflow(existing_history, prompt, connection_id)
+            model_history = build_model_history(session_id, existing_history, history_offset)
+            assistant_response = execute_agent_workflow(model_history, prompt, connection_id)
             logger.info("assistant_response: " + assistant_response)
             store_conversation_history(session_id, existing_history, prompt, assistant_response)
         except Exception as e:
@@ -1,9 +1,13 @@
 import os
-import boto3
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 from tools.tool_config import tool_config
-from utils.websocket_util import send_websocket_message
+from utils.websocket_util import StreamingSender
+from utils.retrieval_cache import RetrievalCache
+from utils.metrics_util import add_latency, add_count, timed
 from aws_lambda_powertools import Logger, Metrics, Tracer
+from utils.client_registry import LazyClient
 
 logger = Logger()
 metrics = Metrics()
@@ -11,6 +15,7 @@ tracer = Tracer()
 
 TEMPERATURE = 0
 MAX_TOKENS = 4096
+MAX_TOOL_WORKERS = 4
 
 KNOWLEDGE_BASE_ID = os.environ.get('KNOWLEDGE_BASE_ID')
 SELECTED_MODEL_ID = os.environ.get('SELECTED_MODEL_ID')
@@ -42,8 +47,11 @@ Company X earned $12 million. [1]  Almost 90% of it was from widget sales. [2]
 """
 
 # Initialize Bedrock client
-bedrock_client = boto3.client(service_name="bedrock-runtime")
-bedrock_agent_client = boto3.client('bedrock-agent-runtime')
+bedrock_client = LazyClient("bedrock-runtime")
+bedrock_agent_client = LazyClient('bedrock-agent-runtime')
+
+# Knowledge base retrievals are cached per container and, if configured, in DynamoDB
+retrieval_cache = RetrievalCache()
 
 @tracer.capture_method
 def execute_agent_workflow(history, prompt, connection_id):
@@ -54,43 +62,80 @@ def execute_agent_workflow(history, prompt, connection_id):
 
     # Check if there is an invoke function request from Claude
     while stop_reason == "tool_use":
-        for content in response['content']:
-            if 'toolUse' in content:
-                tool = content['toolUse']
-
-                if tool['name'] == 'retrieve_strategy_docs':
-                    tool_result = {}
-                    
-                    # retrieved_docs = GetECSAmisReleases().execute(tool['input']['image_ids'])
-                    retrieved_docs = retrieve_relevant_docs(
-                        query=tool['input']['query']
-                    )
-                    tool_result = {
-                        "toolUseId": tool['toolUseId'],
-                        "content": [{"json": {"release_detail": retrieved_docs}}]
-                    }
-                    
-                    tool_result_message = {
-                        "role": "user",
-                        "content": [
-                            {
-                                "toolResult": tool_result
-                            }
-                        ]
-                    }
-                    # Add the result info to message array
-                    messages.append(tool_result_message)
+        tool_uses = [content['toolUse'] for content in response['content'] if 'toolUse' in content]
+
+        # Run all tool calls of this turn concurrently and return the results in one message
+        tool_result_message = {
+            "role": "user",
+            "content": [
+                {
+                    "toolResult": tool_result
+                }
+                for tool_result in execute_tools(tool_uses)
+            ]
+        }
+        # Add the result info to message array
+        messages.append(tool_result_message)
         #Send the messages, including the tool result, to the model.
         stop_reason, response  = stream_messages(messages, retrieval_system_prompt + " " + final_answer_prompt, connection_id)
         # Add response to message history
         messages.append(response)
     return response['content'][0]['text']
 
+def execute_tools(tool_uses):
+    """Executes the tool calls requested by the model in one turn
+
+    Args:
+        tool_uses (list): toolUse blocks of the model response
+
+    Returns:
+        list: toolResult blocks, in the same order as tool_uses
+    """
+    if len(tool_uses) <= 1:
+        return [execute_tool(tool) for tool in tool_uses]
+
+    with ThreadPoolExecutor(max_workers=min(MAX_TOOL_WORKERS, len(tool_uses))) as executor:
+        return list(executor.map(execute_tool, tool_uses))
+
+@tracer.capture_method
+def execute_tool(tool):
+    """Executes a single tool call
+
+    Args:
+        tool (dict): toolUse block of the model response
+
+    Returns:
+        dict: toolResult block for the tool call
+    """
+    add_count('ToolCalls')
+    with timed('ToolLatency'):
+        try:
+            if tool['name'] == 'retrieve_strategy_docs':
+                retrieved_docs = retrieve_relevant_docs(
+                    query=tool['input']['query']
+                )
+                return {
+                    "toolUseId": tool['toolUseId'],
+                    "content": [{"json": {"release_detail": retrieved_docs}}]
+                }
+            error = f"Unknown tool: {tool['name']}"
+        except Exception as e:
+            logger.error(f"Error executing tool {tool['name']}: {str(e)}")
+            error = f"Error executing tool: {str(e)}"
+
+    add_count('ToolErrors')
+    return {
+        "toolUseId": tool['toolUseId'],
+        "content": [{"text": error}],
+        "status": "error"
+    }
+
 @tracer.capture_method
 def stream_messages(messages, system_prompt, connection_id):
     system_prompts = [{"text": system_prompt}]
     inference_config = {"temperature": TEMPERATURE, "maxTokens": MAX_TOKENS}
 
+    start = time.perf_counter()
     response = bedrock_client.converse_stream(
             modelId=SELECTED_MODEL_ID,
             messages=messages,
@@ -107,6 +152,8 @@ def stream_messages(messages, system_prompt, connection_id):
     text = ''
     tool_use = {}
     counter = 0
+    deltas = 0
+    sender = StreamingSender(connection_id)
 
      #stream the response into a message.
     for chunk in response['stream']:
@@ -117,17 +164,16 @@ def stream_messages(messages, system_prompt, connection_id):
             tool_use['toolUseId'] = tool['toolUseId']
             tool_use['name'] = tool['name']
         elif 'contentBlockDelta' in chunk:
+            if deltas == 0:
+                add_latency('TimeToFirstToken', start)
+            deltas += 1
             delta = chunk['contentBlockDelta']['delta']
             if 'toolUse' in delta:
                 if 'input' not in tool_use:
                     tool_use['input'] = ''
                 tool_use['input'] += delta['toolUse']['input']
             elif 'text' in delta:
-                send_websocket_message(connection_id, {
-                    'type': 'content_block_delta',
-                    'delta': {'text': delta['text']},
-                    'message_id': counter
-                })
+                sender.add(delta['text'], counter)
                 text += delta['text']
 
         elif 'contentBlockStop' in chunk:
@@ -136,9 +182,7 @@ def stream_messages(messages, system_prompt, connection_id):
                 content.append({'toolUse': tool_use})
                 tool_use = {}
             else:
-                send_websocket_message(connection_id, {
-                    'type': 'message_stop',
-                })
+                sender.stop()
                 content.append({'text': text})
                 text = ''
                 counter += 1
@@ -146,6 +190,8 @@ def stream_messages(messages, system_prompt, connection_id):
         elif 'messageStop' in chunk:
             stop_reason = chunk['messageStop']['stopReason']
 
+    add_latency('StreamTime', start)
+    add_count('StreamDeltas', deltas)
     return stop_reason, message
     
 
@@ -165,22 +211,15 @@ def stream_pricing_message(messages, connection_id):
     counter = 0
     
     text = messages
-    chunk_size = 3
-    chunks = chunk_string(text, chunk_size)
+    sender = StreamingSender(connection_id)
+    chunks = chunk_string(text, sender.max_bytes)
 
-     #stream the response into a message.
+     #stream the response into a message, one frame per chunk.
     for chunk in chunks:
-        send_websocket_message(connection_id, {
-            'type': 'content_block_delta',
-            'delta': {'text': chunk},
-            'message_id': counter
-        })
-        text += chunk
+        sender.add(chunk, counter)
         counter += 1
 
-    send_websocket_message(connection_id, {
-        'type': 'message_stop',
-    })
+    sender.stop()
     content.append({'text': text})
     text = ''
 
@@ -192,6 +231,12 @@ def retrieve_relevant_docs(query):
     vector_search_configuration = { 
          "numberOfResults": 2
       }
+
+    cache_key = RetrievalCache.make_key(KNOWLEDGE_BASE_ID, query, vector_search_configuration["numberOfResults"])
+    cached_data = retrieval_cache.get(cache_key)
+    if cached_data is not None:
+        logger.info(f"Retrieval cache hit for query: {query}")
+        return cached_data
     
     retrieval_query ={
         "text": query
@@ -238,6 +283,7 @@ def retrieve_relevant_docs(query):
         'retrievalResults': list(merged_results.values())
     }
     logger.info(merged_data)
+    retrieval_cache.put(cache_key, merged_data)
     return merged_data
 
 
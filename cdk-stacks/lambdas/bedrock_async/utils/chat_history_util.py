@@ -1,9 +1,13 @@
 from datetime import datetime
 import os
 import json
-import boto3
+import time
 from botocore.exceptions import ClientError
 from aws_lambda_powertools import Logger, Metrics, Tracer
+from utils import history_codec
+from utils.estimate_cache import PriceEstimateCache
+from utils.metrics_util import add_latency, add_bytes, timed
+from utils.client_registry import LazyClient
 
 logger = Logger()
 metrics = Metrics()
@@ -11,15 +15,27 @@ tracer = Tracer()
 user_cache = {}
 
 # Initialize DynamoDB and S3 client
-dynamodb = boto3.client('dynamodb')
-s3 = boto3.client('s3')
+dynamodb = LazyClient('dynamodb')
+s3 = LazyClient('s3')
 
 conversation_history_bucket = os.environ['CONVERSATION_HISTORY_BUCKET']
 table_name = os.environ['DYNAMODB_TABLE']
+turns_table_name = os.environ.get('CONVERSATION_TURNS_TABLE')
+
+# 'blob' stores the whole conversation in one item, 'turns' stores one item per message
+HISTORY_STORAGE_MODE = os.environ.get('HISTORY_STORAGE_MODE', 'blob')
+# Maximum number of most recent messages read as prompt history in 'turns' mode (0 for all)
+HISTORY_MAX_MESSAGES = int(os.environ.get('HISTORY_MAX_MESSAGES', 0))
+# Attributes holding the conversation history of the blob storage mode
+HISTORY_ATTRIBUTES = ('conversation_history', 'conversation_history_z', 'conversation_history_codec')
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_RETRIES = 5
 flowAliasIdentifier = os.environ["FLOW_ALIAS_IDENTIFIER"]
 flowIdentifier = os.environ["FLOW_IDENTIFIER"]
 
-client_runtime = boto3.client('bedrock-agent-runtime')
+client_runtime = LazyClient('bedrock-agent-runtime')
+
+price_estimate_cache = PriceEstimateCache()
 
 @tracer.capture_method
 def price_estimate_bedrock_flow(session_id, prompt):
@@ -30,8 +46,19 @@ def price_estimate_bedrock_flow(session_id, prompt):
         prompt (str): Prompt in JSON format to be passed to Bedrock Flow
 
     Returns:
-        dict: price estimate response
+        dict: price estimate response, with 'cached' set when it was served from the cache
     """
+    # Reuse the estimate of the same prompt while no new price data was written
+    cache_key = price_estimate_cache.key_for_prompt(prompt)
+    if cache_key:
+        cached_estimate = price_estimate_cache.get(cache_key)
+        if cached_estimate is not None:
+            logger.info(f"Price estimate cache hit for prompt: {prompt}")
+            return {
+                'response': cached_estimate['response'],
+                'cached': True
+            }
+
     response = client_runtime.invoke_flow(
         flowAliasIdentifier=flowAliasIdentifier,
         flowIdentifier=flowIdentifier,
@@ -54,6 +81,8 @@ def price_estimate_bedrock_flow(session_id, prompt):
     if result['flowCompletionEvent']['completionReason'] == 'SUCCESS':
         logger.info("Bedrock flow invocation was successful! The output of the Bedrock flow is as follows:\n")
         logger.info(result['flowOutputEvent']['content']['document'])
+        if cache_key:
+            price_estimate_cache.put(cache_key, {'response': result['flowOutputEvent']['content']['document']})
     
     else:
         logger.info("The bedrock flow invocation completed because of the following reason:", result['flowCompletionEvent']['completionReason'])
@@ -74,6 +103,8 @@ def delete_conversation_history(session_id):
             TableName=table_name,
             Key={'session_id': {'S': session_id}}
         )
+        if turns_table_name:
+            delete_conversation_turns(session_id)
         logger.info(f"Conversation history deleted for session ID: {session_id}")
     except Exception as e:
         logger.error(f"Error deleting conversation history (9781): {str(e)}")
@@ -82,27 +113,40 @@ def delete_conversation_history(session_id):
 def query_existing_history(session_id):
     """Return existing conversation history for client session
 
+    With HISTORY_MAX_MESSAGES only the most recent messages are returned, the offset tells
+    where they start in the conversation.
+
     Args:
         session_id (str): client session ID
         
     Returns:
-        dict: list of messages
+        tuple: list of messages and the number of older messages of the conversation not included
     """
+    start = time.perf_counter()
     try:
-        response = dynamodb.get_item(
-            TableName=table_name,
-            Key={'session_id': {'S': session_id}},
-            ProjectionExpression='conversation_history'
-        )
-
-        if 'Item' in response:
-            return json.loads(response['Item']['conversation_history']['S'])
-        else:
-            return []
+        messages = None
+        offset = 0
+        if HISTORY_STORAGE_MODE == 'turns':
+            messages, oldest_seq = query_conversation_turns(session_id, limit=HISTORY_MAX_MESSAGES or None)
+            # Sequence numbers start at 1 and have no gaps
+            offset = oldest_seq - 1 if messages else 0
+
+        if not messages:
+            # Sessions stored before per-message storage was enabled are read from the blob
+            response = dynamodb.get_item(
+                TableName=table_name,
+                Key={'session_id': {'S': session_id}},
+                ProjectionExpression='conversation_history, conversation_history_z, conversation_history_codec, conversation_history_in_s3'
+            )
+            messages = read_history_item(session_id, response.get('Item', {}))
 
     except Exception as e:
         logger.error("Error querying existing history: " + str(e))
-        return []
+        return [], 0
+
+    add_latency('HistoryLoadTime', start)
+    add_bytes('HistoryLoadBytes', len(json.dumps(messages)))
+    return messages, offset
 
 @tracer.capture_method
 def store_conversation_history(session_id, existing_history, user_message, assistant_message):
@@ -116,12 +160,22 @@ def store_conversation_history(session_id, existing_history, user_message, assis
 
     """
     if user_message.strip() and assistant_message.strip():
-        # Prepare the updated conversation history
-        conversation_history = existing_history + [
+        new_messages = [
             {'role': 'user', 'content': [{'text': user_message}]},
             {'role': 'assistant', 'content': [{'text': assistant_message}]}
         ]
-        conversation_history_size = len(json.dumps(conversation_history).encode('utf-8'))
+        start = time.perf_counter()
+        if HISTORY_STORAGE_MODE == 'turns':
+            # Append only the new messages, independent of the conversation length
+            append_conversation_turns(session_id, existing_history, new_messages)
+            add_latency('HistoryStoreTime', start)
+            add_bytes('HistoryStoreBytes', len(json.dumps(new_messages)))
+            return
+
+        # Prepare the updated conversation history, compressed when it is large enough
+        conversation_history = existing_history + new_messages
+        history_attributes = history_codec.to_attributes(conversation_history, 'conversation_history')
+        conversation_history_size = history_codec.attribute_size(history_attributes)
 
 
         # Check if the conversation history size is greater than 80% of the 400KB limit (327,680)
@@ -129,31 +183,23 @@ def store_conversation_history(session_id, existing_history, user_message, assis
             logger.warn(f"Warning: Session ID {session_id} has reached 80% of the DynamoDB limit. Storing conversation history in S3.")
             # Store the conversation history in S3
             try:
+                codec, body = history_codec.encode(conversation_history)
                 s3.put_object(
                     Bucket=conversation_history_bucket,
                     Key=f"{session_id}.json",
-                    Body=json.dumps(conversation_history).encode('utf-8')
+                    Body=body,
+                    Metadata={'codec': codec}
                 )
+
+                # Update the DynamoDB item to indicate that the conversation history is in S3
+                update_history_item(session_id, {}, True)
             except ClientError as e:
                 logger.error(f"Error storing conversation history in S3: {e}")
-
-            # Update the DynamoDB item to indicate that the conversation history is in S3
-                dynamodb.update_item(
-                    TableName=table_name,
-                    Key={'session_id': session_id},
-                    UpdateExpression="SET conversation_history_in_s3=:true",
-                    ExpressionAttributeValues={':true': True}
-                )
         else:
             # Store the updated conversation history in DynamoDB
-            dynamodb.put_item(
-                TableName=table_name,
-                Item={
-                    'session_id': {'S': session_id},
-                    'conversation_history': {'S': json.dumps(conversation_history)},
-                    'conversation_history_in_s3': {'BOOL': False}
-                }
-            )
+            update_history_item(session_id, history_attributes, False)
+        add_latency('HistoryStoreTime', start)
+        add_bytes('HistoryStoreBytes', conversation_history_size)
         
     else:
         if not user_message.strip():
@@ -171,39 +217,269 @@ def load_conversation_history(session_id):
     Returns:
         dict: list of messages
     """
+    start = time.perf_counter()
+    try:
+        conversation_history = None
+        if HISTORY_STORAGE_MODE == 'turns':
+            conversation_history = query_all_conversation_turns(session_id)
+
+        if not conversation_history:
+            response = dynamodb.get_item(
+                TableName=table_name,
+                Key={'session_id': {'S': session_id}}
+            )
+            conversation_history = read_history_item(session_id, response.get('Item', {}))
+
+        add_latency('HistoryLoadTime', start)
+        add_bytes('HistoryLoadBytes', len(json.dumps(conversation_history)))
+
+        # Split the conversation history into chunks
+        return split_message(conversation_history)
+
+    except Exception as e:
+        logger.error(f"Error loading conversation history: {str(e)}")
+        return []
+    
+
+def update_history_item(session_id, history_attributes, in_s3):
+    """Replace the conversation history attributes of a session item
+
+    Other attributes of the session, like the history summary, are kept.
+
+    Args:
+        session_id (str): client session ID
+        history_attributes (dict): attributes produced by history_codec.to_attributes
+        in_s3 (bool): True if the conversation history is stored in S3
+    """
+    names = {'#in_s3': 'conversation_history_in_s3'}
+    values = {':in_s3': {'BOOL': in_s3}}
+    set_expressions = ['#in_s3 = :in_s3']
+    remove_expressions = []
+
+    for index, name in enumerate(HISTORY_ATTRIBUTES):
+        names[f'#h{index}'] = name
+        if name in history_attributes:
+            values[f':h{index}'] = history_attributes[name]
+            set_expressions.append(f'#h{index} = :h{index}')
+        else:
+            remove_expressions.append(f'#h{index}')
+
+    update_expression = 'SET ' + ', '.join(set_expressions)
+    if remove_expressions:
+        update_expression += ' REMOVE ' + ', '.join(remove_expressions)
+
+    dynamodb.update_item(
+        TableName=table_name,
+        Key={'session_id': {'S': session_id}},
+        UpdateExpression=update_expression,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
+
+@tracer.capture_method
+def query_history_summary(session_id):
+    """Return the rolling summary of the older part of the conversation
+
+    Args:
+        session_id (str): client session ID
+
+    Returns:
+        tuple: summary text (or None) and the number of messages it covers
+    """
     try:
         response = dynamodb.get_item(
             TableName=table_name,
-            Key={'session_id': {'S': session_id}}
+            Key={'session_id': {'S': session_id}},
+            ProjectionExpression='history_summary, history_summary_upto'
+        )
+        item = response.get('Item', {})
+        if 'history_summary' in item:
+            return item['history_summary']['S'], int(item['history_summary_upto']['N'])
+    except Exception as e:
+        logger.error(f"Error querying history summary: {str(e)}")
+    return None, 0
+
+@tracer.capture_method
+def store_history_summary(session_id, summary, upto):
+    """Store the rolling summary of the older part of the conversation
+
+    Args:
+        session_id (str): client session ID
+        summary (str): summary text
+        upto (int): number of messages, from the start of the conversation, the summary covers
+    """
+    try:
+        dynamodb.update_item(
+            TableName=table_name,
+            Key={'session_id': {'S': session_id}},
+            UpdateExpression='SET history_summary = :summary, history_summary_upto = :upto',
+            ExpressionAttributeValues={
+                ':summary': {'S': summary},
+                ':upto': {'N': str(upto)}
+            }
         )
+    except Exception as e:
+        logger.error(f"Error storing history summary: {str(e)}")
 
-        if 'Item' in response:
-            item = response['Item']
-            conversation_history_in_s3 = False
-            conversation_history_in_s3_value = item.get('conversation_history_in_s3', False)
-            if isinstance(conversation_history_in_s3_value, dict):
-                conversation_history_in_s3 = conversation_history_in_s3_value.get('BOOL', False)
+def read_history_item(session_id, item):
+    """Decode the conversation history of a session item, loading it from S3 if offloaded
 
-            if conversation_history_in_s3:
-                # Load conversation history from S3
-                response = s3.get_object(Bucket=conversation_history_bucket, Key=f"{session_id}.json")
-                conversation_history = json.loads(response['Body'].read().decode('utf-8'))
-            else:
-                # Load conversation history from DynamoDB
-                conversation_history_str = item['conversation_history']['S']
-                conversation_history = json.loads(conversation_history_str)
+    Args:
+        session_id (str): client session ID
+        item (dict): DynamoDB item of the session
 
-            # Split the conversation history into chunks
-            return split_message(conversation_history)
+    Returns:
+        list: list of messages
+    """
+    conversation_history_in_s3 = item.get('conversation_history_in_s3', {}).get('BOOL', False)
 
+    if conversation_history_in_s3:
+        # Load conversation history from S3, objects written before compression have no codec
+        response = s3.get_object(Bucket=conversation_history_bucket, Key=f"{session_id}.json")
+        codec = response.get('Metadata', {}).get('codec', history_codec.CODEC_JSON)
+        return history_codec.decode(codec, response['Body'].read())
 
-        else:
-            return []
+    if 'conversation_history' in item or 'conversation_history_z' in item:
+        # Load conversation history from DynamoDB
+        return history_codec.from_attributes(item, 'conversation_history')
 
-    except Exception as e:
-        logger.error(f"Error loading conversation history: {str(e)}")
-        return []
-    
+    return []
+
+@tracer.capture_method
+def append_conversation_turns(session_id, existing_history, new_messages):
+    """Store each new message as its own item in the conversation turns table
+
+    The sequence numbers are allocated with an atomic counter on the session item. The
+    first append of a session stored in the blob format moves the blob into turns.
+
+    Args:
+        session_id (str): Websocket session ID
+        existing_history (list): current history of messages
+        new_messages (list): messages to append
+    """
+    response = dynamodb.update_item(
+        TableName=table_name,
+        Key={'session_id': {'S': session_id}},
+        UpdateExpression='ADD message_count :count',
+        ExpressionAttributeValues={':count': {'N': str(len(new_messages))}},
+        ReturnValues='UPDATED_OLD'
+    )
+    previous_count = int(response.get('Attributes', {}).get('message_count', {}).get('N', 0))
+
+    if previous_count == 0 and existing_history:
+        logger.info(f"Migrating conversation history of session ID {session_id} to per-message storage")
+        dynamodb.update_item(
+            TableName=table_name,
+            Key={'session_id': {'S': session_id}},
+            UpdateExpression='ADD message_count :count',
+            ExpressionAttributeValues={':count': {'N': str(len(existing_history))}}
+        )
+        new_messages = existing_history + new_messages
+
+    requests = [
+        {
+            'PutRequest': {
+                'Item': {
+                    'session_id': {'S': session_id},
+                    'seq': {'N': str(previous_count + index + 1)},
+                    'role': {'S': message['role']},
+                    **history_codec.to_attributes(message['content'], 'content')
+                }
+            }
+        }
+        for index, message in enumerate(new_messages)
+    ]
+    batch_write_turns(requests)
+
+@tracer.capture_method
+def query_conversation_turns(session_id, limit=None):
+    """Return messages stored per item, oldest first
+
+    Args:
+        session_id (str): client session ID
+        limit (int): maximum number of most recent messages to return, all if None
+
+    Returns:
+        tuple: list of messages and the sequence number of the oldest returned message
+    """
+    query_args = {
+        'TableName': turns_table_name,
+        'KeyConditionExpression': 'session_id = :session_id',
+        'ExpressionAttributeValues': {':session_id': {'S': session_id}},
+        'ScanIndexForward': False
+    }
+
+    items = []
+    while True:
+        if limit:
+            query_args['Limit'] = limit - len(items)
+        with timed('DynamoDBQueryLatency'):
+            response = dynamodb.query(**query_args)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response or (limit and len(items) >= limit):
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    items.reverse()
+    # A window of the conversation sent to the model has to start with a user message
+    while limit and items and items[0]['role']['S'] != 'user':
+        items.pop(0)
+
+    messages = [
+        {'role': item['role']['S'], 'content': history_codec.from_attributes(item, 'content')}
+        for item in items
+    ]
+    oldest_seq = int(items[0]['seq']['N']) if items else None
+    return messages, oldest_seq
+
+def query_all_conversation_turns(session_id):
+    """Return all messages of a session stored per item
+
+    Args:
+        session_id (str): client session ID
+
+    Returns:
+        list: list of messages
+    """
+    messages, _ = query_conversation_turns(session_id)
+    return messages
+
+@tracer.capture_method
+def delete_conversation_turns(session_id):
+    """Delete all message items of a session
+
+    Args:
+        session_id (str): client session ID
+    """
+    query_args = {
+        'TableName': turns_table_name,
+        'KeyConditionExpression': 'session_id = :session_id',
+        'ExpressionAttributeValues': {':session_id': {'S': session_id}},
+        'ProjectionExpression': 'session_id, seq'
+    }
+    while True:
+        response = dynamodb.query(**query_args)
+        batch_write_turns([{'DeleteRequest': {'Key': item}} for item in response.get('Items', [])])
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def batch_write_turns(requests):
+    """Write put or delete requests to the conversation turns table in batches of 25
+
+    Args:
+        requests (list): BatchWriteItem requests
+    """
+    for start in range(0, len(requests), BATCH_WRITE_SIZE):
+        batch = requests[start:start + BATCH_WRITE_SIZE]
+        for attempt in range(BATCH_WRITE_RETRIES):
+            response = dynamodb.batch_write_item(RequestItems={turns_table_name: batch})
+            batch = response.get('UnprocessedItems', {}).get(turns_table_name, [])
+            if not batch:
+                break
+            time.sleep(0.05 * (2 ** attempt))
+        if batch:
+            logger.error(f"Error writing {len(batch)} conversation turns to DynamoDB")
 
 @tracer.capture_method
 def split_message(message, max_chunk_size=30 * 1024):  # 30 KB chunk size
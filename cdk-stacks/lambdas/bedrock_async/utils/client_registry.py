@@ -0,0 +1,48 @@
+import threading
+from pricing_common.aws_clients import create_client
+
+# Clients shared by all modules of the container, by service name and client arguments
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(service_name, **client_args):
+    """Return the shared boto3 client of a service, created on first use
+
+    Creating a client loads the service model, so it is only paid by the invocations
+    that use the service and only once per container. Clients get the tuned timeouts,
+    retries and connection pool of pricing_common.aws_clients.
+
+    Args:
+        service_name (str): boto3 service name
+        **client_args: additional arguments of create_client, e.g. endpoint_url
+
+    Returns:
+        The boto3 client
+    """
+    key = (service_name, tuple(sorted(client_args.items())))
+    client = clients.get(key)
+    if client is None:
+        with clients_lock:
+            # boto3.client is not thread safe on the default session, create under the lock
+            client = clients.get(key)
+            if client is None:
+                client = clients[key] = create_client(service_name, **client_args)
+    return client
+
+
+class LazyClient:
+    """Module level handle of a shared client, resolved through get_client on first attribute access
+
+    Modules keep using their client as before, e.g. dynamodb.query(...) or
+    apigateway_management_api.exceptions.GoneException, without creating it at import.
+    """
+
+    def __init__(self, service_name, **client_args):
+        self._service_name = service_name
+        self._client_args = client_args
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(get_client(self._service_name, **self._client_args), name)
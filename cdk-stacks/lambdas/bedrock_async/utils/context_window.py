@@ -0,0 +1,159 @@
+import os
+import json
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from utils.chat_history_util import query_history_summary, store_history_summary
+from utils.client_registry import LazyClient
+
+logger = Logger()
+metrics = Metrics()
+tracer = Tracer()
+
+# Initialize Bedrock client
+bedrock_client = LazyClient("bedrock-runtime")
+
+SUMMARY_MODEL_ID = os.environ.get('SUMMARY_MODEL_ID', os.environ.get('SELECTED_MODEL_ID'))
+
+# Estimated number of history tokens sent to the model with every prompt
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 6000))
+SUMMARY_MAX_TOKENS = 512
+# Rough average for English text, good enough to budget without a tokenizer
+CHARS_PER_TOKEN = 4
+
+summary_prompt = (
+    "You summarize conversations between a fuel pricing analyst and an assistant. "
+    "Update the existing summary with the new messages. Keep the questions asked, the facts, "
+    "prices, stations and document references that were discussed. "
+    "Respond with the summary only, in at most 300 words."
+)
+
+
+def estimate_tokens(messages):
+    """Estimate the number of tokens of a list of messages
+
+    Args:
+        messages (list): list of messages
+
+    Returns:
+        int: estimated number of tokens
+    """
+    chars = 0
+    for message in messages:
+        for content in message['content']:
+            chars += len(content['text']) if 'text' in content else len(json.dumps(content))
+    return chars // CHARS_PER_TOKEN
+
+
+@tracer.capture_method
+def build_model_history(session_id, history, offset=0, token_budget=HISTORY_TOKEN_BUDGET):
+    """Fit the conversation history into the token budget sent to the model
+
+    The most recent messages are kept verbatim. Older messages are folded into a rolling
+    summary that is stored with the session. The summary is advanced so the verbatim part
+    only uses half of the budget, so it is recomputed once every few turns and not per turn.
+
+    The summary boundary is stored as a message index of the whole conversation, so it stays
+    valid when history is only the most recent window of it.
+
+    Args:
+        session_id (str): client session ID
+        history (list): conversation history, or its most recent messages
+        offset (int): number of older messages of the conversation not included in history
+        token_budget (int): estimated token limit of the history
+
+    Returns:
+        list: messages to send to the model
+    """
+    if estimate_tokens(history) <= token_budget:
+        return history
+
+    summary, summary_upto = query_history_summary(session_id)
+    if summary_upto > offset + len(history):
+        summary, summary_upto = None, 0
+    # Messages between the end of the summary and the start of the window were dropped by the window
+    upto = max(0, summary_upto - offset)
+
+    summary_tokens = len(summary) // CHARS_PER_TOKEN if summary else 0
+    if summary_tokens + estimate_tokens(history[upto:]) > token_budget:
+        split = find_split(history, upto, token_budget // 2)
+        if split > upto:
+            logger.info(f"Summarizing messages {upto} to {split} of session ID {session_id}")
+            try:
+                summary = summarize_messages(summary, history[upto:split])
+                store_history_summary(session_id, summary, offset + split)
+            except Exception as e:
+                # Still answer the prompt, with the older messages dropped instead of summarized
+                logger.error(f"Error summarizing conversation history: {str(e)}")
+            upto = split
+
+    return with_summary(summary, history[upto:])
+
+
+def find_split(history, start, token_budget):
+    """Return the index of the first message kept verbatim
+
+    The recent messages fit in token_budget and the first of them is a user message, as
+    required by the Converse API. At least the last user message is always kept.
+
+    Args:
+        history (list): full conversation history
+        start (int): index of the first message not covered by the summary
+        token_budget (int): estimated token limit of the verbatim messages
+
+    Returns:
+        int: index of the first message kept verbatim
+    """
+    split = len(history)
+    tokens = 0
+    for index in range(len(history) - 1, start - 1, -1):
+        tokens += estimate_tokens([history[index]])
+        if tokens > token_budget and split < len(history):
+            break
+        if history[index]['role'] == 'user':
+            split = index
+    return split
+
+
+def with_summary(summary, messages):
+    """Prepend the summary to the first message kept verbatim
+
+    Args:
+        summary (str): summary of the older messages, or None
+        messages (list): messages kept verbatim, starting with a user message
+
+    Returns:
+        list: messages to send to the model
+    """
+    if not summary or not messages:
+        return messages
+
+    first_message = messages[0]
+    summary_block = {'text': f"<conversation_summary>{summary}</conversation_summary>"}
+    return [{'role': first_message['role'], 'content': [summary_block] + first_message['content']}] + messages[1:]
+
+
+@tracer.capture_method
+def summarize_messages(summary, messages):
+    """Fold messages into the rolling summary
+
+    Args:
+        summary (str): existing summary, or None
+        messages (list): messages to add to the summary
+
+    Returns:
+        str: updated summary
+    """
+    transcript = "\n".join(
+        f"{message['role']}: {content['text']}"
+        for message in messages
+        for content in message['content']
+        if 'text' in content
+    )
+    prompt = f"<summary>{summary or ''}</summary>\n<messages>\n{transcript}\n</messages>"
+
+    response = bedrock_client.converse(
+        modelId=SUMMARY_MODEL_ID,
+        messages=[{'role': 'user', 'content': [{'text': prompt}]}],
+        system=[{'text': summary_prompt}],
+        inferenceConfig={'temperature': 0, 'maxTokens': SUMMARY_MAX_TOKENS}
+    )
+    return response['output']['message']['content'][0]['text']
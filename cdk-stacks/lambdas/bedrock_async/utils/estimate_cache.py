@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+from aws_lambda_powertools import Logger
+from utils.retrieval_cache import TwoTierCache
+from utils.fuel_station_util import query_latest_price_timestamp
+
+logger = Logger()
+
+# Estimates are also keyed by the newest price record, so the TTL only bounds how long
+# an estimate is reused while no new data arrives
+DEFAULT_TTL_SECONDS = int(os.environ.get('PRICE_ESTIMATE_CACHE_TTL_SECONDS', 6 * 3600))
+
+
+def normalize_prompt(prompt):
+    """Returns the prompt in a canonical form and the station it asks about.
+
+    JSON prompts, e.g. {"prompttype": "priceestimate", "station": "Station 1"}, are
+    re-serialized with sorted keys and lower case values, other prompts are lower cased
+    with collapsed whitespace.
+
+    Args:
+        prompt (str): The price estimate prompt.
+
+    Returns:
+        tuple: Normalized prompt and station name, or None if the prompt names no station.
+    """
+    try:
+        document = json.loads(prompt)
+    except (TypeError, ValueError):
+        return " ".join(str(prompt).lower().split()), None
+
+    if not isinstance(document, dict):
+        return json.dumps(document, sort_keys=True), None
+
+    station = document.get('station')
+    normalized = {
+        key.lower(): " ".join(value.lower().split()) if isinstance(value, str) else value
+        for key, value in document.items()
+    }
+    return json.dumps(normalized, sort_keys=True, separators=(',', ':')), station
+
+
+class PriceEstimateCache(TwoTierCache):
+    """Two tier cache for the price estimates of the Bedrock flow.
+
+    An estimate is reused until a newer price record is written for its station.
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, **kwargs):
+        super().__init__('PriceEstimate', ttl_seconds=ttl_seconds, **kwargs)
+
+    @staticmethod
+    def make_key(station, normalized_prompt, latest_timestamp):
+        """Builds the cache key of an estimate.
+
+        Args:
+            station (str): The station of the estimate.
+            normalized_prompt (str): The prompt from normalize_prompt.
+            latest_timestamp (int): Epoch timestamp of the newest price record of the station.
+
+        Returns:
+            str: Cache key
+        """
+        digest = hashlib.sha256(f"{station}|{latest_timestamp}|{normalized_prompt}".encode('utf-8')).hexdigest()
+        return f"estimate#{digest}"
+
+    def key_for_prompt(self, prompt):
+        """Builds the cache key of a prompt, or returns None if it cannot be cached.
+
+        Prompts without a station, or stations without price data, are not cached.
+        """
+        normalized_prompt, station = normalize_prompt(prompt)
+        if not station:
+            return None
+        latest_timestamp = query_latest_price_timestamp(station)
+        if latest_timestamp is None:
+            return None
+        return self.make_key(station, normalized_prompt, latest_timestamp)
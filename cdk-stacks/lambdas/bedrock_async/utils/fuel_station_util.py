@@ -1,63 +1,233 @@
-from datetime import datetime
 import os
-import boto3
+import json
+import time
+import base64
+import threading
 from botocore.exceptions import ClientError
 from aws_lambda_powertools import Logger, Metrics, Tracer
-from boto3.dynamodb.conditions import Key
-from decimal import Decimal
+from pricing_common.dynamodb_decode import decode_items
+from pricing_common.price_history import query_price_history, RESOLUTIONS
+from pricing_common.price_rollups import get_rollup
+from utils.metrics_util import timed
+from concurrent.futures import ThreadPoolExecutor
+from utils.client_registry import LazyClient
 
 logger = Logger()
 metrics = Metrics()
 tracer = Tracer()
 
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+# Initialize DynamoDB client, items are decoded from the typed attribute values directly
+dynamodb = LazyClient('dynamodb')
 
 # Initialize dynamodb tables
 table_name = os.environ['FUEL_PRICES_TABLE']
 stations_table_name = os.environ['FUEL_STATIONS_TABLE']
 ai_recommendation_table_name = os.environ['AI_RECOMMENDATION_TABLE']
+rollups_table_name = os.environ.get('PRICE_ROLLUPS_TABLE')
 
-fuel_prices_table = dynamodb.Table(table_name)
-fuel_stations_table = dynamodb.Table(stations_table_name)
-ai_recommendation_table = dynamodb.Table(ai_recommendation_table_name)
+# Station metadata is written once by the data generator, so it is cached in the warm container
+STATION_CACHE_TTL_SECONDS = int(os.environ.get('STATION_CACHE_TTL_SECONDS', 900))
+# Interval of the optional version check against the stations table item count (0 disables it)
+STATION_CACHE_VERSION_CHECK_SECONDS = int(os.environ.get('STATION_CACHE_VERSION_CHECK_SECONDS', 0))
 
+station_cache = {}
+station_cache_state = {'version': None, 'checked_at': 0}
+station_cache_lock = threading.Lock()
+
+# Number of parallel scan segments used to list the stations (1 for a sequential scan)
+STATION_SCAN_SEGMENTS = int(os.environ.get('STATION_SCAN_SEGMENTS', 1))
+DEFAULT_STATIONS_PAGE_SIZE = 50
+MAX_STATIONS_PAGE_SIZE = 500
+
+MAX_DASHBOARD_WORKERS = 16
+# Attributes repeated in every nested dashboard entry, dropped to keep the frame compact
+DASHBOARD_REDUNDANT_KEYS = ('station', 'expirationtime')
+
+
+def get_station_metadata(key, loader):
+    """Read-through cache for station metadata.
+
+    Args:
+        key: Cache key.
+        loader: Function loading the value from DynamoDB on a miss.
+
+    Returns:
+        The cached or loaded value. Empty values are not cached.
+    """
+    check_station_cache_version()
+
+    with station_cache_lock:
+        entry = station_cache.get(key)
+    if entry and entry[1] > time.time():
+        return entry[0]
+
+    value = loader()
+    if value:
+        with station_cache_lock:
+            station_cache[key] = (value, time.time() + STATION_CACHE_TTL_SECONDS)
+    return value
+
+def invalidate_station_cache(station_name=None):
+    """Drops cached station metadata, for stations and station_detail requests with 'refresh' set.
+
+    Args:
+        station_name (str): Only drop the detail of this station and the station list, all entries if None.
+    """
+    with station_cache_lock:
+        if station_name is None:
+            station_cache.clear()
+        else:
+            station_cache.pop(('detail', station_name), None)
+            station_cache.pop('stations', None)
+
+def check_station_cache_version():
+    """Invalidates the station cache when the item count of the stations table changed.
+
+    DynamoDB refreshes the item count about every six hours, so this catches stations
+    added or removed outside of the application while the TTL covers everything else.
+    """
+    if not STATION_CACHE_VERSION_CHECK_SECONDS:
+        return
+
+    now = time.time()
+    with station_cache_lock:
+        if now - station_cache_state['checked_at'] < STATION_CACHE_VERSION_CHECK_SECONDS:
+            return
+        station_cache_state['checked_at'] = now
+
+    try:
+        version = dynamodb.describe_table(TableName=stations_table_name)['Table']['ItemCount']
+    except Exception as e:
+        logger.error(f"Error checking stations table version: {str(e)}")
+        return
+
+    with station_cache_lock:
+        if station_cache_state['version'] is not None and station_cache_state['version'] != version:
+            logger.info("Stations table changed, invalidating station cache")
+            station_cache.clear()
+        station_cache_state['version'] = version
 
 @tracer.capture_method
 def query_stations():
-    """Return list of fuel stations from dynamodb
+    """Return list of fuel stations, from the station cache when it is fresh
 
     Returns:
         dict: list of stations
     """
+    return get_station_metadata('stations', scan_stations)
+
+@tracer.capture_method
+def query_stations_page(cursor=None, page_size=DEFAULT_STATIONS_PAGE_SIZE):
+    """Return one page of the station list, reading only that page from the table
+
+    Each page is one Scan call with Limit, continued from the LastEvaluatedKey of the
+    previous page. Pages follow the order of the table and are sorted by id within
+    the page, the full list of query_stations is sorted by id as a whole.
+
+    Args:
+        cursor (str): Opaque cursor returned with the previous page, None for the first page.
+        page_size (int): Number of stations per page.
+
+    Returns:
+        dict: Stations of the page and the cursor of the next page (None on the last page).
+    """
+    page_size = max(1, min(int(page_size), MAX_STATIONS_PAGE_SIZE))
+    scan_args = {'TableName': stations_table_name, 'Limit': page_size}
+    start_key = decode_stations_cursor(cursor)
+    if start_key:
+        scan_args['ExclusiveStartKey'] = start_key
+
     try:
-        response = fuel_stations_table.scan(
-            Limit=50
-        ) 
+        with timed('DynamoDBQueryLatency'):
+            response = dynamodb.scan(**scan_args)
+    except Exception as e:
+        logger.error(f"Error scanning stations page: {str(e)}")
+        return {'stations': [], 'next_cursor': None}
 
-        unsorted_items = response.get('Items')
-        items = sorted(unsorted_items, key=lambda x: x['id'])
+    last_key = response.get('LastEvaluatedKey')
+    return {
+        'stations': sorted(decode_items(response.get('Items', [])), key=lambda x: x['id']),
+        'next_cursor': encode_stations_cursor(last_key) if last_key else None
+    }
 
-        formated_items = []
-        
-        for item in items:
-            current_item = item
-            
-            # Convert Decimal to float for CSV compatibility
-            for key, value in current_item.items():
-                if isinstance(value, Decimal):
-                    current_item[key] = float(value)
-                if key == 'timestamp':
-                    current_item[key] = datetime.fromtimestamp(current_item[key]).strftime("%Y-%m-%d %H:%M:%S")
-            
-            formated_items.append(current_item)
-        return formated_items
+def encode_stations_cursor(last_key):
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode('utf-8')).decode('utf-8')
+
+def decode_stations_cursor(cursor):
+    """Return the ExclusiveStartKey of a cursor, None for the first page or an invalid cursor"""
+    if not cursor:
+        return None
+    try:
+        start_key = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        if not isinstance(start_key, dict) or 'station' not in start_key:
+            raise ValueError(cursor)
+        return start_key
+    except (ValueError, TypeError):
+        logger.warning(f"Invalid stations cursor: {cursor}")
+        return None
+
+def scan_stations(segments=STATION_SCAN_SEGMENTS):
+    """Return list of fuel stations from dynamodb
+
+    All pages of the table are read. With more than one segment, the segments of a
+    parallel scan are read concurrently, so listing time stays flat for large fleets.
+
+    Args:
+        segments (int): Number of parallel scan segments.
+
+    Returns:
+        dict: list of stations
+    """
+    try:
+        if segments > 1:
+            with ThreadPoolExecutor(max_workers=segments) as executor:
+                segment_items = executor.map(lambda segment: scan_station_segment(segment, segments), range(segments))
+                unsorted_items = [item for items in segment_items for item in items]
+        else:
+            unsorted_items = scan_station_segment()
+
+        return sorted(decode_items(unsorted_items), key=lambda x: x['id'])
     except:
         return []
 
+def scan_station_segment(segment=None, total_segments=None):
+    """Read all pages of the stations table, or of one segment of a parallel scan.
+
+    Args:
+        segment (int): Segment to read.
+        total_segments (int): Total number of segments, None for a sequential scan.
+
+    Returns:
+        list: Items of the segment.
+    """
+    scan_args = {'TableName': stations_table_name}
+    if total_segments:
+        scan_args['Segment'] = segment
+        scan_args['TotalSegments'] = total_segments
+
+    items = []
+    while True:
+        with timed('DynamoDBQueryLatency'):
+            response = dynamodb.scan(**scan_args)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
 @tracer.capture_method
 def query_station_detail(station_name):
+    """Returns the detail of a specific station, from the station cache when it is fresh.
+
+    Args:
+        station_name (str): The name of the station to query.
+
+    Returns:
+        dict or None: Station Details
+    """
+    return get_station_metadata(('detail', station_name), lambda: load_station_detail(station_name))
+
+def load_station_detail(station_name):
     """Queries DynamoDB for detail of a specific station.
 
     Args:
@@ -67,28 +237,8 @@ def query_station_detail(station_name):
         dict or None: Station Details
     """
     try:
-
-        # Query with KeyConditionExpression to filter by station
-        response = fuel_stations_table.query(
-            KeyConditionExpression=Key('station').eq(station_name),
-            ScanIndexForward=False,   # Sort by timestamp in descending order (newest first)
-            Limit=1                     # Retrieve only the latest (top) record
-        )
-        
-        items = response.get('Items')
-        if items:
-            latest_item = items[0]
-            
-            # Convert Decimal to float for CSV compatibility
-            for key, value in latest_item.items():
-                if isinstance(value, Decimal):
-                    latest_item[key] = float(value)
-                if key == 'timestamp':
-                    latest_item[key] = datetime.fromtimestamp(latest_item[key]).strftime("%Y-%m-%d %H:%M:%S")
-
-            return latest_item
-        else:
-            return None
+        items = query_station_items(stations_table_name, station_name, limit=1)
+        return items[0] if items else None
 
     except Exception as e:
         print(f"Error querying latest fuel prices: {e}")
@@ -105,28 +255,8 @@ def query_ai_recommendation(station_name):
         dict or None: Recommendation by AI.
     """
     try:
-
-        # Query with KeyConditionExpression to filter by station
-        response = ai_recommendation_table.query(
-            KeyConditionExpression=Key('station').eq(station_name),
-            ScanIndexForward=False,   # Sort by timestamp in descending order (newest first)
-            Limit=1                     # Retrieve only the latest (top) record
-        )
-        
-        items = response.get('Items')
-        if items:
-            latest_item = items[0]
-            
-            # Convert Decimal to float for CSV compatibility
-            for key, value in latest_item.items():
-                if isinstance(value, Decimal):
-                    latest_item[key] = float(value)
-                if key == 'timestamp':
-                    latest_item[key] = datetime.fromtimestamp(latest_item[key]).strftime("%Y-%m-%d %H:%M:%S")
-
-            return latest_item
-        else:
-            return None
+        items = query_station_items(ai_recommendation_table_name, station_name, limit=1)
+        return items[0] if items else None
 
     except Exception as e:
         print(f"Error querying latest fuel prices: {e}")
@@ -143,68 +273,178 @@ def query_latest_fuel_prices(station_name):
         dict or None: The latest fuel prices if found, or None if not found.
     """
     try:
+        items = query_station_items(table_name, station_name, limit=1)
+        return items[0] if items else None
 
-        # Query with KeyConditionExpression to filter by station
-        response = fuel_prices_table.query(
-            KeyConditionExpression=Key('station').eq(station_name),
-            ScanIndexForward=False,   # Sort by timestamp in descending order (newest first)
-            Limit=1                     # Retrieve only the latest (top) record
-        )
+    except Exception as e:
+        print(f"Error querying latest fuel prices: {e}")
+        return None  # Indicate that no data was found
         
-        items = response.get('Items')
-        if items:
-            latest_item = items[0]
-            
-            # Convert Decimal to float for CSV compatibility
-            for key, value in latest_item.items():
-                if isinstance(value, Decimal):
-                    latest_item[key] = float(value)
-                if key == 'timestamp':
-                    latest_item[key] = datetime.fromtimestamp(latest_item[key]).strftime("%Y-%m-%d %H:%M:%S")
-
-            return latest_item
-        else:
-            return None
+@tracer.capture_method
+def query_latest_price_timestamp(station_name):
+    """Queries the epoch timestamp of the newest price record of a station.
+
+    Only the sort key is read, so the query consumes the minimum capacity.
+
+    Args:
+        station_name (str): The name of the station to query.
+
+    Returns:
+        int or None: The epoch timestamp, or None if there are no records or on error.
+    """
+    try:
+        with timed('DynamoDBQueryLatency'):
+            response = dynamodb.query(
+                TableName=table_name,
+                KeyConditionExpression='station = :station',
+                ExpressionAttributeValues={':station': {'S': station_name}},
+                ExpressionAttributeNames={'#timestamp': 'timestamp'},
+                ProjectionExpression='#timestamp',
+                ScanIndexForward=False,
+                Limit=1
+            )
+        items = response.get('Items', [])
+        return int(float(items[0]['timestamp']['N'])) if items else None
+
+    except Exception as e:
+        print(f"Error querying latest price timestamp: {e}")
+        return None
+
+def parse_history_range(start=None, end=None, resolution=None):
+    """Checks the range and resolution of a historical_fuel_prices request.
+
+    Args:
+        start: Start of the range as epoch seconds, a number or numeric string, or None.
+        end: End of the range as epoch seconds, a number or numeric string, or None.
+        resolution (str): One of RESOLUTIONS, or None.
+
+    Returns:
+        tuple: start and end as integer epoch seconds, None where not given.
+
+    Raises:
+        ValueError: With a message for the client if the request is invalid.
+    """
+    if resolution is not None and resolution not in RESOLUTIONS:
+        raise ValueError(f"Unsupported resolution '{resolution}', expected one of {', '.join(RESOLUTIONS)}")
+
+    bounds = []
+    for name, value in (('start', start), ('end', end)):
+        if value is None:
+            bounds.append(None)
+            continue
+        try:
+            if isinstance(value, bool):
+                raise ValueError(value)
+            bounds.append(int(float(value)))
+        except (ValueError, TypeError, OverflowError):
+            raise ValueError(f"Invalid {name} '{value}', expected epoch seconds")
+        if bounds[-1] < 0:
+            raise ValueError(f"Invalid {name} '{value}', expected epoch seconds")
+
+    if bounds[0] is not None and bounds[1] is not None and bounds[0] > bounds[1]:
+        raise ValueError("Invalid range, start is after end")
+    return bounds[0], bounds[1]
+
+@tracer.capture_method
+def query_historical_fuel_prices(station_name, start=None, end=None, resolution=None):
+    """Queries DynamoDB for the history of fuel prices for a specific station.
+
+    Without a range or resolution the latest 7 records are returned.
+
+    Args:
+        station_name (str): The name of the station to query.
+        start (int): Start of the range as epoch seconds.
+        end (int): End of the range as epoch seconds.
+        resolution (str): 'raw', 'daily', 'weekly' or 'monthly'. Buckets hold the mean,
+            min and max of every price column.
+
+    Returns:
+        dict or None: The fuel price records, newest first, or None on error.
+    """
+    try:
+        if start is None and end is None and resolution is None:
+            return query_station_items(table_name, station_name, limit=7)
+        with timed('DynamoDBQueryLatency'):
+            return query_price_history(dynamodb, table_name, station_name, start, end, resolution or 'raw')
 
     except Exception as e:
         print(f"Error querying latest fuel prices: {e}")
         return None  # Indicate that no data was found
-        
+
 @tracer.capture_method
-def query_historical_fuel_prices(station_name):
-    """Queries DynamoDB for 7 days history of fuel prices for a specific station.
+def query_price_rollup(station_name, resolution='daily', timestamp=None):
+    """Reads the precomputed price aggregates of a station with a single GetItem.
 
     Args:
         station_name (str): The name of the station to query.
+        resolution (str): 'daily', 'weekly' or 'monthly'.
+        timestamp (int): Epoch timestamp in the requested day, week or month, now if None.
 
     Returns:
-        dict or None: The latest fuel prices if found, or None if not found.
+        dict or None: Mean, min and max of every price column, total volume and record
+            count, or None if there is no rollup or on error.
     """
+    if not rollups_table_name:
+        return None
     try:
+        with timed('DynamoDBQueryLatency'):
+            return get_rollup(dynamodb, rollups_table_name, station_name, resolution, timestamp)
+
+    except Exception as e:
+        print(f"Error querying price rollup: {e}")
+        return None
+
+def query_station_items(query_table_name, station_name, limit):
+    """Queries the newest items of a station with the low-level client and decodes them.
+
+    Args:
+        query_table_name (str): The table to query.
+        station_name (str): The name of the station to query.
+        limit (int): Maximum number of items.
 
-        # Query with KeyConditionExpression to filter by station
-        response = fuel_prices_table.query(
-            KeyConditionExpression=Key('station').eq(station_name),
+    Returns:
+        list: Decoded items, newest first.
+    """
+    # Query with KeyConditionExpression to filter by station
+    with timed('DynamoDBQueryLatency'):
+        response = dynamodb.query(
+            TableName=query_table_name,
+            KeyConditionExpression='station = :station',
+            ExpressionAttributeValues={':station': {'S': station_name}},
             ScanIndexForward=False,   # Sort by timestamp in descending order (newest first)
-            Limit=7                     # Retrieve only the latest (top) record
+            Limit=limit
         )
-        
-        items = response.get('Items')
-        formated_items = []
-        
-        for item in items:
-            current_item = item
-            
-            # Convert Decimal to float for CSV compatibility
-            for key, value in current_item.items():
-                if isinstance(value, Decimal):
-                    current_item[key] = float(value)
-                if key == 'timestamp':
-                    current_item[key] = datetime.fromtimestamp(current_item[key]).strftime("%Y-%m-%d %H:%M:%S")
-            
-            formated_items.append(current_item)
-        return formated_items
+    return decode_items(response.get('Items', []))
 
-    except Exception as e:
-        print(f"Error querying latest fuel prices: {e}")
-        return None  # Indicate that no data was found
\ No newline at end of file
+@tracer.capture_method
+def query_dashboard(station_names):
+    """Queries latest prices, station detail and latest ai recommendation of several stations.
+
+    The queries of all stations run concurrently, so the response time is bound by the slowest
+    query instead of the sum of all queries.
+
+    Args:
+        station_names (list): The names of the stations to query.
+
+    Returns:
+        list: One entry per station with its prices, detail and recommendation.
+    """
+    station_queries = (
+        ('prices', query_latest_fuel_prices),
+        ('detail', query_station_detail),
+        ('recommendation', query_ai_recommendation),
+    )
+    queries = [(station_name, key, query) for station_name in station_names for key, query in station_queries]
+    if not queries:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(MAX_DASHBOARD_WORKERS, len(queries))) as executor:
+        results = list(executor.map(lambda station_query: station_query[2](station_query[0]), queries))
+
+    dashboard = {station_name: {'station': station_name} for station_name in station_names}
+    for (station_name, key, _), result in zip(queries, results):
+        if result:
+            result = {name: value for name, value in result.items() if name not in DASHBOARD_REDUNDANT_KEYS}
+        dashboard[station_name][key] = result
+
+    return list(dashboard.values())
@@ -0,0 +1,89 @@
+import json
+import zlib
+
+# Codec markers stored next to the payload, so the format can change without breaking old items
+CODEC_JSON = 'json'
+CODEC_ZLIB = 'zlib-v1'
+
+# Payloads smaller than this are stored as plain JSON, compression does not pay off for them
+COMPRESSION_THRESHOLD = 512
+COMPRESSION_LEVEL = 6
+
+
+def encode(value):
+    """Serialize a value to JSON and compress it when it is large enough
+
+    Args:
+        value: JSON serializable value
+
+    Returns:
+        tuple: codec marker and encoded bytes
+    """
+    data = json.dumps(value).encode('utf-8')
+    if len(data) < COMPRESSION_THRESHOLD:
+        return CODEC_JSON, data
+    return CODEC_ZLIB, zlib.compress(data, COMPRESSION_LEVEL)
+
+
+def decode(codec, data):
+    """Decode bytes produced by encode
+
+    Args:
+        codec (str): codec marker returned by encode
+        data (bytes): encoded bytes
+
+    Returns:
+        The decoded value
+    """
+    if codec == CODEC_ZLIB:
+        data = zlib.decompress(data)
+    elif codec not in (None, CODEC_JSON):
+        raise ValueError(f"Unsupported history codec: {codec}")
+    return json.loads(data)
+
+
+def to_attributes(value, name):
+    """Encode a value as DynamoDB attributes
+
+    Compressed values are stored in a binary '<name>_z' attribute with a '<name>_codec'
+    marker, small values in a plain string attribute '<name>'.
+
+    Args:
+        value: JSON serializable value
+        name (str): attribute name
+
+    Returns:
+        dict: DynamoDB attribute values
+    """
+    codec, data = encode(value)
+    if codec == CODEC_JSON:
+        return {name: {'S': data.decode('utf-8')}}
+    return {
+        f'{name}_z': {'B': data},
+        f'{name}_codec': {'S': codec}
+    }
+
+
+def from_attributes(item, name):
+    """Decode a value stored with to_attributes, or as a plain JSON string attribute
+
+    Args:
+        item (dict): DynamoDB item
+        name (str): attribute name
+
+    Returns:
+        The decoded value
+    """
+    codec = item.get(f'{name}_codec', {}).get('S')
+    if codec and codec != CODEC_JSON:
+        return decode(codec, item[f'{name}_z']['B'])
+    return json.loads(item[name]['S'])
+
+
+def attribute_size(attributes):
+    """Return the approximate size in bytes of attributes produced by to_attributes"""
+    size = 0
+    for name, value in attributes.items():
+        payload = value.get('B', value.get('S', b''))
+        size += len(name) + len(payload if isinstance(payload, bytes) else payload.encode('utf-8'))
+    return size
@@ -0,0 +1,51 @@
+import time
+from contextlib import contextmanager
+from aws_lambda_powertools import Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Metrics instances share one metric set, it is published as EMF by log_metrics on the handler
+metrics = Metrics()
+
+MESSAGE_TYPE_DIMENSION = 'MessageType'
+
+
+def set_message_type(message_type):
+    """Add the websocket message type as dimension of every metric of this invocation
+
+    Args:
+        message_type (str): message type of the request
+    """
+    metrics.add_dimension(name=MESSAGE_TYPE_DIMENSION, value=message_type)
+
+def add_latency(name, start):
+    """Add the time since start as a latency metric in milliseconds
+
+    Args:
+        name (str): metric name
+        start (float): time.perf_counter() value at the start of the stage
+
+    Returns:
+        float: the latency in milliseconds
+    """
+    latency = (time.perf_counter() - start) * 1000
+    metrics.add_metric(name=name, unit=MetricUnit.Milliseconds, value=latency)
+    return latency
+
+def add_count(name, value=1):
+    metrics.add_metric(name=name, unit=MetricUnit.Count, value=value)
+
+def add_bytes(name, value):
+    metrics.add_metric(name=name, unit=MetricUnit.Bytes, value=value)
+
+@contextmanager
+def timed(name):
+    """Add the duration of the block as a latency metric, also when it raises
+
+    Args:
+        name (str): metric name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_latency(name, start)
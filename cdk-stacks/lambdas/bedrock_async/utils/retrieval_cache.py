@@ -0,0 +1,192 @@
+import os
+import time
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.metrics import MetricUnit
+from utils.client_registry import LazyClient
+
+logger = Logger()
+metrics = Metrics()
+tracer = Tracer()
+
+# Initialize DynamoDB client
+dynamodb = LazyClient('dynamodb')
+
+cache_table_name = os.environ.get('CACHE_TABLE')
+
+DEFAULT_TTL_SECONDS = int(os.environ.get('RETRIEVAL_CACHE_TTL_SECONDS', 3600))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('RETRIEVAL_CACHE_MAX_ENTRIES', 256))
+DEFAULT_MAX_BYTES = int(os.environ.get('RETRIEVAL_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+
+class TTLCache:
+    """Thread safe in-process LRU cache with a per entry TTL and a total size limit.
+
+    Values are stored as strings so the size of an entry is its length.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, expires_at=None):
+        """Stores value and returns the number of entries evicted to make room for it."""
+        if len(value) > self.max_bytes:
+            return 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at or time.time() + self.ttl_seconds)
+            self._size += len(value)
+
+            evicted = 0
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                evicted += 1
+            return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._size -= len(value)
+
+
+class TwoTierCache:
+    """Two tier cache of JSON values.
+
+    The first tier lives in the Lambda container. The optional second tier is the DynamoDB
+    cache table, shared by all containers, so cold containers can skip the work as well.
+    Metrics are named after the cache, e.g. RetrievalCacheHit.
+    """
+
+    def __init__(self, name, table_name=cache_table_name, ttl_seconds=DEFAULT_TTL_SECONDS, local_cache=None):
+        self.name = name
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.local_cache = local_cache or TTLCache(ttl_seconds=ttl_seconds)
+
+    @tracer.capture_method
+    def get(self, key):
+        """Returns the cached value, or None on a miss.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            dict or None: The cached value.
+        """
+        value = self.local_cache.get(key)
+        if value is not None:
+            metrics.add_metric(name=f"{self.name}CacheHit", unit=MetricUnit.Count, value=1)
+            return json.loads(value)
+
+        if self.table_name:
+            value, expires_at = self._get_shared(key)
+            if value is not None:
+                metrics.add_metric(name=f"{self.name}CacheSharedHit", unit=MetricUnit.Count, value=1)
+                self._put_local(key, value, expires_at)
+                return json.loads(value)
+
+        metrics.add_metric(name=f"{self.name}CacheMiss", unit=MetricUnit.Count, value=1)
+        return None
+
+    @tracer.capture_method
+    def put(self, key, result):
+        """Stores a value in both tiers.
+
+        Args:
+            key (str): Cache key.
+            result (dict): The value.
+        """
+        value = json.dumps(result)
+        expires_at = int(time.time()) + self.ttl_seconds
+        self._put_local(key, value, expires_at)
+
+        if self.table_name:
+            try:
+                dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        'cache_key': {'S': key},
+                        'value': {'S': value},
+                        'expirationtime': {'N': str(expires_at)}
+                    }
+                )
+            except Exception as e:
+                logger.error(f"Error storing {self.name} value in cache table: {str(e)}")
+
+    def _put_local(self, key, value, expires_at):
+        evicted = self.local_cache.put(key, value, expires_at)
+        if evicted:
+            metrics.add_metric(name=f"{self.name}CacheEviction", unit=MetricUnit.Count, value=evicted)
+
+    def _get_shared(self, key):
+        try:
+            response = dynamodb.get_item(
+                TableName=self.table_name,
+                Key={'cache_key': {'S': key}}
+            )
+        except Exception as e:
+            logger.error(f"Error reading {self.name} value from cache table: {str(e)}")
+            return None, None
+
+        item = response.get('Item')
+        if not item:
+            return None, None
+
+        # DynamoDB TTL deletes lazily, so expired items can still be returned
+        expires_at = int(item['expirationtime']['N'])
+        if expires_at <= time.time():
+            return None, None
+        return item['value']['S'], expires_at
+
+
+class RetrievalCache(TwoTierCache):
+    """Two tier cache for knowledge base retrievals."""
+
+    def __init__(self, table_name=cache_table_name, ttl_seconds=DEFAULT_TTL_SECONDS, local_cache=None):
+        super().__init__('Retrieval', table_name, ttl_seconds, local_cache)
+
+    @staticmethod
+    def make_key(knowledge_base_id, query, number_of_results):
+        """Builds the cache key from the normalized query and the number of results.
+
+        Args:
+            knowledge_base_id (str): The knowledge base the query runs against.
+            query (str): The retrieval query.
+            number_of_results (int): The number of results requested.
+
+        Returns:
+            str: Cache key
+        """
+        normalized_query = " ".join(query.lower().split())
+        digest = hashlib.sha256(f"{knowledge_base_id}|{number_of_results}|{normalized_query}".encode('utf-8')).hexdigest()
+        return f"retrieval#{digest}"
@@ -1,15 +1,29 @@
 import os
-import boto3
+import time
 import json
+import threading
 from botocore.exceptions import ClientError
 from aws_lambda_powertools import Logger, Metrics, Tracer
+from utils.metrics_util import add_latency, add_count
+from utils.client_registry import LazyClient
 
 logger = Logger()
 metrics = Metrics()
 tracer = Tracer()
 
 WEBSOCKET_API_ENDPOINT = os.environ['WEBSOCKET_API_ENDPOINT']
-apigateway_management_api = boto3.client('apigatewaymanagementapi', endpoint_url=f"{WEBSOCKET_API_ENDPOINT.replace('wss', 'https')}/ws")
+apigateway_management_api = LazyClient('apigatewaymanagementapi', endpoint_url=f"{WEBSOCKET_API_ENDPOINT.replace('wss', 'https')}/ws")
+
+# Streamed text is coalesced into frames of up to this many bytes, or sent once the oldest
+# buffered delta is this old
+STREAM_FLUSH_BYTES = int(os.environ.get('STREAM_FLUSH_BYTES', 512))
+STREAM_FLUSH_INTERVAL_MS = int(os.environ.get('STREAM_FLUSH_INTERVAL_MS', 50))
+# API Gateway rejects websocket frames over 128 KB, lists are split into frames below this size
+MAX_FRAME_BYTES = int(os.environ.get('WEBSOCKET_MAX_FRAME_BYTES', 120 * 1024))
+
+# Connection state of the current invocation, refreshed by check_websocket_status and
+# invalidated when API Gateway reports the connection as gone
+connection_states = {}
 
 
 @tracer.capture_method
@@ -22,27 +36,177 @@ def send_websocket_message(connection_id, message):
             
     """
     try:
-        # Check if the WebSocket connection is open
-        connection = apigateway_management_api.get_connection(ConnectionId=connection_id)
-        connection_state = connection.get('ConnectionStatus', 'OPEN')
-        if connection_state != 'OPEN':
-            logger.warn(f"WebSocket connection is not open (state: {connection_state})")
+        # Check if the WebSocket connection is open, using the cached state when known
+        is_open = connection_states.get(connection_id)
+        if is_open is None:
+            is_open = get_connection_status(connection_id)
+        if not is_open:
+            logger.warn(f"WebSocket connection is not open (connectionId: {connection_id})")
             return
 
+        start = time.perf_counter()
         apigateway_management_api.post_to_connection(
             ConnectionId=connection_id,
             Data=json.dumps(message).encode()
         )
+        add_latency('WebsocketSendLatency', start)
     except apigateway_management_api.exceptions.GoneException:
+        add_count('WebsocketSendFailures')
+        invalidate_connection(connection_id)
         logger.info(f"WebSocket connection is closed (connectionId: {connection_id})")
     except Exception as e:
+        add_count('WebsocketSendFailures')
         logger.error(f"Error sending WebSocket message (9012): {str(e)}")
 
+def send_websocket_items(connection_id, message, items_key, max_bytes=MAX_FRAME_BYTES):
+    """Send a message with a list of items, split across frames that fit the frame size limit
+
+    Every frame is a copy of message with a consecutive slice of the items under items_key,
+    plus 'part' (starting at 1) and 'parts'. A list that fits in one frame is sent as a single
+    frame with part 1 of 1, so clients reading only the first frame are unaffected. An empty
+    or missing list, e.g. None after a failed query, is sent unchanged in one frame.
+
+    Args:
+        connection_id (str): client connection ID
+        message (dict): message fields sent in every frame
+        items_key (str): key of the item list in the frames
+        max_bytes (int): maximum encoded size of a frame
+
+    Returns:
+        int: number of frames sent
+    """
+    items = message.get(items_key)
+    if not items:
+        send_websocket_message(connection_id, {**message, 'part': 1, 'parts': 1})
+        return 1
+
+    # Size of the frame without items, with room for the part counters
+    envelope_bytes = len(json.dumps({**message, items_key: [], 'part': 0, 'parts': 0}).encode()) + 16
+
+    chunks = []
+    chunk = []
+    chunk_bytes = envelope_bytes
+    for item in items:
+        # Item plus the separator, the frame is encoded with the same separators by send_websocket_message
+        item_bytes = len(json.dumps(item).encode()) + 2
+        if chunk and chunk_bytes + item_bytes > max_bytes:
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = envelope_bytes
+        chunk.append(item)
+        chunk_bytes += item_bytes
+    chunks.append(chunk)
+
+    for part, chunk in enumerate(chunks, start=1):
+        send_websocket_message(connection_id, {**message, items_key: chunk, 'part': part, 'parts': len(chunks)})
+    return len(chunks)
+
+def get_connection_status(connection_id):
+    """Queries API Gateway for the connection state and caches the result
+
+    Args:
+        connection_id (str): client connection ID
+
+    Returns:
+        bool: True if the connection is open
+    """
+    connection = apigateway_management_api.get_connection(ConnectionId=connection_id)
+    connection_state = connection.get('ConnectionStatus', 'OPEN')
+    connection_states[connection_id] = connection_state == 'OPEN'
+    return connection_states[connection_id]
+
+def invalidate_connection(connection_id):
+    """Marks the connection as closed so further sends are skipped
+
+    Args:
+        connection_id (str): client connection ID
+    """
+    connection_states[connection_id] = False
+
 def check_websocket_status(connection_id):
+    # Start every invocation with a fresh state for this connection only
+    connection_states.clear()
     try:
-        connection = apigateway_management_api.get_connection(ConnectionId=connection_id)
-        connection_state = connection.get('ConnectionStatus', 'OPEN')
-        return connection_state == 'OPEN'
+        return get_connection_status(connection_id)
     except ClientError as e:
         logger.error(f"Error checking WebSocket status (9011): {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+class StreamingSender:
+    """Coalesces streamed text deltas into fewer websocket frames
+
+    The first delta of every message_id is sent right away, so coalescing does not delay
+    the first token. Later deltas are buffered and sent as one content_block_delta frame
+    when the buffer reaches max_bytes, when the message_id changes, or at the latest
+    max_interval_ms after the oldest buffered delta, by a timer when no further delta
+    arrives. stop sends the remaining text before the message_stop frame, so clients see
+    the same text, ids and stop events with fewer frames.
+    """
+
+    def __init__(self, connection_id, max_bytes=STREAM_FLUSH_BYTES, max_interval_ms=STREAM_FLUSH_INTERVAL_MS):
+        self.connection_id = connection_id
+        self.max_bytes = max_bytes
+        self.max_interval = max_interval_ms / 1000
+        self.frames_sent = 0
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._buffered_since = None
+        self._message_id = None
+        self._sent_message_id = None
+        self._timer = None
+        # Held while sending, so frames of the timer and the stream are sent in order
+        self._lock = threading.RLock()
+
+    def add(self, text, message_id):
+        """Buffer a text delta, sending the buffer when a flush condition is met
+
+        Args:
+            text (str): text delta
+            message_id (int): id of the message the delta belongs to
+        """
+        if not text:
+            return
+        with self._lock:
+            if self._buffer and message_id != self._message_id:
+                self.flush()
+            if not self._buffer:
+                self._message_id = message_id
+                self._buffered_since = time.monotonic()
+            self._buffer.append(text)
+            self._buffered_bytes += len(text.encode('utf-8'))
+
+            if (message_id != self._sent_message_id or self._buffered_bytes >= self.max_bytes
+                    or time.monotonic() - self._buffered_since >= self.max_interval):
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.max_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Send the buffered text as one content_block_delta frame"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer:
+                return
+            send_websocket_message(self.connection_id, {
+                'type': 'content_block_delta',
+                'delta': {'text': ''.join(self._buffer)},
+                'message_id': self._message_id
+            })
+            self.frames_sent += 1
+            self._sent_message_id = self._message_id
+            self._buffer = []
+            self._buffered_bytes = 0
+            self._buffered_since = None
+
+    def stop(self):
+        """Send the buffered text followed by a message_stop frame"""
+        with self._lock:
+            self.flush()
+            send_websocket_message(self.connection_id, {
+                'type': 'message_stop',
+            })
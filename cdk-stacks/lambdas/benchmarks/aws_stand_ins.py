@@ -0,0 +1,428 @@
+"""In-process stand-ins of the AWS clients used by the Lambda functions, for benchmarks.
+
+Every call is counted per operation and sleeps for the configured latency of its
+service, so benchmarks see realistic downstream waits without AWS access. Only the
+request shapes used by the functions of this repository are supported.
+"""
+import re
+import json
+import time
+import threading
+from collections import Counter
+import boto3
+from botocore.exceptions import ClientError
+
+# Default latency per service in milliseconds
+DEFAULT_LATENCY_MS = {
+    'dynamodb': 4,
+    's3': 15,
+    'apigatewaymanagementapi': 8,
+    'bedrock-runtime': 150,
+    'bedrock-agent-runtime': 300,
+}
+
+# Key schema of the tables, by environment variable of the table name
+TABLE_KEYS = {
+    'FUEL_PRICES_TABLE': ('station', 'timestamp'),
+    'FUEL_STATIONS_TABLE': ('station', 'id'),
+    'AI_RECOMMENDATION_TABLE': ('station', 'timestamp'),
+    'PRICE_ROLLUPS_TABLE': ('station', 'bucket'),
+    'DYNAMODB_TABLE': ('session_id', None),
+    'CONVERSATION_TURNS_TABLE': ('session_id', 'seq'),
+    'CACHE_TABLE': ('cache_key', None),
+}
+
+
+class CallRecorder:
+    """Thread safe counter of the calls made to the stand-ins."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def record(self, operation, payload_bytes=0):
+        with self._lock:
+            self.counts[operation] += 1
+            self.bytes_sent += payload_bytes
+
+    def snapshot(self):
+        with self._lock:
+            return Counter(self.counts), self.bytes_sent
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.bytes_sent = 0
+
+
+class _Exceptions:
+    """Modeled exceptions of a client, created on first access, e.g. client.exceptions.GoneException."""
+
+    def __init__(self):
+        self._classes = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name not in self._classes:
+            self._classes[name] = type(name, (ClientError,), {})
+        return self._classes[name]
+
+    def error(self, name, message=''):
+        return getattr(self, name)({'Error': {'Code': name, 'Message': message}}, name)
+
+
+class StandInClient:
+    """Base class of the stand-ins. Public methods are wrapped to record calls and sleep."""
+
+    service = None
+
+    def __init__(self, recorder, latency_ms=None):
+        self.recorder = recorder
+        self.latency = (DEFAULT_LATENCY_MS.get(self.service, 0) if latency_ms is None else latency_ms) / 1000
+        self.exceptions = _Exceptions()
+
+    def _call(self, operation, payload_bytes=0):
+        self.recorder.record(f"{self.service}.{operation}", payload_bytes)
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def _projection(item, expression, names):
+    if not expression:
+        return item
+    attributes = [names.get(name.strip(), name.strip()) for name in expression.split(',')]
+    return {name: value for name, value in item.items() if name in attributes}
+
+
+def _sort_value(typed_value):
+    if typed_value is None:
+        return 0
+    if 'N' in typed_value:
+        return float(typed_value['N'])
+    return typed_value.get('S', '')
+
+
+class DynamoDBStandIn(StandInClient):
+    """Low-level DynamoDB client keeping typed items in memory."""
+
+    service = 'dynamodb'
+
+    def __init__(self, recorder, latency_ms=None, key_schemas=None):
+        super().__init__(recorder, latency_ms)
+        self.key_schemas = key_schemas or {}
+        self.tables = {}
+        self._lock = threading.Lock()
+
+    # Helpers to seed and inspect data, not counted
+
+    def _keys(self, table_name):
+        return self.key_schemas.get(table_name, ('pk', None))
+
+    def _partition(self, table_name, pk_value):
+        return self.tables.setdefault(table_name, {}).setdefault(pk_value, {})
+
+    def seed(self, table_name, items):
+        for item in items:
+            self._store(table_name, item)
+
+    def _store(self, table_name, item):
+        pk, sk = self._keys(table_name)
+        with self._lock:
+            self._partition(table_name, item[pk]['S'])[_sort_value(item.get(sk)) if sk else None] = item
+
+    def _find(self, table_name, key):
+        pk, sk = self._keys(table_name)
+        partition = self.tables.get(table_name, {}).get(key[pk]['S'], {})
+        return partition.get(_sort_value(key.get(sk)) if sk else None)
+
+    def clear(self, table_name, pk_value=None):
+        with self._lock:
+            if pk_value is None:
+                self.tables.pop(table_name, None)
+            else:
+                self.tables.get(table_name, {}).pop(pk_value, None)
+
+    # Client operations
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False):
+        self._call('get_item')
+        item = self._find(TableName, Key)
+        if item is None:
+            return {}
+        return {'Item': _projection(item, ProjectionExpression, ExpressionAttributeNames or {})}
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._call('put_item', len(json.dumps(Item, default=str)))
+        self._store(TableName, Item)
+        return {}
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self._call('delete_item')
+        pk, sk = self._keys(TableName)
+        with self._lock:
+            self.tables.get(TableName, {}).get(Key[pk]['S'], {}).pop(_sort_value(Key.get(sk)) if sk else None, None)
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ReturnValues=None, **kwargs):
+        self._call('update_item', len(json.dumps(ExpressionAttributeValues or {}, default=str)))
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            item = self._find(TableName, Key)
+            if item is None:
+                item = dict(Key)
+                pk, sk = self._keys(TableName)
+                self._partition(TableName, Key[pk]['S'])[_sort_value(Key.get(sk)) if sk else None] = item
+            old = dict(item)
+            updated = []
+            for action, body in re.findall(r'(SET|REMOVE|ADD)\s+(.*?)(?=\s+(?:SET|REMOVE|ADD)\s|$)', UpdateExpression):
+                for part in body.split(','):
+                    part = part.strip()
+                    if action == 'SET':
+                        name, value = [token.strip() for token in part.split('=')]
+                        name = names.get(name, name)
+                        item[name] = values[value]
+                    elif action == 'REMOVE':
+                        name = names.get(part, part)
+                        item.pop(name, None)
+                    else:
+                        name, value = part.split()
+                        name = names.get(name, name)
+                        total = float(item.get(name, {'N': '0'})['N']) + float(values[value]['N'])
+                        item[name] = {'N': str(int(total)) if total.is_integer() else str(total)}
+                    updated.append(name)
+        if ReturnValues == 'UPDATED_OLD':
+            return {'Attributes': {name: old[name] for name in updated if name in old}}
+        return {}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ScanIndexForward=True,
+              Limit=None, ExclusiveStartKey=None, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        pk, sk = self._keys(TableName)
+        with self._lock:
+            partition = dict(self.tables.get(TableName, {}).get(ExpressionAttributeValues[f':{pk}']['S'], {}))
+
+        sort_keys = sorted(partition, reverse=not ScanIndexForward)
+        if 'BETWEEN' in KeyConditionExpression:
+            start = float(ExpressionAttributeValues[':start']['N'])
+            end = float(ExpressionAttributeValues[':end']['N'])
+            sort_keys = [key for key in sort_keys if start <= key <= end]
+        elif '>=' in KeyConditionExpression:
+            placeholder = re.search(r'>=\s*(:\w+)', KeyConditionExpression).group(1)
+            bound = float(ExpressionAttributeValues[placeholder]['N'])
+            sort_keys = [key for key in sort_keys if key >= bound]
+        elif '<' in KeyConditionExpression:
+            placeholder = re.search(r'<\s*(:\w+)', KeyConditionExpression).group(1)
+            bound = float(ExpressionAttributeValues[placeholder]['N'])
+            sort_keys = [key for key in sort_keys if key < bound]
+
+        if ExclusiveStartKey:
+            last = _sort_value(ExclusiveStartKey.get(sk))
+            sort_keys = sort_keys[sort_keys.index(last) + 1:]
+
+        page = sort_keys[:Limit] if Limit else sort_keys
+        items = [_projection(partition[key], ProjectionExpression, ExpressionAttributeNames or {}) for key in page]
+        self._call('query')
+        response = {'Items': items, 'Count': len(items)}
+        if Limit and len(sort_keys) > Limit:
+            response['LastEvaluatedKey'] = {name: partition[page[-1]][name] for name in (pk, sk) if name}
+        return response
+
+    def scan(self, TableName, Segment=None, TotalSegments=None, ExclusiveStartKey=None, Limit=None, **kwargs):
+        self._call('scan')
+        pk, sk = self._keys(TableName)
+        with self._lock:
+            items = [item for partition in self.tables.get(TableName, {}).values() for item in partition.values()]
+        if TotalSegments:
+            items = items[Segment::TotalSegments]
+        if ExclusiveStartKey:
+            keys = [{name: item[name] for name in (pk, sk) if name} for item in items]
+            items = items[keys.index(ExclusiveStartKey) + 1:]
+
+        page = items[:Limit] if Limit else items
+        response = {'Items': page, 'Count': len(page)}
+        if Limit and len(items) > Limit:
+            response['LastEvaluatedKey'] = {name: page[-1][name] for name in (pk, sk) if name}
+        return response
+
+    def batch_write_item(self, RequestItems):
+        self._call('batch_write_item', len(json.dumps(RequestItems, default=str)))
+        for table_name, requests in RequestItems.items():
+            for request in requests:
+                if 'PutRequest' in request:
+                    self._store(table_name, request['PutRequest']['Item'])
+                else:
+                    key = request['DeleteRequest']['Key']
+                    pk, sk = self._keys(table_name)
+                    with self._lock:
+                        self.tables.get(table_name, {}).get(key[pk]['S'], {}).pop(_sort_value(key.get(sk)) if sk else None, None)
+        return {'UnprocessedItems': {}}
+
+    def describe_table(self, TableName):
+        self._call('describe_table')
+        count = sum(len(partition) for partition in self.tables.get(TableName, {}).values())
+        return {'Table': {'TableName': TableName, 'ItemCount': count}}
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class S3StandIn(StandInClient):
+    service = 's3'
+
+    def __init__(self, recorder, latency_ms=None):
+        super().__init__(recorder, latency_ms)
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        data = Body.encode('utf-8') if isinstance(Body, str) else Body
+        self._call('put_object', len(data))
+        self.objects[(Bucket, Key)] = (data, Metadata or {})
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call('get_object')
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.error('NoSuchKey')
+        data, metadata = self.objects[(Bucket, Key)]
+        return {'Body': _Body(data), 'Metadata': metadata}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call('delete_object')
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+
+class ApiGatewayStandIn(StandInClient):
+    """API Gateway management API, every connection is open. Frames over the 128 KB
+    limit of websocket APIs are rejected and counted as error frames.
+    """
+
+    service = 'apigatewaymanagementapi'
+    max_frame_bytes = 128 * 1024
+
+    def __init__(self, recorder, latency_ms=None):
+        super().__init__(recorder, latency_ms)
+        self.error_frames = 0
+        self.rejected_frames = 0
+        # Delivered frames are only kept when enabled, e.g. by tests inspecting them
+        self.record_frames = False
+        self.frames = []
+
+    def post_to_connection(self, ConnectionId, Data):
+        self._call('post_to_connection', len(Data))
+        if len(Data) > self.max_frame_bytes:
+            self.error_frames += 1
+            self.rejected_frames += 1
+            raise self.exceptions.error('PayloadTooLargeException', 'Message too long')
+        if self.record_frames:
+            self.frames.append(Data)
+        if b'"type": "error"' in Data:
+            self.error_frames += 1
+        return {}
+
+    def get_connection(self, ConnectionId):
+        self._call('get_connection')
+        return {'ConnectionStatus': 'OPEN'}
+
+
+class BedrockRuntimeStandIn(StandInClient):
+    """Converse API. The first turn of a conversation asks for the retrieval tool, the
+    turn after a tool result answers with response_chars of text in delta_chars deltas.
+    """
+
+    service = 'bedrock-runtime'
+
+    def __init__(self, recorder, latency_ms=None, response_chars=1500, delta_chars=6, delta_ms=0):
+        super().__init__(recorder, latency_ms)
+        self.response_chars = response_chars
+        self.delta_chars = delta_chars
+        self.delta_latency = delta_ms / 1000
+
+    def _answer(self):
+        sentence = "Regular prices in Amarillo follow the competitors within three cents. "
+        return (sentence * (self.response_chars // len(sentence) + 1))[:self.response_chars]
+
+    def converse_stream(self, modelId, messages, **kwargs):
+        self._call('converse_stream')
+        wants_tool = 'toolResult' not in messages[-1]['content'][0]
+        return {'stream': self._stream(wants_tool)}
+
+    def _stream(self, wants_tool):
+        yield {'messageStart': {'role': 'assistant'}}
+        text = "Let me look up the pricing strategy documents." if wants_tool else self._answer()
+        for start in range(0, len(text), self.delta_chars):
+            if self.delta_latency:
+                time.sleep(self.delta_latency)
+            yield {'contentBlockDelta': {'delta': {'text': text[start:start + self.delta_chars]}}}
+        yield {'contentBlockStop': {}}
+        if wants_tool:
+            yield {'contentBlockStart': {'start': {'toolUse': {'toolUseId': 'tool-1', 'name': 'retrieve_strategy_docs'}}}}
+            yield {'contentBlockDelta': {'delta': {'toolUse': {'input': json.dumps({'query': 'regular fuel pricing strategy'})}}}}
+            yield {'contentBlockStop': {}}
+        yield {'messageStop': {'stopReason': 'tool_use' if wants_tool else 'end_turn'}}
+
+    def converse(self, modelId, messages, **kwargs):
+        self._call('converse')
+        return {'output': {'message': {'role': 'assistant', 'content': [{'text': self._answer()[:600]}]}}}
+
+
+class BedrockAgentRuntimeStandIn(StandInClient):
+    """Knowledge base retrieval and the price estimate flow."""
+
+    service = 'bedrock-agent-runtime'
+
+    def __init__(self, recorder, latency_ms=None, estimate_chars=2048):
+        super().__init__(recorder, latency_ms)
+        self.estimate_chars = estimate_chars
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, **kwargs):
+        self._call('retrieve')
+        return {'retrievalResults': [
+            {
+                'content': {'text': f"Pricing strategy section {index}. " * 40},
+                'location': {'type': 'S3', 's3Location': {'uri': f"s3://docs/strategy/doc{index}.pdf"}},
+            }
+            for index in range(2)
+        ]}
+
+    def invoke_flow(self, flowIdentifier, flowAliasIdentifier, inputs, **kwargs):
+        self._call('invoke_flow')
+        estimate = ("Recommended regular price: $3.45, mid: $3.59, premium: $3.79. " * 40)[:self.estimate_chars]
+        return {'responseStream': [
+            {'flowOutputEvent': {'content': {'document': estimate}}},
+            {'flowCompletionEvent': {'completionReason': 'SUCCESS'}},
+        ]}
+
+
+class StandIns:
+    """The stand-ins of all services, sharing one call recorder."""
+
+    def __init__(self, latency_ms=None, table_names=None, **bedrock_options):
+        latency_ms = {**DEFAULT_LATENCY_MS, **(latency_ms or {})}
+        self.recorder = CallRecorder()
+        key_schemas = {table_names[variable]: keys for variable, keys in TABLE_KEYS.items() if variable in (table_names or {})}
+        self.clients = {
+            'dynamodb': DynamoDBStandIn(self.recorder, latency_ms['dynamodb'], key_schemas),
+            's3': S3StandIn(self.recorder, latency_ms['s3']),
+            'apigatewaymanagementapi': ApiGatewayStandIn(self.recorder, latency_ms['apigatewaymanagementapi']),
+            'bedrock-runtime': BedrockRuntimeStandIn(self.recorder, latency_ms['bedrock-runtime'], **bedrock_options),
+            'bedrock-agent-runtime': BedrockAgentRuntimeStandIn(self.recorder, latency_ms['bedrock-agent-runtime']),
+        }
+
+    def __getitem__(self, service):
+        return self.clients[service]
+
+    def install(self):
+        """Make boto3.client return the stand-ins. Call before importing the function code."""
+        def client(service_name=None, *args, **kwargs):
+            return self.clients[service_name]
+        boto3.client = client
+        boto3.Session.client = lambda session, service_name=None, *args, **kwargs: self.clients[service_name]
@@ -0,0 +1,183 @@
+"""Cold start benchmark of the bedrock_async handler.
+
+Every run starts a fresh interpreter that imports lambda_function and handles one
+websocket message, then a second one of the same type. Real boto3 clients are created,
+only the HTTP send is answered locally with an empty response, so import time, client
+creation and the request path are measured without AWS access.
+
+To compare with an older version, check it out next to the tree and point --lambda-dir at it:
+    git worktree add /tmp/before <commit>
+    python benchmarks/bench_cold_start.py --lambda-dir /tmp/before/cdk-stacks/lambdas/bedrock_async
+
+Usage:
+    python benchmarks/bench_cold_start.py [--runs 5] [--types stations,prompt] [--lambda-dir DIR]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LAMBDA_DIR = os.path.join(BENCHMARKS_DIR, '..', 'bedrock_async')
+
+MESSAGES = {
+    'stations': {'type': 'stations'},
+    'fuel_prices': {'type': 'fuel_prices', 'station': 'Station 1'},
+    'dashboard': {'type': 'dashboard', 'stations': ['Station 1', 'Station 2']},
+    'load': {'type': 'load', 'session_id': 'bench-session'},
+    'price_estimate': {'type': 'price_estimate', 'prompt': 'Station 1', 'session_id': 'bench-session'},
+    'prompt': {'type': 'prompt', 'prompt': 'How should I price regular fuel?', 'session_id': 'bench-session'},
+}
+
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'AWS_EC2_METADATA_DISABLED': 'true',
+    'REGION': 'us-east-1',
+    'FUEL_PRICES_TABLE': 'bench-prices',
+    'FUEL_STATIONS_TABLE': 'bench-stations',
+    'AI_RECOMMENDATION_TABLE': 'bench-ai-recommendations',
+    'PRICE_ROLLUPS_TABLE': 'bench-price-rollups',
+    'DYNAMODB_TABLE': 'bench-conversations',
+    'CONVERSATION_TURNS_TABLE': 'bench-conversation-turns',
+    'CACHE_TABLE': 'bench-cache',
+    'CONVERSATION_HISTORY_BUCKET': 'bench-history',
+    'HISTORY_STORAGE_MODE': 'turns',
+    'WEBSOCKET_API_ENDPOINT': 'wss://bench.example.com',
+    'FLOW_ALIAS_IDENTIFIER': 'bench-flow-alias',
+    'FLOW_IDENTIFIER': 'bench-flow',
+    'USER_POOL_ID': 'bench-pool',
+    'USER_POOL_CLIENT_ID': 'bench-client',
+    'KNOWLEDGE_BASE_ID': 'bench-kb',
+    'SELECTED_MODEL_ID': 'bench-model',
+    'POWERTOOLS_SERVICE_NAME': 'BEDROCK_ASYNC_BENCHMARK',
+    'POWERTOOLS_METRICS_NAMESPACE': 'Benchmark',
+    'POWERTOOLS_TRACE_DISABLED': 'true',
+    'POWERTOOLS_LOG_LEVEL': 'WARNING',
+}
+
+
+class LambdaContext:
+    function_name = 'bench-bedrock-async'
+    memory_limit_in_mb = 1024
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:bench-bedrock-async'
+    aws_request_id = 'bench-request'
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+def run_child(message_type, lambda_dir):
+    """Measure one cold start in this interpreter and print the result as JSON."""
+    import io
+    import resource
+    import warnings
+    import contextlib
+
+    start = time.perf_counter()
+    # Everything imported from here on is part of the cold start
+    import botocore.client
+    import botocore.httpsession
+    from botocore.awsrequest import AWSResponse
+
+    class EmptyBody:
+        def stream(self, **kwargs):
+            yield b'{}'
+
+    def send(self, request):
+        return AWSResponse(request.url, 200, {}, EmptyBody())
+
+    botocore.httpsession.URLLib3Session.send = send
+
+    clients_created = []
+    create_client = botocore.client.ClientCreator.create_client
+
+    def counting_create_client(self, service_name, *args, **kwargs):
+        clients_created.append(service_name)
+        return create_client(self, service_name, *args, **kwargs)
+
+    botocore.client.ClientCreator.create_client = counting_create_client
+
+    sys.path.insert(0, os.path.join(lambda_dir, '..', 'layers', 'common', 'python'))
+    sys.path.insert(0, lambda_dir)
+    warnings.simplefilter('ignore')
+    with contextlib.redirect_stdout(io.StringIO()):
+        from lambda_function import lambda_handler
+    imported = time.perf_counter()
+
+    event = {
+        'body': json.dumps(MESSAGES[message_type]),
+        'requestContext': {'eventType': 'MESSAGE', 'connectionId': 'bench-connection'},
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = lambda_handler(event, LambdaContext())
+        first = time.perf_counter()
+        lambda_handler(event, LambdaContext())
+    second = time.perf_counter()
+
+    print(json.dumps({
+        'import_ms': (imported - start) * 1000,
+        'first_invocation_ms': (first - imported) * 1000,
+        'second_invocation_ms': (second - first) * 1000,
+        'clients': len(clients_created),
+        'client_services': clients_created,
+        'max_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'status': response.get('statusCode'),
+    }))
+
+
+def measure(message_type, lambda_dir):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', message_type, '--lambda-dir', lambda_dir],
+        env={**os.environ, **ENVIRONMENT}, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per message type')
+    parser.add_argument('--types', help=f"Comma separated message types, of {', '.join(MESSAGES)}")
+    parser.add_argument('--lambda-dir', default=DEFAULT_LAMBDA_DIR, help='Directory of lambda_function.py')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+    lambda_dir = os.path.abspath(args.lambda_dir)
+
+    if args.child:
+        run_child(args.child, lambda_dir)
+        return
+
+    message_types = args.types.split(',') if args.types else list(MESSAGES)
+    # The first run compiles the bytecode of the tree, it is not counted
+    measure(message_types[0], lambda_dir)
+
+    results = []
+    for message_type in message_types:
+        runs = [measure(message_type, lambda_dir) for _ in range(args.runs)]
+        results.append({
+            'type': message_type,
+            **{name: statistics.median(run[name] for run in runs)
+               for name in ('import_ms', 'first_invocation_ms', 'second_invocation_ms', 'clients', 'max_rss_mib')},
+            'client_services': runs[-1]['client_services'],
+            'status': runs[-1]['status'],
+        })
+
+    print(f"lambda dir: {lambda_dir}, runs: {args.runs}, medians")
+    print(f"{'type':<18}{'import ms':>11}{'first ms':>10}{'cold ms':>9}{'second ms':>11}{'clients':>9}{'RSS MiB':>9}")
+    for result in results:
+        cold = result['import_ms'] + result['first_invocation_ms']
+        print(f"{result['type']:<18}{result['import_ms']:>11.1f}{result['first_invocation_ms']:>10.1f}{cold:>9.1f}"
+              f"{result['second_invocation_ms']:>11.1f}{result['clients']:>9g}{result['max_rss_mib']:>9.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
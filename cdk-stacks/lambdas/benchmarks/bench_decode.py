@@ -0,0 +1,96 @@
+"""Micro-benchmark of the per-item cost of decoding fuel price items.
+
+Compares the previous path, the boto3 resource layer deserializer (Decimal values)
+followed by the Decimal to float and timestamp loop, with pricing_common.dynamodb_decode
+working on the typed attribute maps of the low-level client.
+
+Usage:
+    python benchmarks/bench_decode.py [--items 1000] [--repeat 20]
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'layers', 'common', 'python'))
+from pricing_common.dynamodb_decode import ItemDecoder
+
+PRICE_COLUMNS = (
+    'regularFuelPrice', 'midFuelPrice', 'premiumFuelPrice',
+    'ZenithFuelRegularFuelPrice', 'ZenithFuelMidFuelPrice', 'ZenithFuelPremiumFuelPrice',
+    'HorizonEnergyRegularFuelPrice', 'HorizonEnergyMidFuelPrice', 'HorizonEnergyPremiumFuelPrice',
+    'MeridianPetrolRegularFuelPrice', 'MeridianPetrolMidFuelPrice', 'MeridianPetrolPremiumFuelPrice',
+)
+
+
+def make_typed_items(count):
+    """Build items the way the low-level client returns them."""
+    start = 1721822400
+    items = []
+    for index in range(count):
+        item = {
+            'station': {'S': f"Station {index % 50 + 1}"},
+            'city': {'S': 'Houston'},
+            'state': {'S': 'TX'},
+            'timestamp': {'N': str(start + (index // 50) * 86400)},
+            'expirationtime': {'N': str(start + (index // 50) * 86400 + 30 * 86400)},
+            'trafficEvents': {'S': 'Accident on I-45 causing delays'},
+            'weatherCondition': {'S': 'Thunderstorms'},
+            'volumeOfGasSold': {'N': str(3800 + index % 1000)},
+        }
+        for column_index, column in enumerate(PRICE_COLUMNS):
+            item[column] = {'N': f"{3.40 + (index + column_index) % 60 / 100:.2f}"}
+        items.append(item)
+    return items
+
+
+def decode_resource_layer(items):
+    """The previous path: resource layer deserialization plus the Decimal/timestamp loop."""
+    deserializer = TypeDeserializer()
+    decoded = []
+    for typed_item in items:
+        item = {key: deserializer.deserialize(value) for key, value in typed_item.items()}
+        for key, value in item.items():
+            if isinstance(value, Decimal):
+                item[key] = float(value)
+            if key == 'timestamp':
+                item[key] = datetime.fromtimestamp(item[key]).strftime("%Y-%m-%d %H:%M:%S")
+        decoded.append(item)
+    return decoded
+
+
+def decode_typed(items):
+    return ItemDecoder().decode_items(items)
+
+
+def measure(function, items, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(items)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    items = make_typed_items(args.items)
+    assert decode_resource_layer(items) == decode_typed(items), "decoders disagree"
+
+    before = measure(decode_resource_layer, items, args.repeat)
+    after = measure(decode_typed, items, args.repeat)
+    print(f"items: {args.items}, best of {args.repeat} runs")
+    print(f"resource layer + Decimal loop: {before:8.2f} us/item")
+    print(f"typed decoder:                 {after:8.2f} us/item")
+    print(f"speedup:                       {before / after:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+"""Benchmark of the bedrock_async websocket handler for every message type.
+
+Drives lambda_function.lambda_handler with synthetic websocket events. DynamoDB, S3,
+the API Gateway management API and Bedrock are replaced by the in-process stand-ins of
+aws_stand_ins, with injected latency per service. Reports p50/p95/p99 latency, the
+downstream calls per invocation and the peak Python memory per message type.
+
+Usage:
+    python benchmarks/bench_handlers.py [--iterations 20] [--types stations,prompt]
+        [--latency dynamodb=4,bedrock-runtime=150] [--stations 50] [--days 60]
+        [--history 10] [--json results.json]
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import warnings
+import tracemalloc
+import contextlib
+from datetime import datetime, timedelta, timezone
+
+LAMBDAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(LAMBDAS_DIR, 'benchmarks'))
+sys.path.insert(0, os.path.join(LAMBDAS_DIR, 'layers', 'common', 'python'))
+sys.path.insert(0, os.path.join(LAMBDAS_DIR, 'bedrock_async'))
+
+from aws_stand_ins import StandIns, DEFAULT_LATENCY_MS
+
+TABLE_NAMES = {
+    'FUEL_PRICES_TABLE': 'bench-prices',
+    'FUEL_STATIONS_TABLE': 'bench-stations',
+    'AI_RECOMMENDATION_TABLE': 'bench-ai-recommendations',
+    'PRICE_ROLLUPS_TABLE': 'bench-price-rollups',
+    'DYNAMODB_TABLE': 'bench-conversations',
+    'CONVERSATION_TURNS_TABLE': 'bench-conversation-turns',
+    'CACHE_TABLE': 'bench-cache',
+}
+
+ENVIRONMENT = {
+    **TABLE_NAMES,
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'REGION': 'us-east-1',
+    'CONVERSATION_HISTORY_BUCKET': 'bench-history',
+    'HISTORY_STORAGE_MODE': 'turns',
+    'WEBSOCKET_API_ENDPOINT': 'wss://bench.example.com',
+    'FLOW_ALIAS_IDENTIFIER': 'bench-flow-alias',
+    'FLOW_IDENTIFIER': 'bench-flow',
+    'USER_POOL_ID': 'bench-pool',
+    'USER_POOL_CLIENT_ID': 'bench-client',
+    'KNOWLEDGE_BASE_ID': 'bench-kb',
+    'DOC_DOMAIN': 'docs.example.com',
+    'SELECTED_MODEL_ID': 'bench-model',
+    'POWERTOOLS_SERVICE_NAME': 'BEDROCK_ASYNC_BENCHMARK',
+    'POWERTOOLS_METRICS_NAMESPACE': 'Benchmark',
+    'POWERTOOLS_TRACE_DISABLED': 'true',
+    'POWERTOOLS_LOG_LEVEL': 'WARNING',
+}
+
+PRICE_COLUMNS = (
+    'regularFuelPrice', 'midFuelPrice', 'premiumFuelPrice',
+    'ZenithFuelRegularFuelPrice', 'ZenithFuelMidFuelPrice', 'ZenithFuelPremiumFuelPrice',
+    'HorizonEnergyRegularFuelPrice', 'HorizonEnergyMidFuelPrice', 'HorizonEnergyPremiumFuelPrice',
+    'MeridianPetrolRegularFuelPrice', 'MeridianPetrolMidFuelPrice', 'MeridianPetrolPremiumFuelPrice',
+)
+
+CONNECTION_ID = 'bench-connection'
+SESSION_ID = 'bench-session'
+
+
+class LambdaContext:
+    function_name = 'bench-bedrock-async'
+    memory_limit_in_mb = 1024
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:bench-bedrock-async'
+    aws_request_id = 'bench-request'
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+def station_name(index):
+    return f"Station {index + 1}"
+
+
+def seed_data(stand_ins, stations, days, history):
+    """Fill the DynamoDB stand-in with stations, prices, recommendations, rollups and a session."""
+    from pricing_common.price_rollups import aggregate_rollups, bucket_to_item
+
+    dynamodb = stand_ins['dynamodb']
+    today = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+    for index in range(stations):
+        name = station_name(index)
+        dynamodb.seed(TABLE_NAMES['FUEL_STATIONS_TABLE'], [{
+            'station': {'S': name},
+            'id': {'N': str(index + 1)},
+            'address': {'S': f"{100 + index} Oak Street, Amarillo, TX 79101"},
+            'city': {'S': 'Amarillo, TX'},
+            'state': {'S': 'In Service'},
+            'fuelPumps': {'N': str(8 + index % 8)},
+            'parkingSpaces': {'N': '30'},
+            'accessToMajorRoads': {'BOOL': True},
+            'hoursOfOperation': {'S': '24 hours'},
+        }])
+
+        records = []
+        for day in range(days):
+            timestamp = int((today - timedelta(days=day)).timestamp())
+            record = {'station': name, 'timestamp': timestamp, 'volumeOfGasSold': 4000 + (index * 37 + day * 11) % 1500}
+            for column_index, column in enumerate(PRICE_COLUMNS):
+                record[column] = round(3.2 + (index + day + column_index) % 40 / 100, 2)
+            records.append(record)
+        dynamodb.seed(TABLE_NAMES['FUEL_PRICES_TABLE'], [
+            {
+                **{name_: {'N': str(value)} for name_, value in record.items() if name_ != 'station'},
+                'station': {'S': name},
+                'city': {'S': 'Amarillo'},
+                'state': {'S': 'TX'},
+                'trafficEvents': {'S': 'No major events'},
+                'weatherCondition': {'S': 'Clear'},
+                'expirationtime': {'N': str(record['timestamp'] + 30 * 86400)},
+            }
+            for record in records
+        ])
+        dynamodb.seed(TABLE_NAMES['PRICE_ROLLUPS_TABLE'], [
+            bucket_to_item(key, bucket, 1) for key, bucket in aggregate_rollups(name, records).items()
+        ])
+        dynamodb.seed(TABLE_NAMES['AI_RECOMMENDATION_TABLE'], [{
+            'station': {'S': name},
+            'timestamp': {'N': str(int(today.timestamp()))},
+            'expirationtime': {'N': str(int(today.timestamp()) + 30 * 86400)},
+            'message': {'S': "Hold regular prices, competitors are within three cents. " * 10},
+        }])
+
+    reset_session(stand_ins, history)
+
+
+def reset_session(stand_ins, history):
+    """Replace the benchmark session with history messages of alternating roles."""
+    from utils import history_codec
+
+    dynamodb = stand_ins['dynamodb']
+    dynamodb.clear(TABLE_NAMES['CONVERSATION_TURNS_TABLE'], SESSION_ID)
+    dynamodb.clear(TABLE_NAMES['DYNAMODB_TABLE'], SESSION_ID)
+    turns = []
+    for seq in range(1, history + 1):
+        role = 'user' if seq % 2 else 'assistant'
+        text = "What should the regular price be tomorrow?" if role == 'user' else "Keep it at $3.45. " * 20
+        turns.append({
+            'session_id': {'S': SESSION_ID},
+            'seq': {'N': str(seq)},
+            'role': {'S': role},
+            **history_codec.to_attributes([{'text': text}], 'content'),
+        })
+    dynamodb.seed(TABLE_NAMES['CONVERSATION_TURNS_TABLE'], turns)
+    dynamodb.seed(TABLE_NAMES['DYNAMODB_TABLE'], [{'session_id': {'S': SESSION_ID}, 'message_count': {'N': str(history)}}])
+
+
+def make_scenarios(stand_ins, args):
+    """Return (name, request body, setup) per message type. setup runs untimed before each run."""
+    from utils import chat_history_util
+
+    now = int(time.time())
+
+    def reset_history():
+        reset_session(stand_ins, args.history)
+
+    def clear_estimate_cache():
+        chat_history_util.price_estimate_cache.local_cache.clear()
+        stand_ins['dynamodb'].clear(TABLE_NAMES['CACHE_TABLE'])
+
+    estimate_prompt = json.dumps({'prompttype': 'priceestimate', 'station': station_name(0)})
+    dashboard_stations = [station_name(index) for index in range(min(args.stations, 20))]
+    return [
+        ('stations', {'type': 'stations'}, None),
+        ('stations_page', {'type': 'stations', 'page_size': 20}, None),
+        ('station_detail', {'type': 'station_detail', 'station': station_name(0)}, None),
+        ('fuel_prices', {'type': 'fuel_prices', 'station': station_name(0)}, None),
+        ('historical_fuel_prices', {'type': 'historical_fuel_prices', 'station': station_name(0)}, None),
+        ('historical_daily', {'type': 'historical_fuel_prices', 'station': station_name(0),
+                              'start': now - 30 * 86400, 'resolution': 'daily'}, None),
+        ('historical_raw_range', {'type': 'historical_fuel_prices', 'station': station_name(0),
+                                  'start': now - 3000 * 86400}, None),
+        ('ai_recommendation', {'type': 'ai_recommendation', 'station': station_name(0)}, None),
+        ('dashboard', {'type': 'dashboard', 'stations': dashboard_stations}, None),
+        ('price_rollup', {'type': 'price_rollup', 'station': station_name(0), 'resolution': 'weekly'}, None),
+        ('load', {'type': 'load', 'session_id': SESSION_ID}, None),
+        ('clear_conversation', {'type': 'clear_conversation', 'session_id': SESSION_ID}, reset_history),
+        ('price_estimate', {'type': 'price_estimate', 'prompt': estimate_prompt, 'session_id': SESSION_ID}, None),
+        ('price_estimate_uncached', {'type': 'price_estimate', 'prompt': estimate_prompt, 'session_id': SESSION_ID}, clear_estimate_cache),
+        ('prompt', {'type': 'prompt', 'prompt': 'How should I price regular fuel this week?', 'session_id': SESSION_ID}, reset_history),
+    ]
+
+
+def make_event(body):
+    return {
+        'body': json.dumps(body),
+        'requestContext': {'eventType': 'MESSAGE', 'connectionId': CONNECTION_ID},
+    }
+
+
+def invoke(handler, event, context):
+    # The metrics of every invocation are printed as EMF, keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return handler(event, context)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def run_scenario(stand_ins, handler, name, body, setup, iterations):
+    context = LambdaContext()
+    event = make_event(body)
+    api_gateway = stand_ins['apigatewaymanagementapi']
+
+    # Warm up once, like a warm container
+    if setup:
+        setup()
+    invoke(handler, event, context)
+
+    latencies = []
+    errors = 0
+    stand_ins.recorder.reset()
+    error_frames = api_gateway.error_frames
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        response = invoke(handler, event, context)
+        latencies.append((time.perf_counter() - start) * 1000)
+        errors += response.get('statusCode') != 200
+    counts, bytes_sent = stand_ins.recorder.snapshot()
+    errors += api_gateway.error_frames - error_frames
+
+    # Peak memory is measured on a separate run, tracing allocations slows everything down
+    if setup:
+        setup()
+    tracemalloc.start()
+    invoke(handler, event, context)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'type': name,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'calls_per_invocation': sum(counts.values()) / iterations,
+        'calls': {operation: count / iterations for operation, count in sorted(counts.items())},
+        'bytes_sent_per_invocation': bytes_sent / iterations,
+        'peak_memory_kib': peak / 1024,
+        'errors': errors,
+    }
+
+
+def parse_latency(value):
+    latency = {}
+    for setting in filter(None, (value or '').split(',')):
+        service, milliseconds = setting.split('=')
+        if service not in DEFAULT_LATENCY_MS:
+            raise SystemExit(f"Unknown service {service}, expected one of {', '.join(DEFAULT_LATENCY_MS)}")
+        latency[service] = float(milliseconds)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--types', help='Comma separated message types, all if omitted')
+    parser.add_argument('--latency', help='Latency per service in ms, e.g. dynamodb=4,bedrock-runtime=150')
+    parser.add_argument('--stations', type=int, default=50)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--history', type=int, default=10, help='Messages in the benchmark session')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    os.environ.update(ENVIRONMENT)
+    # Message types that publish no metric of their own make powertools warn on every invocation
+    warnings.filterwarnings('ignore', message='No application metrics to publish')
+    stand_ins = StandIns(parse_latency(args.latency), TABLE_NAMES)
+    stand_ins.install()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from lambda_function import lambda_handler
+    seed_data(stand_ins, args.stations, args.days, args.history)
+
+    scenarios = make_scenarios(stand_ins, args)
+    if args.types:
+        selected = set(args.types.split(','))
+        scenarios = [scenario for scenario in scenarios if scenario[0] in selected]
+
+    results = [run_scenario(stand_ins, lambda_handler, *scenario, args.iterations) for scenario in scenarios]
+
+    print(f"iterations: {args.iterations}, stations: {args.stations}, days: {args.days}, "
+          f"latency ms: {json.dumps({**DEFAULT_LATENCY_MS, **parse_latency(args.latency)})}")
+    print(f"{'type':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'calls':>8}{'peak KiB':>10}{'errors':>8}")
+    for result in results:
+        print(f"{result['type']:<26}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+              f"{result['calls_per_invocation']:>8.1f}{result['peak_memory_kib']:>10.0f}{result['errors']:>8}")
+    print()
+    print("calls per invocation")
+    for result in results:
+        calls = ', '.join(f"{operation}={count:g}" for operation, count in result['calls'].items())
+        print(f"  {result['type']:<24}{calls}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+from datetime import datetime, timedelta
+from botocore.exceptions import ClientError
+from fuel_station_prices import (
+    table, load_json_from_file, stream_price_records, filter_new_records, update_price_rollups
+)
+from batch_writer import prepare_items, write_items
+from rate_limiter import LIMITED_CLIENT_MAX_ATTEMPTS
+from pricing_common.aws_clients import create_client, create_resource
+
+# Set up the checkpoint table, one item per backfill job
+dynamodb = create_resource('dynamodb')
+checkpoint_table_name = os.environ.get('DYNAMODB_CHECKPOINTS_TABLE_NAME')
+
+# Days generated per model call, the response of larger chunks gets truncated
+DEFAULT_CHUNK_DAYS = 5
+MAX_CHUNK_DAYS = 10
+# Time kept free at the end of an invocation to save the checkpoint and reinvoke
+DEADLINE_MARGIN_MILLIS = int(os.environ.get('BACKFILL_DEADLINE_MARGIN_SECONDS', 60)) * 1000
+# Expected duration of a chunk until one was measured, a model call with retries
+INITIAL_CHUNK_ESTIMATE_MILLIS = 60000
+# Finished and abandoned checkpoints are removed after this many days
+CHECKPOINT_TTL_DAYS = 30
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+class CheckpointConflict(Exception):
+    """Raised when another invocation advanced the checkpoint of the same job."""
+
+
+def create_checkpoint(event):
+    """Creates the checkpoint of a new backfill job from the invocation event.
+
+    Args:
+        event (dict): {"job_id", "start": "YYYY-MM-DD", "end": "YYYY-MM-DD" (default today),
+            "stations": [names] (default all), "chunk_days", "ttl_days", "reinvoke"}
+
+    Returns:
+        dict: The checkpoint, with the cursor on the start date of the first station.
+    """
+    start = datetime.strptime(event['start'], DATE_FORMAT)
+    end = datetime.strptime(event['end'], DATE_FORMAT) if event.get('end') else datetime.now()
+    end = end.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    station_names = event.get('stations') or [station["station"] for station in load_json_from_file("stations.json") or []]
+
+    return {
+        'job_id': event['job_id'],
+        'status': 'running',
+        'stations': station_names,
+        'station_index': 0,
+        'start': int(start.timestamp()),
+        'end': int(end.timestamp()),
+        'cursor': int(start.timestamp()),
+        'chunk_days': min(int(event.get('chunk_days', DEFAULT_CHUNK_DAYS)), MAX_CHUNK_DAYS),
+        'ttl_days': event.get('ttl_days'),
+        'reinvoke': event.get('reinvoke', True),
+        'records': 0,
+        'invocations': 0,
+        'version': 0,
+    }
+
+
+def load_checkpoint(job_id):
+    response = dynamodb.Table(checkpoint_table_name).get_item(Key={'job_id': job_id}, ConsistentRead=True)
+    return response.get('Item')
+
+
+def save_checkpoint(checkpoint):
+    """Writes the checkpoint if nobody else advanced it since it was read.
+
+    Raises:
+        CheckpointConflict: The job is running in another invocation.
+    """
+    expected_version = checkpoint['version']
+    checkpoint['version'] = expected_version + 1
+    checkpoint['expirationtime'] = int((datetime.now() + timedelta(days=CHECKPOINT_TTL_DAYS)).timestamp())
+
+    condition = {'ConditionExpression': 'attribute_not_exists(job_id)'}
+    if expected_version:
+        condition = {
+            'ConditionExpression': '#version = :version',
+            'ExpressionAttributeNames': {'#version': 'version'},
+            'ExpressionAttributeValues': {':version': expected_version},
+        }
+    try:
+        dynamodb.Table(checkpoint_table_name).put_item(Item=checkpoint, **condition)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise CheckpointConflict(f"Backfill job {checkpoint['job_id']} was advanced by another invocation")
+        raise
+
+
+def generate_chunk(client, model_id, station, chunk_start, chunk_end, ttl_days):
+    """Generates and writes the records of one station in [chunk_start, chunk_end).
+
+    Records the model returns outside of the chunk are dropped, so chunks never overlap.
+    Rewriting a chunk after a failure overwrites the same keys, only records that were not
+    stored before are added to the rollups.
+
+    Returns:
+        int: The number of records written.
+    """
+    days = (chunk_end - chunk_start) // 86400
+    last_day = datetime.fromtimestamp(chunk_end - 86400)
+    generated_records = list(stream_price_records(client, model_id, station, days, last_day))
+
+    records = [
+        record for record in prepare_items(generated_records, ttl_days=ttl_days)
+        if chunk_start <= record['timestamp'] < chunk_end
+    ]
+    new_records = filter_new_records(station['station'], records)
+    written = write_items(table, records)['written']
+    update_price_rollups(station['station'], new_records)
+    return written
+
+
+def reinvoke(context, job_id):
+    """Invokes this function asynchronously to continue the job."""
+    create_client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({'action': 'backfill', 'job_id': job_id})
+    )
+
+
+def run_backfill(event, context):
+    """Backfills price data for a date range, resuming from the checkpoint of the job.
+
+    The range is generated station by station in chunks of a few days. Before each chunk
+    the remaining invocation time is compared with the slowest chunk so far. When it does
+    not fit, the checkpoint is saved and, unless disabled, the function reinvokes itself.
+    The checkpoint is saved after every chunk, so at most one chunk is regenerated after a
+    crash. The records of every chunk are added to the rollups, a regenerated chunk only
+    adds the records that were not stored before.
+
+    Args:
+        event (dict): {"action": "backfill", "job_id": ..., ...}, see create_checkpoint.
+            Only the job_id is needed to resume.
+        context: Lambda context, for the remaining time and the function ARN.
+
+    Returns:
+        dict: Response with the status of the job.
+    """
+    if not checkpoint_table_name:
+        return {'statusCode': 400, 'body': "DYNAMODB_CHECKPOINTS_TABLE_NAME is not configured"}
+
+    job_id = event.get('job_id')
+    if not job_id:
+        return {'statusCode': 400, 'body': "job_id is required"}
+
+    checkpoint = load_checkpoint(job_id)
+    if checkpoint is None:
+        if not event.get('start'):
+            return {'statusCode': 404, 'body': f"No backfill job {job_id}, start is required to create it"}
+        checkpoint = create_checkpoint(event)
+
+    if checkpoint['status'] == 'completed':
+        return {'statusCode': 200, 'body': json.dumps({'job_id': job_id, 'status': 'completed', 'records': int(checkpoint['records'])})}
+
+    # Throttled and transiently failed calls are retried by the rate limiter of stream_price_records
+    client = create_client("bedrock-runtime", max_attempts=LIMITED_CLIENT_MAX_ATTEMPTS)
+    model_id = os.environ['MODEL_ID']
+    stations = {station["station"]: station for station in load_json_from_file("stations.json") or []}
+    ttl_days = int(checkpoint['ttl_days']) if checkpoint.get('ttl_days') else None
+    chunk_seconds = int(checkpoint['chunk_days']) * 86400
+    slowest_chunk_millis = None
+
+    checkpoint['invocations'] = int(checkpoint['invocations']) + 1
+    try:
+        save_checkpoint(checkpoint)
+
+        while int(checkpoint['station_index']) < len(checkpoint['stations']):
+            station_name = checkpoint['stations'][int(checkpoint['station_index'])]
+            cursor = int(checkpoint['cursor'])
+
+            if cursor >= int(checkpoint['end']):
+                checkpoint['station_index'] = int(checkpoint['station_index']) + 1
+                checkpoint['cursor'] = int(checkpoint['start'])
+                save_checkpoint(checkpoint)
+                continue
+
+            chunk_estimate_millis = slowest_chunk_millis or INITIAL_CHUNK_ESTIMATE_MILLIS
+            if context.get_remaining_time_in_millis() < DEADLINE_MARGIN_MILLIS + chunk_estimate_millis:
+                print(f"Backfill job {job_id} paused at {station_name} {datetime.fromtimestamp(cursor).strftime(DATE_FORMAT)}")
+                if checkpoint.get('reinvoke'):
+                    reinvoke(context, job_id)
+                return {'statusCode': 202, 'body': json.dumps({
+                    'job_id': job_id,
+                    'status': 'running',
+                    'station': station_name,
+                    'cursor': datetime.fromtimestamp(cursor).strftime(DATE_FORMAT),
+                    'records': int(checkpoint['records'])
+                })}
+
+            chunk_end = min(cursor + chunk_seconds, int(checkpoint['end']))
+            started = time.time()
+            written = generate_chunk(client, model_id, stations.get(station_name, {'station': station_name, 'city': ''}), cursor, chunk_end, ttl_days)
+            slowest_chunk_millis = max(slowest_chunk_millis or 0, int((time.time() - started) * 1000))
+
+            checkpoint['cursor'] = chunk_end
+            checkpoint['records'] = int(checkpoint['records']) + written
+            save_checkpoint(checkpoint)
+
+    except CheckpointConflict as e:
+        print(f"Stopping backfill: {e}")
+        return {'statusCode': 409, 'body': str(e)}
+
+    checkpoint['status'] = 'completed'
+    save_checkpoint(checkpoint)
+    print(f"Backfill job {job_id} completed with {checkpoint['records']} records.")
+    return {'statusCode': 200, 'body': json.dumps({'job_id': job_id, 'status': 'completed', 'records': int(checkpoint['records'])})}
@@ -0,0 +1,161 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+# BatchWriteItem accepts at most 25 put requests per call
+MAX_BATCH_SIZE = 25
+MAX_RETRIES = 8
+BASE_BACKOFF_SECONDS = 0.05
+MAX_BACKOFF_SECONDS = 5
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def prepare_items(items, ttl_days=None):
+    """Converts a batch of JSON items into DynamoDB ready items.
+
+    Floats are converted to Decimal and 'YYYY-MM-DDTHH:MM:SS' timestamps to epoch seconds.
+    When ttl_days is set an 'expirationtime' attribute is derived from the timestamp.
+
+    Args:
+        items (list): JSON items as dictionaries.
+        ttl_days (int): Number of days after the timestamp the item expires.
+
+    Returns:
+        list: Converted items. Items with an invalid timestamp are dropped.
+    """
+    prepared = []
+    for item_data in items:
+        item = {}
+        for key, value in item_data.items():
+            item[key] = Decimal(str(value)) if isinstance(value, float) else value
+
+        if isinstance(item.get('timestamp'), str):
+            try:
+                datetime_obj = datetime.strptime(item['timestamp'], TIMESTAMP_FORMAT)
+            except ValueError:
+                print(f"Error: Invalid timestamp format '{item['timestamp']}'. Please use 'YYYY-MM-DDTHH:MM:SS'.")
+                continue
+            item['timestamp'] = int(datetime_obj.timestamp())
+            if ttl_days:
+                item['expirationtime'] = int((datetime_obj + timedelta(days=ttl_days)).timestamp())
+
+        prepared.append(item)
+    return prepared
+
+
+def write_items(dynamo_table, items, ttl_days=None, key_names=('station', 'timestamp')):
+    """Writes items to a DynamoDB table with BatchWriteItem.
+
+    Items are converted once per batch, de-duplicated on their key (a batch may not contain
+    the same key twice) and written 25 at a time. UnprocessedItems are retried with
+    exponential backoff.
+
+    Args:
+        dynamo_table: DynamoDB Table resource to write to.
+        items (list): JSON items as dictionaries.
+        ttl_days (int): Number of days after the timestamp the item expires.
+        key_names (tuple): Key attributes of the table.
+
+    Returns:
+        dict: Number of items written and number of items left unprocessed.
+    """
+    client = dynamo_table.meta.client
+    table_name = dynamo_table.name
+    written = 0
+    unprocessed = 0
+
+    for start in range(0, len(items), MAX_BATCH_SIZE):
+        batch = prepare_items(items[start:start + MAX_BATCH_SIZE], ttl_days)
+        unique_items = {tuple(item.get(key) for key in key_names): item for item in batch}
+        requests = [{'PutRequest': {'Item': item}} for item in unique_items.values()]
+
+        remaining = _write_batch(client, table_name, requests)
+        written += len(requests) - len(remaining)
+        unprocessed += len(remaining)
+
+    if unprocessed:
+        print(f"Error: {unprocessed} items could not be written to {table_name}.")
+
+    return {'written': written, 'unprocessed': unprocessed}
+
+
+def _write_batch(client, table_name, requests):
+    """Sends one batch and retries its UnprocessedItems, returning what is still unprocessed."""
+    attempt = 0
+    while requests:
+        response = client.batch_write_item(RequestItems={table_name: requests})
+        requests = response.get('UnprocessedItems', {}).get(table_name, [])
+        if not requests or attempt >= MAX_RETRIES:
+            break
+
+        # Full jitter exponential backoff before retrying the throttled items
+        backoff = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt))
+        time.sleep(random.uniform(0, backoff))
+        attempt += 1
+
+    return requests
+
+
+class QueuedWriter:
+    """Writes items in the background while the caller keeps producing them.
+
+    Items put while a write is in flight are collected and sent together in the next
+    write, so batches grow with the backlog instead of waiting for a fixed size.
+    """
+
+    def __init__(self, dynamo_table, ttl_days=None, key_names=('station', 'timestamp')):
+        self.dynamo_table = dynamo_table
+        self.ttl_days = ttl_days
+        self.key_names = key_names
+        self.written = 0
+        self.unprocessed = 0
+        self._pending = []
+        self._writing = False
+        self._error = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def put(self, item):
+        """Queues an item and starts a write unless one is in flight."""
+        with self._lock:
+            self._pending.append(item)
+            if self._writing:
+                return
+            self._writing = True
+        self._executor.submit(self._drain)
+
+    def close(self):
+        """Waits for the queued items to be written.
+
+        Returns:
+            dict: Number of items written and number of items left unprocessed.
+
+        Raises:
+            Exception: The first error raised by a write.
+        """
+        self._executor.shutdown(wait=True)
+        if self._error:
+            raise self._error
+        return {'written': self.written, 'unprocessed': self.unprocessed}
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+                if not batch or self._error:
+                    self._writing = False
+                    return
+            try:
+                result = write_items(self.dynamo_table, batch, self.ttl_days, self.key_names)
+            except Exception as e:
+                with self._lock:
+                    self._error = e
+                    self._writing = False
+                return
+            self.written += result['written']
+            self.unprocessed += result['unprocessed']
@@ -1,23 +1,47 @@
 import os
 import json
-from datetime import datetime, timedelta
-from decimal import Decimal
 import time
+from datetime import datetime, timedelta
 import os
 import json
-import boto3
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key
-import strip_markdown
+from pricing_common.price_rollups import apply_rollups, rebuild_rollups
+from pricing_common.aws_clients import create_client, create_resource, MAX_POOL_CONNECTIONS
+from batch_writer import prepare_items, write_items, QueuedWriter, MAX_BATCH_SIZE
+from record_stream import parse_records
+from rate_limiter import AdaptiveRateLimiter, LIMITED_CLIENT_MAX_ATTEMPTS
 
 # Set up the DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+dynamodb = create_resource('dynamodb')
 table_name = os.environ['DYNAMODB_PRICES_TABLE_NAME']
 table = dynamodb.Table(table_name)
 
 ai_table_name = os.environ['DYNAMODB_AI_RECOMMENDATIONS_TABLE_NAME']
 ai_table = dynamodb.Table(ai_table_name)
 
+# Daily, weekly and monthly aggregates, updated with every generated batch
+rollups_table_name = os.environ.get('DYNAMODB_ROLLUPS_TABLE_NAME')
+dynamodb_client = create_client('dynamodb')
+
+# Days after their timestamp the price records of the daily generation expire. Rollup
+# rebuilds only recompute the buckets that are still complete in the price table.
+PRICE_TTL_DAYS = int(os.environ.get('PRICE_TTL_DAYS', 30))
+
+SYSTEM_PROMPT = "You create synthetic data in JSON for gas stations. Must be in JSON format as show in example. Output only plain text. Do not output markdown."
+
+# Number of stations generated in parallel
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Records the NumPy generator queues for writing at most, bounding the memory of pending writes
+NUMPY_MAX_PENDING_RECORDS = int(os.environ.get('NUMPY_MAX_PENDING_RECORDS', 50000))
+# Time left for the pending writes when the NumPy generator stops before the Lambda timeout
+NUMPY_DEADLINE_MARGIN_MILLIS = int(os.environ.get('NUMPY_DEADLINE_MARGIN_SECONDS', 60)) * 1000
+
+# Client side rate limiters, shared by all worker threads, adapting to the Bedrock quotas
+model_rate_limiter = AdaptiveRateLimiter('InvokeModel')
+flow_rate_limiter = AdaptiveRateLimiter('InvokeFlow', initial_rate=0.5)
+
 def load_json_from_file(file_path):
     try:
         with open(file_path, 'r') as file:
@@ -31,242 +55,582 @@ def load_json_from_file(file_path):
         return None
         
 def get_last_record_timestamp(stationName):
-    # Query with reverse order (to get the latest first) and limit of 1
+    # Query with reverse order (to get the latest first) and limit of 1. The low-level client
+    # is used because the worker threads share it, boto3 resources are not thread safe.
     try:
-        response = table.query(
-        KeyConditionExpression=Key('station').eq(stationName),
-        ScanIndexForward=False,  
+        response = dynamodb_client.query(
+        TableName=table_name,
+        KeyConditionExpression='station = :station',
+        ExpressionAttributeValues={':station': {'S': stationName}},
+        ExpressionAttributeNames={'#timestamp': 'timestamp'},
+        ProjectionExpression='#timestamp',
+        ScanIndexForward=False,
         Limit=1)
 
         items = response.get('Items')
-        return items[0]["timestamp"] if items else None  # Return the first (latest) item or None
+        return int(float(items[0]["timestamp"]["N"])) if items else None  # Return the first (latest) item or None
     except:
         return None
         
 def get_last_record(stationName):
-    # Query with reverse order (to get the latest first) and limit of 1
+    return get_last_record_timestamp(stationName)
+
+def build_price_prompt(station, days, date):
+    """Builds the prompt asking the model for daily price records of one station.
+
+    Args:
+        station (dict): Station entry from stations.json.
+        days (int): Number of days to generate, ending on date.
+        date (datetime): The last day to generate, given to the model as the current date.
+
+    Returns:
+        str: The prompt.
+    """
+    # Define the prompt for the model.
+    prompt = "Can you generate data for a gas station called {station} with this location {city}? The data needs to include traffic events, weather conditions, regular fuel price, mid fuel price, premium fuel price, and volume of gas sold at this gas station for today to the last {days} days? We also need competing prices at gas stations nearby. The gas station names are (ZenithFuel, HorizonEnergy, and MeridianPetrol). Make sure you consider real historical data for this city when making the synthetic data. Traffic conditions should correlate with weather and also be reflected in prices. For example, more road closures or accident with bad weather may require increasing prices. Provide this data in json format. The current date is {date}. Needs to be a record once a day. Only a json response is allowed, no other text that would make it invalid".format(station=station["station"], city=station["city"] ,days=days, date=date.strftime('%B %d, %Y'))
+    prompt = prompt + """
+                Format:
+
+                {"stationData": [
+                    {
+                    "station": "Station 1",
+                    "city": "Houston",
+                    "state": "TX",
+                    "timestamp": "2024-07-24T12:00:00",
+                    "trafficEvents": "No major events",
+                    "weatherCondition": "Clear",
+                    "regularFuelPrice": 3.45,
+                    "midFuelPrice": 3.59,
+                    "premiumFuelPrice": 3.75,
+                    "volumeOfGasSold": 5200,
+                    "ZenithFuelRegularFuelPrice": 3.42,
+                    "ZenithFuelMidFuelPrice": 3.58,
+                    "ZenithFuelPremiumFuelPrice": 3.74,
+                    "HorizonEnergyRegularFuelPrice": 3.46,
+                    "HorizonEnergyMidFuelPrice": 3.61,
+                    "HorizonEnergyPremiumFuelPrice": 3.77,
+                    "MeridianPetrolRegularFuelPrice": 3.40,
+                    "MeridianPetrolMidFuelPrice": 3.55,
+                    "MeridianPetrolPremiumFuelPrice": 3.72
+                    },
+                    {
+                    "station": "Station 1",
+                    "city": "Houston",
+                    "state": "TX",
+                    "timestamp": "2024-07-25T12:00:00",
+                    "trafficEvents": "Accident on I-45 causing delays",
+                    "weatherCondition": "Thunderstorms",
+                    "regularFuelPrice": 3.75,
+                    "midFuelPrice": 3.89,
+                    "premiumFuelPrice": 4.15,
+                    "volumeOfGasSold": 3800,
+                    "ZenithFuelRegularFuelPrice": 3.72,
+                    "ZenithFuelMidFuelPrice": 3.87,
+                    "ZenithFuelPremiumFuelPrice": 4.00,
+                    "HorizonEnergyRegularFuelPrice": 3.72,
+                    "HorizonEnergyMidFuelPrice": 3.87,
+                    "HorizonEnergyPremiumFuelPrice": 4.00,
+                    "MeridianPetrolRegularFuelPrice": 3.72,
+                    "MeridianPetrolMidFuelPrice": 3.87,
+                    "MeridianPetrolPremiumFuelPrice": 4.00
+                    },    
+                  ]
+                }"""
+
+    return prompt
+
+
+def stream_price_records(client, model_id, station, days, date):
+    """Streams the model output and yields the price records as they complete.
+
+    Records are parsed and validated one by one from the text deltas, so a malformed
+    record or a truncated response only loses the records it affects. A throttle or a
+    transient error raised inside the stream is handled by the rate limiter and restarts
+    the stream, records with a timestamp that was already yielded are skipped.
+
+    Args:
+        client: Bedrock Runtime client used to invoke the model.
+        model_id (str): The model used to generate the data.
+        station (dict): Station entry from stations.json.
+        days (int): Number of days to generate, ending on date.
+        date (datetime): The last day to generate, given to the model as the current date.
+
+    Yields:
+        dict: Validated records, with 'YYYY-MM-DDTHH:MM:SS' timestamps.
+    """
+    def text_deltas(response):
+        for event in response["stream"]:
+            if "contentBlockDelta" in event:
+                yield event["contentBlockDelta"]["delta"].get("text", "")
+            elif "messageStop" in event and event["messageStop"].get("stopReason") == "max_tokens":
+                print(f"Output for {station['station']} was truncated, keeping the complete records.")
+
+    timestamps = set()
+    for attempt in range(model_rate_limiter.max_retries + 1):
+        # Start the stream, pacing calls to the account quota.
+        response = model_rate_limiter.call(
+            client.converse_stream,
+            modelId=model_id,
+            messages=[{"role": "user", "content": [{"text": build_price_prompt(station, days, date)}]}],
+            system=[{"text": SYSTEM_PROMPT}],
+            inferenceConfig={"maxTokens": 4096, "topP": 0.9, "temperature": 0.5},
+            additionalModelRequestFields={"inferenceConfig": {"topK": 20}}
+        )
+        try:
+            for record in parse_records(text_deltas(response), station["station"]):
+                if record["timestamp"] in timestamps:
+                    continue
+                timestamps.add(record["timestamp"])
+                yield record
+            return
+        except Exception as e:
+            # Throttles and service errors inside the stream arrive as EventStreamError, a ClientError
+            if not model_rate_limiter.should_retry(e, attempt, new_call=False):
+                raise
+            print(f"Restarting the stream for {station['station']} after {len(timestamps)} records.")
+
+
+def generate_station_prices(client, model_id, station):
+    """Generates and stores the missing days of synthetic price data for one station.
+
+    Args:
+        client: Bedrock Runtime client used to invoke the model.
+        model_id (str): The model used to generate the data.
+        station (dict): Station entry from stations.json.
+
+    Returns:
+        dict: Per-station result with status, number of records written and error (if any).
+            The status is 'partial' when the stream failed after some records were written.
+    """
+    now = datetime.now()
+    rounded_datetime = now.replace(minute=0, second=0, microsecond=0)
+
+    # Get the last record timestamp from DynamoDB
+    last_record_timestamp = get_last_record_timestamp(station["station"])
+    days_to_create = 0
+
+    if last_record_timestamp:
+        # Calculate the number of days to create based on the last record timestamp
+        last_record_date = datetime.fromtimestamp(int(last_record_timestamp))
+        days_to_create = (datetime.now() - last_record_date).days
+        if days_to_create > 5:
+            days_to_create = 5
+        print(f"Generating {days_to_create} days of historical data for {station['station']}.")
+    else:
+        # No previous records, so create data for the last 5 days
+        days_to_create = 5
+        print(f"No previous records found for {station['station']}, generating 5 days of historical data.")
+
+    if(days_to_create > 0):
+        # Queue every record for writing as soon as it is parsed, expiring them after PRICE_TTL_DAYS.
+        # Records at or before the last stored one, and repeated timestamps, would overwrite
+        # stored records and be counted twice by the rollups, so only new timestamps are kept.
+        writer = QueuedWriter(table)
+        records = []
+        timestamps = set()
+        stream_error = None
+        try:
+            for record in stream_price_records(client, model_id, station, days_to_create, rounded_datetime):
+                for item in prepare_items([record], ttl_days=PRICE_TTL_DAYS):
+                    if (last_record_timestamp and item['timestamp'] <= last_record_timestamp) or item['timestamp'] in timestamps:
+                        continue
+                    timestamps.add(item['timestamp'])
+                    records.append(item)
+                    writer.put(item)
+        except (ClientError, Exception) as e:
+            # The records queued before the stream failed are still written and rolled up
+            stream_error = e
+            print(f"ERROR: Stream for '{station['station']}' failed after {len(records)} records. Reason: {e}")
+        finally:
+            # A write error is raised here and skips the rollups, rebuild_price_rollups recovers them
+            result = writer.close()
+            update_price_rollups(station["station"], records)
+
+        if stream_error:
+            status = 'partial' if result['written'] else 'failed'
+            return {'station': station["station"], 'status': status, 'records': result['written'], 'error': str(stream_error)}
+        if not records:
+            return {'station': station["station"], 'status': 'failed', 'records': 0, 'error': 'No new valid records generated'}
+        return {'station': station["station"], 'status': 'success', 'records': result['written']}
+
+    return {'station': station["station"], 'status': 'skipped', 'records': 0}
+
+def update_price_rollups(station_name, records):
+    """Adds newly written price records to the rollups of a station.
+
+    A failure is logged and does not fail the generation, rebuild_price_rollups
+    recomputes the rollups from the price table.
+
+    Args:
+        station_name (str): The name of the station.
+        records (list): Prepared price records with epoch timestamps that were not
+            stored before, records overwriting stored ones would be counted twice.
+    """
+    if not rollups_table_name or not records:
+        return
     try:
-        response = table.query(
-        KeyConditionExpression=Key('station').eq(stationName),
-        ScanIndexForward=False,  
-        Limit=1)
+        updated = apply_rollups(dynamodb_client, rollups_table_name, station_name, records)
+        print(f"Updated {updated} rollups for {station_name}.")
+    except (ClientError, Exception) as e:
+        print(f"ERROR: Can't update rollups for '{station_name}'. Reason: {e}")
 
-        items = response.get('Items')
-        return items[0]["timestamp"] if items else None  # Return the first (latest) item or None
-    except:
-        return None
 
-def put_item(dynamo_table, item_data):
-    """Inserts a JSON item into a DynamoDB table, converting floats to Decimal.
+def filter_new_records(station_name, records):
+    """Returns the records of a station whose timestamp is not stored in the price table yet.
+
+    Must be called before the records are written. Writing a stored timestamp again
+    overwrites the record, so only the new records may be added to the rollups.
+
+    Args:
+        station_name (str): The name of the station.
+        records (list): Prepared price records with epoch timestamps.
+
+    Returns:
+        list: The new records, all records without a rollup table, none if the stored
+            timestamps could not be read.
+    """
+    if not rollups_table_name or not records:
+        return records
+    timestamps = [record['timestamp'] for record in records]
+    query_args = {
+        'TableName': table_name,
+        'KeyConditionExpression': 'station = :station AND #timestamp BETWEEN :start AND :end',
+        'ExpressionAttributeNames': {'#timestamp': 'timestamp'},
+        'ExpressionAttributeValues': {
+            ':station': {'S': station_name},
+            ':start': {'N': str(min(timestamps))},
+            ':end': {'N': str(max(timestamps))},
+        },
+        'ProjectionExpression': '#timestamp',
+    }
+    try:
+        stored = set()
+        while True:
+            response = dynamodb_client.query(**query_args)
+            stored.update(int(float(item['timestamp']['N'])) for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    except (ClientError, Exception) as e:
+        print(f"ERROR: Can't read stored records of '{station_name}', skipping its rollups. Reason: {e}")
+        return []
+    return [record for record in records if int(record['timestamp']) not in stored]
+
+
+def rebuild_price_rollups(station_name=None, ttl_days=PRICE_TTL_DAYS):
+    """Recomputes the rollups of one or all stations from the price table.
+
+    Only buckets starting inside the TTL window are rebuilt, older buckets aggregate
+    records that already expired and are kept. Buckets of the window without any
+    price record are deleted.
 
     Args:
-        table_name (str): The name of the DynamoDB table.
-        item_data (dict): The JSON item data as a dictionary.
+        station_name (str): The station to rebuild, all stations of stations.json if None.
+        ttl_days (int): Days the price records are kept, 0 or None to rebuild every bucket.
+
+    Returns:
+        dict: Response with the number of rollups written and deleted per station.
     """
-    
-    # Convert floats to Decimal
-    for key, value in item_data.items():
-        if isinstance(value, float):
-            item_data[key] = Decimal(str(value))
-    
-    # Convert timestamp string to epoch
-    if 'timestamp' in item_data and isinstance(item_data['timestamp'], str):
+    if not rollups_table_name:
+        return {
+            'statusCode': 400,
+            'body': "DYNAMODB_ROLLUPS_TABLE_NAME is not configured"
+        }
+
+    if station_name:
+        station_names = [station_name]
+    else:
+        station_names = [station["station"] for station in load_json_from_file("stations.json") or []]
+
+    # Buckets starting at or after since only hold records that have not expired
+    since = int((datetime.now() - timedelta(days=ttl_days)).timestamp()) if ttl_days else None
+
+    results = {}
+    for name in station_names:
         try:
-            # Parse the timestamp string with appropriate format
-            datetime_obj = datetime.strptime(item_data['timestamp'], "%Y-%m-%dT%H:%M:%S")
-            # Get the epoch timestamp (seconds since Unix epoch)
-            item_data['timestamp'] = int(datetime_obj.timestamp())
-            expiration_datetime = datetime_obj + timedelta(days=30)
-            item_data['expirationtime'] = int(expiration_datetime.timestamp())
-        except ValueError:
-            print(f"Error: Invalid timestamp format. Please use 'YYYY-MM-DDTHH:MM:SS'.")
-            return None  # Indicate error
-
-    response = dynamo_table.put_item(Item=item_data)
-    return response
-
-def generate_fuel_prices():
-    # Use the native inference API to send a text message to Anthropic Claude.
-    # Create a Bedrock Runtime client in the AWS Region of your choice.
-    client = boto3.client("bedrock-runtime")
+            results[name] = rebuild_rollups(dynamodb_client, table_name, rollups_table_name, name, since)
+        except (ClientError, Exception) as e:
+            print(f"ERROR: Can't rebuild rollups for '{name}'. Reason: {e}")
+            results[name] = None
+
+    failed = [name for name, result in results.items() if result is None]
+    return {
+        'statusCode': 200 if not failed else 207,
+        'body': json.dumps({'rollups': results, 'failed': failed})
+    }
+
+
+def generate_fuel_prices(max_concurrency=None):
+    """Generates synthetic price data for every station using a bounded worker pool.
+
+    Stations are processed concurrently so the total runtime is bound by the slowest
+    station rather than the sum of all stations. A failure for one station is recorded
+    in the results and does not stop the remaining stations.
+
+    Args:
+        max_concurrency (int): Maximum number of stations processed at the same time.
+            Defaults to the MAX_CONCURRENCY environment variable.
+
+    Returns:
+        dict: Response with a summary of the per-station results.
+    """
+    if max_concurrency is None:
+        max_concurrency = int(os.environ.get('MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY))
+
+    # Create a Bedrock Runtime client in the AWS Region of your choice. Throttled and failed calls are
+    # retried by the rate limiter, so the client does not retry on its own.
+    client = create_client("bedrock-runtime", max_attempts=LIMITED_CLIENT_MAX_ATTEMPTS, max_pool_connections=max(max_concurrency, MAX_POOL_CONNECTIONS))
 
     # Set the model ID, e.g., Claude 3 Haiku.
     model_id = os.environ['MODEL_ID']
-    
-    stations = load_json_from_file("stations.json")
-        
-    for station in stations:
-        
-        now = datetime.now()
-        rounded_datetime = now.replace(minute=0, second=0, microsecond=0)
-        # Convert the rounded datetime to a formatted string
-        formatted_datetime = rounded_datetime.strftime('%B %d, %Y')
-        
-        # Get the last record timestamp from DynamoDB
-        last_record_timestamp = get_last_record_timestamp(station["station"])
-        days_to_create = 0
-        
-        if last_record_timestamp:
-            # Calculate the number of days to create based on the last record timestamp
-            last_record_date = datetime.fromtimestamp(int(last_record_timestamp))
-            days_to_create = (datetime.now() - last_record_date).days
-            if days_to_create > 5:
-                days_to_create = 5
-            print(f"Generating {days_to_create} days of historical data.")
-        else:
-            # No previous records, so create data for the last 5 days
-            days_to_create = 5
-            print("No previous records found, generating 5 days of historical data.")
-        
-        if(days_to_create > 0):
-            # Define the prompt for the model.
-            prompt = "Can you generate data for a gas station called {station} with this location {city}? The data needs to include traffic events, weather conditions, regular fuel price, mid fuel price, premium fuel price, and volume of gas sold at this gas station for today to the last {days} days? We also need competing prices at gas stations nearby. The gas station names are (ZenithFuel, HorizonEnergy, and MeridianPetrol). Make sure you consider real historical data for this city when making the synthetic data. Traffic conditions should correlate with weather and also be reflected in prices. For example, more road closures or accident with bad weather may require increasing prices. Provide this data in json format. The current date is {date}. Needs to be a record once a day. Only a json response is allowed, no other text that would make it invalid".format(station=station["station"], city=station["city"] ,days=days_to_create, date=formatted_datetime)
-            prompt = prompt + """
-                        Format:
-                        
-                        {"stationData": [
-                            {
-                            "station": "Station 1",
-                            "city": "Houston",
-                            "state": "TX",
-                            "timestamp": "2024-07-24T12:00:00",
-                            "trafficEvents": "No major events",
-                            "weatherCondition": "Clear",
-                            "regularFuelPrice": 3.45,
-                            "midFuelPrice": 3.59,
-                            "premiumFuelPrice": 3.75,
-                            "volumeOfGasSold": 5200,
-                            "ZenithFuelRegularFuelPrice": 3.42,
-                            "ZenithFuelMidFuelPrice": 3.58,
-                            "ZenithFuelPremiumFuelPrice": 3.74,
-                            "HorizonEnergyRegularFuelPrice": 3.46,
-                            "HorizonEnergyMidFuelPrice": 3.61,
-                            "HorizonEnergyPremiumFuelPrice": 3.77,
-                            "MeridianPetrolRegularFuelPrice": 3.40,
-                            "MeridianPetrolMidFuelPrice": 3.55,
-                            "MeridianPetrolPremiumFuelPrice": 3.72
-                            },
-                            {
-                            "station": "Station 1",
-                            "city": "Houston",
-                            "state": "TX",
-                            "timestamp": "2024-07-25T12:00:00",
-                            "trafficEvents": "Accident on I-45 causing delays",
-                            "weatherCondition": "Thunderstorms",
-                            "regularFuelPrice": 3.75,
-                            "midFuelPrice": 3.89,
-                            "premiumFuelPrice": 4.15,
-                            "volumeOfGasSold": 3800,
-                            "ZenithFuelRegularFuelPrice": 3.72,
-                            "ZenithFuelMidFuelPrice": 3.87,
-                            "ZenithFuelPremiumFuelPrice": 4.00,
-                            "HorizonEnergyRegularFuelPrice": 3.72,
-                            "HorizonEnergyMidFuelPrice": 3.87,
-                            "HorizonEnergyPremiumFuelPrice": 4.00,
-                            "MeridianPetrolRegularFuelPrice": 3.72,
-                            "MeridianPetrolMidFuelPrice": 3.87,
-                            "MeridianPetrolPremiumFuelPrice": 4.00
-                            },    
-                          ]
-                        }"""
-
-            # Format the request payload using the model's native structure.
-            native_request = {
-                "system": [
-                    {"text": "You create synthetic data in JSON for gas stations. Must be in JSON format as show in example. Output only plain text. Do not output markdown."}
-                ],
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [{"text": prompt}],
-                    }
-                ],
-                "inferenceConfig": {
-                    "max_new_tokens": 4096,
-                    "top_p": 0.9,
-                    "top_k": 20,
-                    "temperature": 0.5,
-                }
-            }
-            
-            # Convert the native request to JSON.
-            request = json.dumps(native_request)
-            
+
+    stations = load_json_from_file("stations.json") or []
+    results = []
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = {
+            executor.submit(generate_station_prices, client, model_id, station): station
+            for station in stations
+        }
+        for future in as_completed(futures):
+            station = futures[future]
             try:
-                # Invoke the model with the request.
-                response = client.invoke_model(modelId=model_id, body=request)
-        
+                results.append(future.result())
             except (ClientError, Exception) as e:
-                print(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
-                exit(1)
-            
-            # Decode the response body.
-            model_response = json.loads(response["body"].read())
-            # Extract and print the response text.
-            response_md = model_response["output"]["message"]["content"][0]["text"]
-            response_text = strip_markdown.strip_markdown(response_md)
-
-            response_text = response_text.replace("json","")
-            
-            generated_response = json.loads(response_text)
-    
-            for record in generated_response['stationData']:
-                put_item(table, record)
-    else:
+                print(f"ERROR: Can't generate data for '{station['station']}' with '{model_id}'. Reason: {e}")
+                results.append({'station': station["station"], 'status': 'failed', 'records': 0, 'error': str(e)})
+
+    failed = [result for result in results if result['status'] == 'failed']
+    partial = [result for result in results if result['status'] == 'partial']
+    generated = [result for result in results if result['status'] == 'success']
+    print(f"Generated data for {len(generated)} stations, {len(partial)} partially, {len(failed)} failed.")
+
+    rate_limiter_metrics = model_rate_limiter.emit_metrics()
+
+    if not generated and not partial and not failed:
         return {
             'statusCode': 200,
             'body': "No data needs to be generated"
         }
 
+    return {
+        'statusCode': 200 if not failed and not partial else 207,
+        'body': json.dumps({
+            'generated': len(generated),
+            'partial': len(partial),
+            'failed': len(failed),
+            'rateLimiter': rate_limiter_metrics,
+            'results': results
+        })
+    }
 
-def generate_ai_recommendations():
-    client_runtime = boto3.client('bedrock-agent-runtime')
-    
-    stations = load_json_from_file("stations.json")
-        
-    for station in stations:
-        try:
-            station["station"]
 
-            response = client_runtime.invoke_flow(
-                flowAliasIdentifier=os.environ["FLOW_ALIAS"],
-                flowIdentifier=os.environ["FLOW_IDENTIFIER"],
-                inputs=[
-                    {
-                        'content': {
-                            'document': '{"prompttype": "airecommendation", "station": "'+station["station"]+'"}'
-                        },
-                        'nodeName': 'FlowInputNode',
-                        'nodeOutputName': 'document'
-                    },
-                ]
-            )
-            
-            result = {}
-            
-            for event in response.get("responseStream"):
-                result.update(event)
-            
-            if result['flowCompletionEvent']['completionReason'] == 'SUCCESS':
-                now = datetime.now()
-                rounded_datetime = now.replace(minute=0, second=0, microsecond=0)
-                # Convert the rounded datetime to a formatted string
-                timestamp = int(rounded_datetime.timestamp())
-                expiration_datetime = int((rounded_datetime + timedelta(days=30)).timestamp())
-                record = {
-                    "station": station["station"],
-                    "timestamp": timestamp,
-                    "expirationtime": expiration_datetime,
-                    "message": result['flowOutputEvent']['content']['document']
-                }
-                
-                ## Store AI Recommendation in Dynamo DB
-                put_item(ai_table, record)
-            
-            else:
-                print("The prompt flow invocation completed because of the following reason:", result['flowCompletionEvent']['completionReason'])
-            
-            time.sleep(10)
-        except:
-            print("Error while generating AI Recommendations for: " + station["station"] + ". Waiting 30 seconds due to throttling.")
-            time.sleep(30)
+def write_generated_records(records):
+    """Writes generated records and adds the new ones to the rollups of their stations.
+
+    A re-run with the same seed overwrites the records of the previous run, so records
+    whose timestamp was already stored are written but not added to the rollups again.
+
+    Returns:
+        int: The number of records written.
+    """
+    records_by_station = {}
+    for record in records:
+        records_by_station.setdefault(record['station'], []).append(record)
+    new_records = {
+        station_name: filter_new_records(station_name, station_records)
+        for station_name, station_records in records_by_station.items()
+    }
+
+    result = write_items(table, records)
+    for station_name, station_records in new_records.items():
+        update_price_rollups(station_name, station_records)
+    return result['written']
+
+
+def generate_numpy_prices(days=30, frequency='daily', seed=0, station_count=None, ttl_days=None, max_concurrency=None,
+                          start_station=0, context=None):
+    """Generates price data with the seeded NumPy generator instead of the model.
+
+    The same seed, stations and time range always produce the same records, so the data
+    can be regenerated for load tests. The records of each station are written while the
+    next stations are generated, with at most NUMPY_MAX_PENDING_RECORDS records waiting
+    for their write. Before each station the remaining invocation time is compared with
+    the slowest station so far. When it does not fit, the pending writes are finished and
+    the run stops with the index of the next station, to be passed as start_station.
+
+    Args:
+        days (int): Number of days of data, ending today.
+        frequency (str): 'daily' or 'hourly'.
+        seed (int): Seed of the random generator.
+        station_count (int): Number of synthetic 'Load Station <n>' stations, the stations
+            of stations.json if None.
+        ttl_days (int): Days after the timestamp the records expire, never if None.
+        max_concurrency (int): Maximum number of stations written at the same time.
+            Defaults to the MAX_CONCURRENCY environment variable.
+        start_station (int): Index of the first station, to resume a stopped run.
+        context: Lambda context for the remaining time, no deadline if None.
+
+    Returns:
+        dict: Response with the number of stations and records written, 202 with the
+            next station if the run stopped before the deadline.
+    """
+    # NumPy is only loaded when this generator is used
+    from numpy_generator import generate_records, synthetic_stations
+
+    if max_concurrency is None:
+        max_concurrency = int(os.environ.get('MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY))
+
+    if station_count:
+        stations = synthetic_stations(station_count, seed)
+    else:
+        stations = load_json_from_file("stations.json") or []
+
+    written = 0
+    next_station = start_station
+    slowest_station_millis = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        pending = {}
+        started = time.time()
+        for records in generate_records(stations, days, frequency, seed, ttl_days, start_station=start_station):
+            # A station larger than the limit is written on its own
+            while pending and (len(pending) >= max_concurrency or sum(pending.values()) + len(records) > NUMPY_MAX_PENDING_RECORDS):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    written += future.result()
+            pending[executor.submit(write_generated_records, records)] = len(records)
+            next_station += 1
+
+            slowest_station_millis = max(slowest_station_millis, int((time.time() - started) * 1000))
+            if (context and next_station < len(stations)
+                    and context.get_remaining_time_in_millis() < NUMPY_DEADLINE_MARGIN_MILLIS + slowest_station_millis):
+                break
+            started = time.time()
+        written += sum(future.result() for future in pending)
+
+    if next_station < len(stations):
+        print(f"Generated {written} records, stopped before the deadline at station {next_station} of {len(stations)} with seed {seed}.")
+        return {
+            'statusCode': 202,
+            'body': json.dumps({
+                'generator': 'numpy',
+                'status': 'running',
+                'stations': len(stations),
+                'records': written,
+                'seed': seed,
+                'start_station': next_station
+            })
+        }
+
+    print(f"Generated {written} records for {len(stations)} stations with seed {seed}.")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'generator': 'numpy',
+            'stations': len(stations),
+            'records': written,
+            'seed': seed
+        })
+    }
+
+
+def invoke_recommendation_flow(client_runtime, station_name):
+    """Invokes the Bedrock flow for an AI recommendation and reads its response stream.
+
+    Args:
+        client_runtime: Bedrock Agent Runtime client.
+        station_name (str): The name of the station.
+
+    Returns:
+        dict: The merged flow events.
+    """
+    response = client_runtime.invoke_flow(
+        flowAliasIdentifier=os.environ["FLOW_ALIAS"],
+        flowIdentifier=os.environ["FLOW_IDENTIFIER"],
+        inputs=[
+            {
+                'content': {
+                    'document': '{"prompttype": "airecommendation", "station": "'+station_name+'"}'
+                },
+                'nodeName': 'FlowInputNode',
+                'nodeOutputName': 'document'
+            },
+        ]
+    )
+
+    result = {}
+
+    for event in response.get("responseStream"):
+        result.update(event)
+
+    return result
+
+def generate_station_recommendation(client_runtime, station):
+    """Generates the AI recommendation record for one station.
+
+    Args:
+        client_runtime: Bedrock Agent Runtime client.
+        station (dict): Station entry from stations.json.
+
+    Returns:
+        dict or None: The recommendation record, or None if the flow did not succeed.
+    """
+    result = flow_rate_limiter.call(invoke_recommendation_flow, client_runtime, station["station"])
+
+    if result['flowCompletionEvent']['completionReason'] == 'SUCCESS':
+        now = datetime.now()
+        rounded_datetime = now.replace(minute=0, second=0, microsecond=0)
+        # Convert the rounded datetime to a formatted string
+        timestamp = int(rounded_datetime.timestamp())
+        expiration_datetime = int((rounded_datetime + timedelta(days=30)).timestamp())
+        return {
+            "station": station["station"],
+            "timestamp": timestamp,
+            "expirationtime": expiration_datetime,
+            "message": result['flowOutputEvent']['content']['document']
+        }
+
+    print("The prompt flow invocation completed because of the following reason:", result['flowCompletionEvent']['completionReason'])
+    return None
+
+def generate_ai_recommendations(max_concurrency=None):
+    """Generates AI recommendations for every station as fast as the flow quota allows.
+
+    Args:
+        max_concurrency (int): Maximum number of flows invoked at the same time.
+            Defaults to the MAX_CONCURRENCY environment variable.
+    """
+    if max_concurrency is None:
+        max_concurrency = int(os.environ.get('MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY))
+
+    # Throttled and transiently failed flow invocations are retried by the rate limiter
+    client_runtime = create_client('bedrock-agent-runtime', max_attempts=LIMITED_CLIENT_MAX_ATTEMPTS, max_pool_connections=max(max_concurrency, MAX_POOL_CONNECTIONS))
+
+    stations = load_json_from_file("stations.json") or []
+    records = []
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = {
+            executor.submit(generate_station_recommendation, client_runtime, station): station
+            for station in stations
+        }
+        for future in as_completed(futures):
+            station = futures[future]
+            try:
+                record = future.result()
+            except (ClientError, Exception) as e:
+                print("Error while generating AI Recommendations for: " + station["station"] + ". Reason: " + str(e))
+                continue
+
+            if record:
+                ## Queue AI Recommendation for the next batch write to Dynamo DB
+                records.append(record)
+                if len(records) >= MAX_BATCH_SIZE:
+                    write_items(ai_table, records)
+                    records = []
+
+    if records:
+        write_items(ai_table, records)
+
+    return flow_rate_limiter.emit_metrics()
@@ -1,14 +1,14 @@
 import os
 import json
-import boto3
 from datetime import datetime
 from botocore.exceptions import ClientError
 from datetime import datetime, timedelta
 from boto3.dynamodb.conditions import Key
-from decimal import Decimal
+from batch_writer import write_items
+from pricing_common.aws_clients import create_resource
 
 # Set up the DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+dynamodb = create_resource('dynamodb')
 table_name = os.environ['DYNAMODB_STATIONS_TABLE_NAME']
 table = dynamodb.Table(table_name)
 
@@ -29,44 +29,18 @@ def table_contains_records():
         response = table.scan(Limit=1)  # Fetch only one item to check
         return 'Items' in response and len(response['Items']) > 0
     except:
-        return false
-
-def put_item(item_data):
-    """Inserts a JSON item into a DynamoDB table, converting floats to Decimal.
-
-    Args:
-        item_data (dict): The JSON item data as a dictionary.
-    """
-    
-    # Convert floats to Decimal
-    for key, value in item_data.items():
-        if isinstance(value, float):
-            item_data[key] = Decimal(str(value))
-    
-    # Convert timestamp string to epoch
-    if 'timestamp' in item_data and isinstance(item_data['timestamp'], str):
-        try:
-            # Parse the timestamp string with appropriate format
-            datetime_obj = datetime.strptime(item_data['timestamp'], "%Y-%m-%dT%H:%M:%S")
-            # Get the epoch timestamp (seconds since Unix epoch)
-            item_data['timestamp'] = int(datetime_obj.timestamp())
-        except ValueError:
-            print(f"Error: Invalid timestamp format. Please use 'YYYY-MM-DDTHH:MM:SS'.")
-            return None  # Indicate error
-
-    response = table.put_item(Item=item_data)
-    return response
+        return False
 
 def create_stations(event, context):
     # If table is empty, create stations using json
     if(table_contains_records() is False):
         stations = load_json_from_file("stations.json")
         
-        id = 1
-        for station in stations:
+        for id, station in enumerate(stations, start=1):
             station["id"] = id
-            put_item(station)
-            id=id+1
+
+        # Insert all stations with batched writes instead of one request per station
+        write_items(table, stations, key_names=('station', 'id'))
             
     else:
         return {
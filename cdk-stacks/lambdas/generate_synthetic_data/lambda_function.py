@@ -1,10 +1,35 @@
 import os
 import json
-from fuel_station_prices import generate_fuel_prices, generate_ai_recommendations
+from fuel_station_prices import generate_fuel_prices, generate_ai_recommendations, generate_numpy_prices, rebuild_price_rollups
 from fuel_stations import create_stations
+from backfill import run_backfill
 
 
 def lambda_handler(event, context):
+    # Recompute the price rollups from existing data, e.g. {"action": "rebuild_rollups", "station": "Station 1"}.
+    # Only buckets inside the TTL window of the prices are rebuilt, "ttl_days": 0 rebuilds all of them
+    if event.get('action') == 'rebuild_rollups':
+        if 'ttl_days' in event:
+            return rebuild_price_rollups(event.get('station'), ttl_days=int(event['ttl_days'] or 0))
+        return rebuild_price_rollups(event.get('station'))
+
+    # Resumable backfill of a date range, e.g. {"action": "backfill", "job_id": "2024", "start": "2024-01-01"}
+    if event.get('action') == 'backfill':
+        return run_backfill(event, context)
+
+    # Seeded bulk data for load tests, e.g. {"generator": "numpy", "days": 365, "frequency": "hourly", "station_count": 1000}.
+    # A run stopped before the timeout is resumed with the "start_station" of its response
+    if event.get('generator') == 'numpy':
+        return generate_numpy_prices(
+            days=int(event.get('days', 30)),
+            frequency=event.get('frequency', 'daily'),
+            seed=int(event.get('seed', 0)),
+            station_count=int(event['station_count']) if event.get('station_count') else None,
+            ttl_days=int(event['ttl_days']) if event.get('ttl_days') else None,
+            start_station=int(event.get('start_station', 0)),
+            context=context
+        )
+
     create_stations(event, context)
     generate_ai_recommendations()
     return generate_fuel_prices()
\ No newline at end of file
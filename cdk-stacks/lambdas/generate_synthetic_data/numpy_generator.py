@@ -0,0 +1,237 @@
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+COMPETITORS = ('ZenithFuel', 'HorizonEnergy', 'MeridianPetrol')
+
+# Weather conditions with their daily probability and impact on prices and demand (0 to 1)
+WEATHER_CONDITIONS = ('Clear', 'Partly Cloudy', 'Cloudy', 'Rain', 'Thunderstorms', 'Fog', 'Extreme Heat')
+WEATHER_PROBABILITIES = (0.42, 0.2, 0.12, 0.12, 0.06, 0.04, 0.04)
+WEATHER_SEVERITY = (0.0, 0.0, 0.1, 0.4, 1.0, 0.6, 0.3)
+
+# Traffic events, the first one means no incident. Incidents get more likely with bad weather.
+TRAFFIC_EVENTS = ('No major events', 'Road construction', 'Heavy congestion', 'Accident causing delays', 'Road closure')
+INCIDENT_PROBABILITIES = (0.35, 0.3, 0.25, 0.1)
+TRAFFIC_SEVERITY = (0.0, 0.3, 0.4, 0.7, 1.0)
+BASE_INCIDENT_PROBABILITY = 0.15
+
+# Share of the daily volume sold per weekday (Monday first) and per hour of the day
+WEEKDAY_PROFILE = (0.95, 0.93, 0.96, 1.0, 1.12, 1.1, 0.94)
+HOURLY_PROFILE = (
+    0.2, 0.1, 0.1, 0.1, 0.2, 0.5, 1.0, 1.6, 1.8, 1.3, 1.1, 1.2,
+    1.4, 1.3, 1.2, 1.4, 1.8, 2.0, 1.6, 1.1, 0.8, 0.6, 0.4, 0.3,
+)
+
+FREQUENCIES = {'daily': 86400, 'hourly': 3600}
+
+# Stations are generated in chunks of this size, each with its own random stream, so the
+# output for a seed does not depend on how many stations are generated
+STATION_CHUNK_SIZE = 64
+
+
+def synthetic_stations(count, seed=0):
+    """Creates station entries in the format of stations.json for load tests.
+
+    Args:
+        count (int): Number of stations.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        list: Station entries named 'Load Station <n>'.
+    """
+    rng = np.random.default_rng([seed, count])
+    cities = ('Amarillo, TX', 'Corpus Christi, TX', 'Lubbock, TX', 'El Paso, TX', 'Abilene, TX', 'Waco, TX',
+              'Laredo, TX', 'McAllen, TX', 'Brownsville, TX', 'Beaumont, TX', 'Odessa, TX')
+    city_indexes = rng.integers(0, len(cities), count)
+    fuel_pumps = rng.integers(6, 20, count)
+    return [
+        {
+            "station": f"Load Station {index + 1}",
+            "city": cities[city_index],
+            "fuelPumps": int(pumps),
+        }
+        for index, (city_index, pumps) in enumerate(zip(city_indexes.tolist(), fuel_pumps.tolist()))
+    ]
+
+
+def make_timestamps(days, frequency='daily', end=None):
+    """Returns the epoch timestamps of the last days, aligned to the day or hour (UTC).
+
+    Args:
+        days (int): Number of days.
+        frequency (str): 'daily' or 'hourly'.
+        end (datetime): Last day of the range, today if None.
+    """
+    step = FREQUENCIES[frequency]
+    end = end or datetime.now(timezone.utc)
+    first_day = end.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    start = int(first_day.timestamp())
+    return np.arange(start, start + days * 86400, step, dtype=np.int64)
+
+
+def market_index(rng, days):
+    """Returns the daily wholesale price movement shared by all stations.
+
+    The index is a mean reverting AR(1) process, so prices wander without drifting away
+    over multi year ranges.
+    """
+    shocks = rng.normal(0.0, 0.02, days)
+    index = np.empty(days)
+    level = 0.0
+    for day in range(days):
+        level = 0.98 * level + shocks[day]
+        index[day] = level
+    return index
+
+
+def generate_arrays(stations, timestamps, market, rng):
+    """Generates the price columns of a group of stations.
+
+    Args:
+        stations (list): Station entries.
+        timestamps (numpy.ndarray): Epoch timestamps, aligned to the day or hour.
+        market (numpy.ndarray): Daily market index from market_index.
+        rng (numpy.random.Generator): Random generator of this group of stations.
+
+    Returns:
+        dict: Arrays of shape (stations, timestamps) by column name. Weather and traffic
+            columns hold indexes into WEATHER_CONDITIONS and TRAFFIC_EVENTS.
+    """
+    station_count = len(stations)
+    days = timestamps.astype('datetime64[s]').astype('datetime64[D]')
+    day_index = (days - days[0]).astype(np.int64)
+    day_count = int(day_index[-1]) + 1
+
+    # Events are drawn once per station and day
+    weather = rng.choice(len(WEATHER_CONDITIONS), size=(station_count, day_count), p=WEATHER_PROBABILITIES)
+    weather_severity = np.asarray(WEATHER_SEVERITY)[weather]
+    incident = rng.random((station_count, day_count)) < BASE_INCIDENT_PROBABILITY + 0.5 * weather_severity
+    incident_type = 1 + rng.choice(len(INCIDENT_PROBABILITIES), size=(station_count, day_count), p=INCIDENT_PROBABILITIES)
+    traffic = np.where(incident, incident_type, 0)
+    traffic_severity = np.asarray(TRAFFIC_SEVERITY)[traffic]
+
+    # Expand the daily values to the requested frequency
+    weather = weather[:, day_index]
+    traffic = traffic[:, day_index]
+    weather_severity = weather_severity[:, day_index]
+    traffic_severity = traffic_severity[:, day_index]
+
+    # Prices peak with the summer driving season and rise with bad weather and road closures
+    day_of_year = (days - days.astype('datetime64[Y]')).astype(np.int64)
+    season = 0.08 * np.sin(2 * np.pi * (day_of_year - 80) / 365.25)
+    base_price = rng.normal(3.25, 0.15, (station_count, 1))
+    event_premium = 0.06 * weather_severity + 0.04 * traffic_severity
+    regular = base_price + market[day_index] + season + event_premium + rng.normal(0.0, 0.015, weather.shape)
+
+    mid_spread = rng.uniform(0.12, 0.2, (station_count, 1))
+    premium_spread = rng.uniform(0.28, 0.45, (station_count, 1))
+    arrays = {
+        'weatherCondition': weather,
+        'trafficEvents': traffic,
+        'regularFuelPrice': regular,
+        'midFuelPrice': regular + mid_spread,
+        'premiumFuelPrice': regular + premium_spread,
+    }
+
+    # Competitors follow the station price with their own offset and react less to events
+    competitor_regular = []
+    for competitor in COMPETITORS:
+        offset = rng.normal(0.0, 0.05, (station_count, 1))
+        price = regular + offset - 0.3 * event_premium + rng.normal(0.0, 0.02, weather.shape)
+        competitor_regular.append(price)
+        arrays[f'{competitor}RegularFuelPrice'] = price
+        arrays[f'{competitor}MidFuelPrice'] = price + mid_spread + rng.normal(0.0, 0.01, weather.shape)
+        arrays[f'{competitor}PremiumFuelPrice'] = price + premium_spread + rng.normal(0.0, 0.01, weather.shape)
+
+    # Volume scales with the number of pumps, drops with bad weather, traffic and a price
+    # above the competitors, and follows the weekly and daily demand profile
+    pumps = np.array([station.get('fuelPumps', 10) for station in stations], dtype=float)[:, None]
+    weekday = ((timestamps // 86400) + 3) % 7
+    demand = pumps * 420.0 * np.asarray(WEEKDAY_PROFILE)[weekday]
+    if len(timestamps) > day_count:
+        hourly_profile = np.asarray(HOURLY_PROFILE)
+        demand = demand * (hourly_profile / hourly_profile.sum())[(timestamps % 86400) // 3600]
+    price_gap = regular - np.mean(competitor_regular, axis=0)
+    arrays['volumeOfGasSold'] = (
+        demand
+        * (1.0 - 0.35 * weather_severity)
+        * (1.0 - 0.25 * traffic_severity)
+        * np.exp(-6.0 * price_gap)
+        * rng.lognormal(0.0, 0.08, weather.shape)
+    )
+    return arrays
+
+
+def arrays_to_records(stations, timestamps, arrays, ttl_days=None):
+    """Converts generated arrays to records with the schema of the model generated data.
+
+    Timestamps are epoch seconds, the way the batch writer stores them. Rows are converted
+    one station at a time, so only the records of one station are held as dictionaries.
+
+    Yields:
+        list: The records of one station.
+    """
+    price_columns = [name for name in arrays if name.endswith('FuelPrice')]
+    weather_conditions = np.asarray(WEATHER_CONDITIONS)
+    traffic_events = np.asarray(TRAFFIC_EVENTS)
+    timestamp_list = timestamps.tolist()
+    expiration_list = (timestamps + ttl_days * 86400).tolist() if ttl_days else None
+
+    for row, station in enumerate(stations):
+        city, _, state = station['city'].partition(', ')
+        prices = {name: np.round(arrays[name][row], 2).tolist() for name in price_columns}
+        volumes = np.rint(arrays['volumeOfGasSold'][row]).astype(np.int64).tolist()
+        weather = weather_conditions[arrays['weatherCondition'][row]].tolist()
+        traffic = traffic_events[arrays['trafficEvents'][row]].tolist()
+
+        records = []
+        for column, timestamp in enumerate(timestamp_list):
+            record = {
+                "station": station['station'],
+                "city": city,
+                "state": state,
+                "timestamp": timestamp,
+                "trafficEvents": traffic[column],
+                "weatherCondition": weather[column],
+                "volumeOfGasSold": volumes[column],
+            }
+            for name in price_columns:
+                record[name] = prices[name][column]
+            if expiration_list:
+                record['expirationtime'] = expiration_list[column]
+            records.append(record)
+        yield records
+
+
+def generate_records(stations, days, frequency='daily', seed=0, ttl_days=None, end=None, start_station=0):
+    """Generates synthetic price records, one station at a time.
+
+    The output is fully determined by the seed, the stations and the time range. The arrays
+    are generated for chunks of STATION_CHUNK_SIZE stations, the records of a station are
+    only created once the previous station was consumed.
+
+    Args:
+        stations (list): Station entries.
+        days (int): Number of days, ending today.
+        frequency (str): 'daily' or 'hourly'.
+        seed (int): Seed of the random generator.
+        ttl_days (int): Days after the timestamp the records expire, never if None.
+        end (datetime): Last day of the range, today if None.
+        start_station (int): Index of the first station to generate, to resume a run.
+            Earlier stations of its chunk are generated but not yielded.
+
+    Yields:
+        list: Records of one station.
+    """
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unsupported frequency: {frequency}")
+
+    timestamps = make_timestamps(days, frequency, end)
+    market = market_index(np.random.default_rng([seed]), days)
+
+    first_chunk = start_station - start_station % STATION_CHUNK_SIZE
+    for offset in range(first_chunk, len(stations), STATION_CHUNK_SIZE):
+        chunk = stations[offset:offset + STATION_CHUNK_SIZE]
+        rng = np.random.default_rng([seed, offset])
+        arrays = generate_arrays(chunk, timestamps, market, rng)
+        skip = max(0, start_station - offset)
+        yield from arrays_to_records(chunk[skip:], timestamps, {name: array[skip:] for name, array in arrays.items()}, ttl_days)
@@ -0,0 +1,217 @@
+import json
+import time
+import random
+import threading
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+# Error codes returned by Bedrock when the account quota is exceeded, in lower case. Throttles
+# raised inside a response stream arrive as EventStreamError with e.g. 'throttlingException'
+THROTTLING_ERROR_CODES = ('throttlingexception', 'toomanyrequestsexception')
+# Error codes of failures that are not caused by the request and succeed when retried, in lower case
+TRANSIENT_ERROR_CODES = (
+    'serviceunavailableexception', 'modelnotreadyexception', 'internalserverexception',
+    'modeltimeoutexception', 'modelstreamerrorexception',
+)
+# Timeouts and dropped connections, raised by botocore or while reading a response stream
+TRANSIENT_EXCEPTIONS = (ConnectionError, HTTPClientError, ProtocolError, ReadTimeoutError)
+
+# Attempts of the clients used through a limiter. Retries of botocore would absorb the
+# throttles before the limiter sees them, so the limiter does the retrying, of throttles
+# and of transient errors.
+LIMITED_CLIENT_MAX_ATTEMPTS = 1
+
+# Full jitter exponential backoff before retrying a transient error. Throttles are paced
+# by the reduced rate instead.
+BASE_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 8
+
+
+def is_throttling_error(error):
+    """Returns True if a ClientError, or EventStreamError, reports a throttled call."""
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code', '').lower() in THROTTLING_ERROR_CODES
+
+
+def is_transient_error(error):
+    """Returns True for errors worth retrying that are not throttles.
+
+    These are service side errors and 5xx responses, timeouts and dropped connections.
+    """
+    if isinstance(error, TRANSIENT_EXCEPTIONS):
+        return True
+    if not isinstance(error, ClientError) or is_throttling_error(error):
+        return False
+    if error.response.get('Error', {}).get('Code', '').lower() in TRANSIENT_ERROR_CODES:
+        return True
+    return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+
+
+class AdaptiveRateLimiter:
+    """Thread safe client side token bucket with an AIMD adjusted fill rate.
+
+    The rate is increased additively after every successful call and cut multiplicatively
+    when the service answers with a throttling error, so callers converge on the rate the
+    account quota allows instead of sleeping for a fixed amount of time.
+    """
+
+    def __init__(self, name, initial_rate=1.0, min_rate=0.05, max_rate=20.0,
+                 increase_step=0.1, decrease_factor=0.5, max_retries=6):
+        """
+        Args:
+            name (str): Name used when reporting metrics.
+            initial_rate (float): Initial number of calls per second.
+            min_rate (float): Lowest number of calls per second.
+            max_rate (float): Highest number of calls per second.
+            increase_step (float): Calls per second added after a successful call.
+            decrease_factor (float): Factor the rate is multiplied with after a throttle.
+            max_retries (int): Number of times a throttled or transiently failed call is retried.
+        """
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+
+        self._lock = threading.Lock()
+        self._rate = initial_rate
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._calls = 0
+        self._throttles = 0
+        self._transient_errors = 0
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def throttle_count(self):
+        return self._throttles
+
+    def acquire(self):
+        """Blocks until a token is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # Allow a burst of up to one second worth of calls
+                capacity = max(1.0, self._rate)
+                self._tokens = min(capacity, self._tokens + (now - self._last_refill) * self._rate)
+                self._last_refill = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def record_success(self):
+        with self._lock:
+            self._calls += 1
+            self._rate = min(self.max_rate, self._rate + self.increase_step)
+
+    def record_throttle(self, new_call=True):
+        """Cuts the rate after a throttle.
+
+        Args:
+            new_call (bool): False when the throttled call was already counted, e.g. for a
+                throttle raised inside the response stream of a successful call.
+        """
+        with self._lock:
+            if new_call:
+                self._calls += 1
+            self._throttles += 1
+            self._rate = max(self.min_rate, self._rate * self.decrease_factor)
+            # Drop any burst so the next call waits for the reduced rate
+            self._tokens = 0.0
+
+    def record_transient_error(self, new_call=True):
+        """Counts a transient error, the rate is kept.
+
+        Args:
+            new_call (bool): See record_throttle.
+        """
+        with self._lock:
+            if new_call:
+                self._calls += 1
+            self._transient_errors += 1
+
+    def should_retry(self, error, attempt, new_call=True):
+        """Records a failed attempt and decides if it is retried.
+
+        Throttles cut the rate, transient errors wait for a jittered backoff before returning.
+
+        Args:
+            error (Exception): The error of the attempt.
+            attempt (int): Number of the attempt, starting at 0.
+            new_call (bool): See record_throttle.
+
+        Returns:
+            bool: True if the call should be retried, False if the error should be raised.
+        """
+        if is_throttling_error(error):
+            self.record_throttle(new_call)
+            print(f"{self.name} throttled, reducing rate to {self._rate:.2f} calls/s (attempt {attempt + 1}).")
+        elif is_transient_error(error):
+            self.record_transient_error(new_call)
+            print(f"{self.name} failed with a transient error (attempt {attempt + 1}): {error}")
+            if attempt < self.max_retries:
+                time.sleep(random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt))))
+        else:
+            return False
+        return attempt < self.max_retries
+
+    def call(self, function, *args, **kwargs):
+        """Calls function once a token is available, retrying throttled and transiently failed calls.
+
+        Args:
+            function: Function performing the Bedrock call.
+
+        Returns:
+            The return value of function.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                continue
+            self.record_success()
+            return result
+
+    def metrics(self):
+        """Returns the current state of the limiter."""
+        with self._lock:
+            return {
+                'name': self.name,
+                'rate': round(self._rate, 3),
+                'calls': self._calls,
+                'throttles': self._throttles,
+                'transientErrors': self._transient_errors,
+            }
+
+    def emit_metrics(self, namespace='StationDataGenerator'):
+        """Prints the limiter state in CloudWatch embedded metric format."""
+        metrics = self.metrics()
+        print(json.dumps({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [['RateLimiter']],
+                    'Metrics': [
+                        {'Name': 'CallRate', 'Unit': 'Count/Second'},
+                        {'Name': 'Calls', 'Unit': 'Count'},
+                        {'Name': 'Throttles', 'Unit': 'Count'},
+                        {'Name': 'TransientErrors', 'Unit': 'Count'},
+                    ],
+                }],
+            },
+            'RateLimiter': metrics['name'],
+            'CallRate': metrics['rate'],
+            'Calls': metrics['calls'],
+            'Throttles': metrics['throttles'],
+            'TransientErrors': metrics['transientErrors'],
+        }))
+        return metrics
@@ -0,0 +1,127 @@
+import json
+from datetime import datetime
+from pricing_common.price_history import PRICE_COLUMNS, VOLUME_COLUMN
+from batch_writer import TIMESTAMP_FORMAT
+
+REQUIRED_TEXT_FIELDS = ('station', 'timestamp')
+# Prices outside of this range are treated as a generation error
+MIN_PRICE = 0.5
+MAX_PRICE = 20.0
+
+
+class RecordStreamParser:
+    """Incrementally extracts the records of a JSON array from streamed text.
+
+    The text is scanned once, tracking strings, escapes and brace depth. Every object
+    nested directly in the array of records is emitted as soon as its closing brace
+    arrives, so a truncated or malformed tail only loses the records it affects. Text
+    before the JSON, like a markdown fence, is ignored.
+
+    Works with {"stationData": [{...}, ...]} and with a bare [{...}, ...].
+    """
+
+    def __init__(self):
+        self._depth = 0
+        self._record_depth = None
+        self._in_string = False
+        self._escaped = False
+        self._buffer = []
+
+    def feed(self, text):
+        """Parses the next piece of text.
+
+        Args:
+            text (str): The next delta of the model output.
+
+        Returns:
+            list: Texts of the records completed by this piece.
+        """
+        completed = []
+        for char in text:
+            if self._buffer:
+                self._buffer.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = self._depth > 0 or self._record_depth is not None
+            elif char == '[' and self._record_depth is None:
+                # Records are the objects at the brace depth of the first array
+                self._record_depth = self._depth
+            elif char == '{':
+                if self._record_depth is not None and self._depth == self._record_depth and not self._buffer:
+                    self._buffer.append(char)
+                self._depth += 1
+            elif char == '}':
+                self._depth = max(self._depth - 1, 0)
+                if self._buffer and self._depth == self._record_depth:
+                    completed.append(''.join(self._buffer))
+                    self._buffer = []
+        return completed
+
+
+def validate_record(record, station_name):
+    """Checks a generated record and normalizes its values.
+
+    Args:
+        record (dict): Decoded record.
+        station_name (str): The station the records were generated for.
+
+    Returns:
+        dict or None: The record with numeric prices and volume, or None if it is invalid.
+    """
+    if not isinstance(record, dict):
+        return None
+    for field in REQUIRED_TEXT_FIELDS:
+        if not isinstance(record.get(field), str):
+            return None
+    try:
+        datetime.strptime(record['timestamp'], TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+    validated = dict(record)
+    validated['station'] = station_name
+    try:
+        for column in PRICE_COLUMNS:
+            price = float(record[column])
+            if not MIN_PRICE <= price <= MAX_PRICE:
+                return None
+            validated[column] = price
+        volume = float(record[VOLUME_COLUMN])
+        if volume < 0:
+            return None
+        validated[VOLUME_COLUMN] = volume
+    except (KeyError, TypeError, ValueError):
+        return None
+    return validated
+
+
+def parse_records(deltas, station_name):
+    """Yields the valid records of a stream of text deltas as they complete.
+
+    Args:
+        deltas: Iterable of text pieces of the model output.
+        station_name (str): The station the records were generated for.
+
+    Yields:
+        dict: Validated records, invalid records are skipped and logged.
+    """
+    parser = RecordStreamParser()
+    for delta in deltas:
+        for text in parser.feed(delta):
+            try:
+                record = validate_record(json.loads(text), station_name)
+            except json.JSONDecodeError:
+                record = None
+            if record is None:
+                print(f"Skipping invalid record for {station_name}: {text[:200]}")
+                continue
+            yield record
@@ -0,0 +1,73 @@
+import os
+import boto3
+from botocore.config import Config
+
+# Connections per client. The botocore default of 10 makes concurrent tool calls, dashboard
+# queries and batch writes queue for a connection
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 50))
+# 'adaptive' adds client side rate limiting to the retries of the 'standard' mode
+RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'adaptive')
+
+# Connect timeout and read timeout in seconds, and maximum attempts including the first, per service
+SERVICE_SETTINGS = {
+    'dynamodb': (2, 5, 5),
+    'apigatewaymanagementapi': (2, 5, 3),
+    's3': (2, 30, 3),
+    'lambda': (2, 10, 3),
+    # Model responses and flows can take minutes before the first byte
+    'bedrock-runtime': (5, 300, 3),
+    'bedrock-agent-runtime': (5, 300, 3),
+}
+DEFAULT_SETTINGS = (5, 60, 3)
+
+
+def client_config(service_name, max_attempts=None, max_pool_connections=None):
+    """Returns the botocore configuration used for clients of a service.
+
+    Args:
+        service_name (str): boto3 service name.
+        max_attempts (int): Maximum attempts including the first, the service default if None.
+            1 disables retries, for callers retrying on their own.
+        max_pool_connections (int): Size of the connection pool, MAX_POOL_CONNECTIONS if None.
+
+    Returns:
+        botocore.config.Config: Timeouts, retries, pool size and TCP keep-alive.
+    """
+    connect_timeout, read_timeout, default_attempts = SERVICE_SETTINGS.get(service_name, DEFAULT_SETTINGS)
+    return Config(
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={'mode': RETRY_MODE, 'total_max_attempts': max_attempts or default_attempts},
+        max_pool_connections=max_pool_connections or MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+    )
+
+
+def create_client(service_name, max_attempts=None, max_pool_connections=None, **client_args):
+    """Creates a boto3 client with the tuned configuration of its service.
+
+    Args:
+        service_name (str): boto3 service name.
+        max_attempts (int): See client_config.
+        max_pool_connections (int): See client_config.
+        **client_args: Additional arguments of boto3.client, e.g. endpoint_url.
+
+    Returns:
+        The boto3 client.
+    """
+    return boto3.client(service_name, config=client_config(service_name, max_attempts, max_pool_connections), **client_args)
+
+
+def create_resource(service_name, max_attempts=None, max_pool_connections=None, **resource_args):
+    """Creates a boto3 resource with the tuned configuration of its service.
+
+    Args:
+        service_name (str): boto3 service name.
+        max_attempts (int): See client_config.
+        max_pool_connections (int): See client_config.
+        **resource_args: Additional arguments of boto3.resource.
+
+    Returns:
+        The boto3 service resource.
+    """
+    return boto3.resource(service_name, config=client_config(service_name, max_attempts, max_pool_connections), **resource_args)
@@ -0,0 +1,117 @@
+from datetime import datetime
+from functools import lru_cache
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@lru_cache(maxsize=8192)
+def format_timestamp(value):
+    """Convert an epoch timestamp from a DynamoDB number to a 'YYYY-MM-DD HH:MM:SS' string.
+
+    Timestamps are rounded to the hour by the data generator and repeat across stations,
+    so the formatted strings are cached.
+    """
+    return datetime.fromtimestamp(float(value)).strftime(TIMESTAMP_FORMAT)
+
+
+def _identity(value):
+    return value
+
+
+def _number(value):
+    return float(value)
+
+
+def _list(value):
+    return [_decode_value(element) for element in value]
+
+
+def _map(value):
+    return {name: _decode_value(element) for name, element in value.items()}
+
+
+def _null(value):
+    return None
+
+
+def _number_set(value):
+    return [float(element) for element in value]
+
+
+# Converters of the DynamoDB type descriptors. Numbers become floats, the same as the
+# Decimal to float loops did, without allocating a Decimal first.
+TYPE_CONVERTERS = {
+    'S': _identity,
+    'N': _number,
+    'BOOL': _identity,
+    'NULL': _null,
+    'B': _identity,
+    'L': _list,
+    'M': _map,
+    'SS': list,
+    'NS': _number_set,
+    'BS': list,
+}
+
+
+def _decode_value(typed_value):
+    for type_descriptor, value in typed_value.items():
+        return TYPE_CONVERTERS[type_descriptor](value)
+
+
+class ItemDecoder:
+    """Decodes items of the low-level DynamoDB client straight to JSON friendly values.
+
+    The converter of each attribute is resolved once, from the attribute name and type
+    descriptor, and reused for every following item.
+    """
+
+    def __init__(self, attribute_converters=None):
+        """
+        Args:
+            attribute_converters (dict): Converters of specific attributes by name, applied
+                to the raw value of the attribute. Defaults to formatting 'timestamp'.
+        """
+        if attribute_converters is None:
+            attribute_converters = {'timestamp': format_timestamp}
+        self.attribute_converters = attribute_converters
+        self._converters = {}
+
+    def _compile(self, name, type_descriptor):
+        converter = self.attribute_converters.get(name, TYPE_CONVERTERS[type_descriptor])
+        self._converters[(name, type_descriptor)] = converter
+        return converter
+
+    def decode_item(self, item):
+        """Decode one item of the low-level client.
+
+        Args:
+            item (dict): Item with typed attribute values, e.g. {'price': {'N': '3.45'}}.
+
+        Returns:
+            dict: Item with plain values.
+        """
+        converters = self._converters
+        decoded = {}
+        for name, typed_value in item.items():
+            for type_descriptor, value in typed_value.items():
+                converter = converters.get((name, type_descriptor)) or self._compile(name, type_descriptor)
+                decoded[name] = converter(value)
+        return decoded
+
+    def decode_items(self, items):
+        """Decode a list of items of the low-level client."""
+        decode_item = self.decode_item
+        return [decode_item(item) for item in items]
+
+
+# Decoder with the default converters, shared by the query functions
+default_decoder = ItemDecoder()
+
+
+def decode_item(item):
+    return default_decoder.decode_item(item)
+
+
+def decode_items(items):
+    return default_decoder.decode_items(items)
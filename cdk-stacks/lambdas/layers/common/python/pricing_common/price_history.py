@@ -0,0 +1,168 @@
+from datetime import datetime, timedelta, timezone
+from pricing_common.dynamodb_decode import ItemDecoder, format_timestamp
+
+RESOLUTIONS = ('raw', 'daily', 'weekly', 'monthly')
+
+PRICE_COLUMNS = (
+    'regularFuelPrice', 'midFuelPrice', 'premiumFuelPrice',
+    'ZenithFuelRegularFuelPrice', 'ZenithFuelMidFuelPrice', 'ZenithFuelPremiumFuelPrice',
+    'HorizonEnergyRegularFuelPrice', 'HorizonEnergyMidFuelPrice', 'HorizonEnergyPremiumFuelPrice',
+    'MeridianPetrolRegularFuelPrice', 'MeridianPetrolMidFuelPrice', 'MeridianPetrolPremiumFuelPrice',
+)
+VOLUME_COLUMN = 'volumeOfGasSold'
+
+# Upper bound of raw records returned by one range query
+MAX_RAW_ITEMS = 2000
+
+# Timestamps are aggregated as epoch numbers and formatted once per bucket
+epoch_decoder = ItemDecoder(attribute_converters={})
+
+
+def bucket_start(timestamp, resolution):
+    """Return the epoch timestamp of the start of the bucket a timestamp falls in.
+
+    Args:
+        timestamp (float): Epoch timestamp.
+        resolution (str): 'daily', 'weekly' (starting on Monday) or 'monthly'.
+
+    Returns:
+        int: Epoch timestamp of the bucket start, in UTC.
+    """
+    day = datetime.fromtimestamp(timestamp, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if resolution == 'weekly':
+        day -= timedelta(days=day.weekday())
+    elif resolution == 'monthly':
+        day = day.replace(day=1)
+    return int(day.timestamp())
+
+
+def new_bucket(station_name):
+    """Return an empty aggregation bucket."""
+    return {'station': station_name, 'count': 0, 'volume': 0.0, 'prices': {}}
+
+
+def add_to_bucket(bucket, item):
+    """Add a price record to an aggregation bucket.
+
+    Price statistics are kept as [min, max, sum, count] per column.
+    """
+    bucket['count'] += 1
+    bucket['volume'] += float(item.get(VOLUME_COLUMN, 0.0))
+    for column in PRICE_COLUMNS:
+        value = item.get(column)
+        if value is None:
+            continue
+        value = float(value)
+        stats = bucket['prices'].get(column)
+        if stats is None:
+            bucket['prices'][column] = [value, value, value, 1]
+        else:
+            stats[0] = min(stats[0], value)
+            stats[1] = max(stats[1], value)
+            stats[2] += value
+            stats[3] += 1
+
+
+def bucket_record(bucket):
+    """Return the mean, min and max of every price column and the total volume of a bucket."""
+    record = {
+        'station': bucket['station'],
+        'records': bucket['count'],
+        VOLUME_COLUMN: bucket['volume'],
+    }
+    for column, (minimum, maximum, total, count) in bucket['prices'].items():
+        record[column] = round(total / count, 3)
+        record[f'{column}Min'] = minimum
+        record[f'{column}Max'] = maximum
+    return record
+
+
+def downsample(items, resolution):
+    """Aggregate raw price records into buckets.
+
+    Every price column gets the mean under its own name, plus '<column>Min' and
+    '<column>Max'. The volume of gas sold is summed.
+
+    Args:
+        items (list): Records with epoch 'timestamp' values, newest first.
+        resolution (str): 'daily', 'weekly' or 'monthly'.
+
+    Returns:
+        list: One record per bucket, newest first, with a formatted 'timestamp'.
+    """
+    buckets = {}
+    for item in items:
+        key = bucket_start(item['timestamp'], resolution)
+        if key not in buckets:
+            buckets[key] = new_bucket(item.get('station'))
+        add_to_bucket(buckets[key], item)
+
+    records = []
+    for key in sorted(buckets, reverse=True):
+        record = bucket_record(buckets[key])
+        record['timestamp'] = format_timestamp(key)
+        records.append(record)
+    return records
+
+
+def query_price_history(client, table_name, station_name, start=None, end=None, resolution='raw', projection=None):
+    """Query the price records of a station in a time range, optionally downsampled.
+
+    All pages of the range are read with a KeyConditionExpression on the timestamp sort key.
+    Downsampled queries only read the columns they aggregate.
+
+    Args:
+        client: Low-level DynamoDB client.
+        table_name (str): The price table.
+        station_name (str): The name of the station.
+        start (int): Start of the range as epoch seconds, unbounded if None.
+        end (int): End of the range as epoch seconds, now if None.
+        resolution (str): One of RESOLUTIONS.
+        projection (list): Attributes to read for raw queries, all if None.
+
+    Returns:
+        list: Records newest first, raw records with formatted timestamps.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unsupported resolution: {resolution}")
+
+    end = int(end) if end is not None else int(datetime.now(timezone.utc).timestamp())
+    start = int(start) if start is not None else 0
+
+    query_args = {
+        'TableName': table_name,
+        'KeyConditionExpression': 'station = :station AND #timestamp BETWEEN :start AND :end',
+        'ExpressionAttributeNames': {'#timestamp': 'timestamp'},
+        'ExpressionAttributeValues': {
+            ':station': {'S': station_name},
+            ':start': {'N': str(start)},
+            ':end': {'N': str(end)},
+        },
+        'ScanIndexForward': False,
+    }
+
+    if resolution != 'raw':
+        projection = ('station', 'timestamp', VOLUME_COLUMN) + PRICE_COLUMNS
+    if projection:
+        for index, name in enumerate(projection):
+            query_args['ExpressionAttributeNames'][f'#p{index}'] = name
+        query_args['ProjectionExpression'] = ', '.join(f'#p{index}' for index in range(len(projection)))
+
+    items = []
+    while True:
+        if resolution == 'raw':
+            query_args['Limit'] = MAX_RAW_ITEMS - len(items)
+        response = client.query(**query_args)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response or (resolution == 'raw' and len(items) >= MAX_RAW_ITEMS):
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    records = epoch_decoder.decode_items(items)
+    if resolution != 'raw':
+        return downsample(records, resolution)
+
+    for record in records:
+        if 'timestamp' in record:
+            record['timestamp'] = format_timestamp(record['timestamp'])
+    return records
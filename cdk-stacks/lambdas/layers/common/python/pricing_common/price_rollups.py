@@ -0,0 +1,250 @@
+from datetime import datetime, timezone
+from pricing_common.dynamodb_decode import format_timestamp
+from pricing_common.price_history import (
+    PRICE_COLUMNS, VOLUME_COLUMN, epoch_decoder, bucket_start, new_bucket, add_to_bucket, bucket_record
+)
+
+ROLLUP_RESOLUTIONS = ('daily', 'weekly', 'monthly')
+
+# Attempts of the optimistic read-merge-write of one rollup item
+MAX_UPDATE_ATTEMPTS = 5
+
+
+def rollup_key(resolution, start):
+    """Return the sort key of a rollup item, e.g. 'daily#2024-07-24'.
+
+    Args:
+        resolution (str): One of ROLLUP_RESOLUTIONS.
+        start (int): Epoch timestamp of the bucket start.
+    """
+    return f"{resolution}#{datetime.fromtimestamp(start, timezone.utc).strftime('%Y-%m-%d')}"
+
+
+def aggregate_rollups(station_name, records):
+    """Aggregate price records into the buckets of every rollup resolution.
+
+    Args:
+        station_name (str): The name of the station.
+        records (list): Price records with epoch 'timestamp' values.
+
+    Returns:
+        dict: Aggregation buckets by rollup key, with the bucket start under 'start'.
+    """
+    buckets = {}
+    for record in records:
+        timestamp = float(record['timestamp'])
+        for resolution in ROLLUP_RESOLUTIONS:
+            start = bucket_start(timestamp, resolution)
+            key = rollup_key(resolution, start)
+            if key not in buckets:
+                buckets[key] = new_bucket(station_name)
+                buckets[key]['start'] = start
+            add_to_bucket(buckets[key], record)
+    return buckets
+
+
+def merge_buckets(target, source):
+    """Merge the statistics of source into target."""
+    target['count'] += source['count']
+    target['volume'] += source['volume']
+    for column, (minimum, maximum, total, count) in source['prices'].items():
+        stats = target['prices'].get(column)
+        if stats is None:
+            target['prices'][column] = [minimum, maximum, total, count]
+        else:
+            stats[0] = min(stats[0], minimum)
+            stats[1] = max(stats[1], maximum)
+            stats[2] += total
+            stats[3] += count
+
+
+def bucket_to_item(key, bucket, version):
+    """Convert an aggregation bucket to a rollup item of the low-level client."""
+    item = {
+        'station': {'S': bucket['station']},
+        'bucket': {'S': key},
+        'bucketStart': {'N': str(bucket['start'])},
+        'records': {'N': str(bucket['count'])},
+        VOLUME_COLUMN: {'N': repr(bucket['volume'])},
+        'version': {'N': str(version)},
+    }
+    for column, (minimum, maximum, total, count) in bucket['prices'].items():
+        item[f'{column}Min'] = {'N': repr(minimum)}
+        item[f'{column}Max'] = {'N': repr(maximum)}
+        item[f'{column}Sum'] = {'N': repr(total)}
+        item[f'{column}Count'] = {'N': str(count)}
+    return item
+
+
+def bucket_from_item(item):
+    """Convert a rollup item of the low-level client back to an aggregation bucket.
+
+    Returns:
+        tuple: The bucket and the version of the item.
+    """
+    values = epoch_decoder.decode_item(item)
+    bucket = new_bucket(values['station'])
+    bucket['start'] = int(values['bucketStart'])
+    bucket['count'] = int(values['records'])
+    bucket['volume'] = values.get(VOLUME_COLUMN, 0.0)
+    for column in PRICE_COLUMNS:
+        if f'{column}Count' in values:
+            bucket['prices'][column] = [
+                values[f'{column}Min'], values[f'{column}Max'], values[f'{column}Sum'], int(values[f'{column}Count'])
+            ]
+    return bucket, int(values['version'])
+
+
+def apply_rollups(client, table_name, station_name, records):
+    """Add new price records to the rollups of a station.
+
+    Each rollup item is read, merged and written back with a condition on its version, so
+    concurrent writers of the same station retry instead of overwriting each other.
+    Records must only be applied once, re-applying them counts them twice.
+
+    Args:
+        client: Low-level DynamoDB client.
+        table_name (str): The rollup table.
+        station_name (str): The name of the station.
+        records (list): New price records with epoch 'timestamp' values.
+
+    Returns:
+        int: The number of rollup items updated.
+    """
+    updated = 0
+    for key, bucket in aggregate_rollups(station_name, records).items():
+        item_key = {'station': {'S': station_name}, 'bucket': {'S': key}}
+        for attempt in range(MAX_UPDATE_ATTEMPTS):
+            response = client.get_item(TableName=table_name, Key=item_key, ConsistentRead=True)
+            if 'Item' in response:
+                merged, version = bucket_from_item(response['Item'])
+                merge_buckets(merged, bucket)
+                condition = {
+                    'ConditionExpression': '#version = :version',
+                    'ExpressionAttributeNames': {'#version': 'version'},
+                    'ExpressionAttributeValues': {':version': {'N': str(version)}},
+                }
+            else:
+                merged, version = bucket, 0
+                condition = {'ConditionExpression': 'attribute_not_exists(station)'}
+            try:
+                client.put_item(TableName=table_name, Item=bucket_to_item(key, merged, version + 1), **condition)
+                updated += 1
+                break
+            except client.exceptions.ConditionalCheckFailedException:
+                print(f"Rollup {key} of {station_name} changed concurrently, attempt {attempt + 1}")
+        else:
+            print(f"Could not update rollup {key} of {station_name}")
+    return updated
+
+
+def rebuild_rollups(client, prices_table_name, rollups_table_name, station_name, since=None):
+    """Recompute the rollups of a station from its price records.
+
+    Price records expire with their TTL, so only buckets starting at or after since are
+    complete in the price table. Those buckets are overwritten, and stored buckets in that
+    window without any price record are deleted. Older buckets are kept as they are, they
+    hold the only aggregates of the expired records. Records written while the rebuild
+    runs may be missing from the result, so rebuilds should run while the generator is idle.
+
+    Args:
+        client: Low-level DynamoDB client.
+        prices_table_name (str): The price table.
+        rollups_table_name (str): The rollup table.
+        station_name (str): The name of the station.
+        since (int): Epoch timestamp of the oldest price record that has not expired,
+            all buckets are rebuilt if None.
+
+    Returns:
+        dict: The number of rollup items written and deleted.
+    """
+    since = int(since) if since is not None else 0
+    projection = ('timestamp', VOLUME_COLUMN) + PRICE_COLUMNS
+    query_args = {
+        'TableName': prices_table_name,
+        'KeyConditionExpression': 'station = :station AND #p0 >= :since',
+        'ExpressionAttributeValues': {':station': {'S': station_name}, ':since': {'N': str(since)}},
+        'ExpressionAttributeNames': {f'#p{index}': name for index, name in enumerate(projection)},
+        'ProjectionExpression': ', '.join(f'#p{index}' for index in range(len(projection))),
+    }
+
+    records = []
+    while True:
+        response = client.query(**query_args)
+        records.extend(epoch_decoder.decode_items(response.get('Items', [])))
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    # Buckets starting before since also hold expired records, they are left untouched
+    buckets = {
+        key: bucket for key, bucket in aggregate_rollups(station_name, records).items()
+        if bucket['start'] >= since
+    }
+    for key, bucket in buckets.items():
+        client.put_item(TableName=rollups_table_name, Item=bucket_to_item(key, bucket, 1))
+
+    deleted = 0
+    for key, start in query_rollup_keys(client, rollups_table_name, station_name):
+        if start >= since and key not in buckets:
+            client.delete_item(TableName=rollups_table_name, Key={'station': {'S': station_name}, 'bucket': {'S': key}})
+            deleted += 1
+    return {'written': len(buckets), 'deleted': deleted}
+
+
+def query_rollup_keys(client, table_name, station_name):
+    """Return the key and bucket start of every stored rollup item of a station.
+
+    Returns:
+        list: Tuples of the rollup key and the epoch timestamp of the bucket start.
+    """
+    query_args = {
+        'TableName': table_name,
+        'KeyConditionExpression': 'station = :station',
+        'ExpressionAttributeValues': {':station': {'S': station_name}},
+        # bucket is a reserved word
+        'ExpressionAttributeNames': {'#bucket': 'bucket', '#start': 'bucketStart'},
+        'ProjectionExpression': '#bucket, #start',
+    }
+    keys = []
+    while True:
+        response = client.query(**query_args)
+        keys.extend((item['bucket']['S'], int(item['bucketStart']['N'])) for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return keys
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def get_rollup(client, table_name, station_name, resolution='daily', timestamp=None):
+    """Read the rollup of a station for the bucket a timestamp falls in, with one GetItem.
+
+    Args:
+        client: Low-level DynamoDB client.
+        table_name (str): The rollup table.
+        station_name (str): The name of the station.
+        resolution (str): One of ROLLUP_RESOLUTIONS.
+        timestamp (int): Epoch timestamp in the bucket, now if None.
+
+    Returns:
+        dict: Mean, min and max of every price column, total volume and record count,
+            or None if the bucket has no records.
+    """
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise ValueError(f"Unsupported rollup resolution: {resolution}")
+
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc).timestamp()
+    key = rollup_key(resolution, bucket_start(float(timestamp), resolution))
+
+    response = client.get_item(
+        TableName=table_name,
+        Key={'station': {'S': station_name}, 'bucket': {'S': key}}
+    )
+    if 'Item' not in response:
+        return None
+
+    bucket, _ = bucket_from_item(response['Item'])
+    record = bucket_record(bucket)
+    record['resolution'] = resolution
+    record['timestamp'] = format_timestamp(bucket['start'])
+    return record
@@ -1,51 +1,138 @@
 import os
-import boto3
 import csv
 import json
 import io
-from datetime import datetime, timedelta
-from boto3.dynamodb.conditions import Key
-from decimal import Decimal
+from pricing_common.dynamodb_decode import decode_items
+from pricing_common.price_history import query_price_history, PRICE_COLUMNS, VOLUME_COLUMN
+from pricing_common.aws_clients import create_client
 
 # Set up the DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+dynamodb = create_client('dynamodb')
 table_name = os.environ['DYNAMODB_TABLE_NAME']
-table = dynamodb.Table(table_name)
+
+# Column order of the compact format, columns not listed here follow in alphabetical order
+COMPACT_COLUMNS = ('timestamp', 'weatherCondition', 'trafficEvents', VOLUME_COLUMN, 'records') + PRICE_COLUMNS
+# Fields that are the same for every row, written once in the header of the compact format
+COMPACT_SHARED_FIELDS = ('station', 'city', 'state')
+COMPACT_DROPPED_FIELDS = ('expirationtime',)
+PRICE_DECIMALS = 2
+
+
+def parse_columns(columns):
+    """Return the requested columns as a list, from a list or a comma separated string."""
+    if not columns:
+        return None
+    if isinstance(columns, str):
+        columns = columns.split(',')
+    columns = [column.strip() for column in columns if column.strip()]
+    if 'timestamp' not in columns:
+        columns.insert(0, 'timestamp')
+    return columns
+
+
+def select_columns(items, columns):
+    """Keep the requested columns of downsampled records, with their Min and Max variants."""
+    selected = set(columns)
+    selected.update(f'{column}{suffix}' for column in columns for suffix in ('Min', 'Max'))
+    selected.update(('station', 'records'))
+    return [{name: value for name, value in item.items() if name in selected} for item in items]
+
+
+def to_csv(items):
+    """Convert records to CSV, with the union of their keys as header in first seen order."""
+    fieldnames = {}
+    for item in items:
+        fieldnames.update(dict.fromkeys(item))
+
+    csv_output = io.StringIO()
+    writer = csv.DictWriter(csv_output, fieldnames=list(fieldnames), restval='')
+    writer.writeheader()
+    writer.writerows(items)
+    return csv_output.getvalue()
+
+
+def to_compact(items):
+    """Convert records to a compact CSV for prompts.
+
+    Station, city and state are written once above the header when they are the same in
+    every row, columns have a fixed order, prices are rounded and timestamps drop seconds.
+    """
+    shared = {}
+    for field in COMPACT_SHARED_FIELDS:
+        values = {item.get(field) for item in items}
+        if len(values) == 1 and None not in values:
+            shared[field] = values.pop()
+
+    present = set()
+    for item in items:
+        present.update(item)
+    present.difference_update(shared, COMPACT_DROPPED_FIELDS)
+    fieldnames = [column for column in COMPACT_COLUMNS if column in present]
+    fieldnames += sorted(present.difference(fieldnames))
+
+    csv_output = io.StringIO()
+    if shared:
+        csv_output.write(';'.join(f'{field}={value}' for field, value in shared.items()) + '\n')
+    writer = csv.writer(csv_output)
+    writer.writerow(fieldnames)
+    for item in items:
+        row = []
+        for column in fieldnames:
+            value = item.get(column, '')
+            if column == 'timestamp' and isinstance(value, str):
+                value = value[:16]
+            elif isinstance(value, float):
+                value = int(value) if column in (VOLUME_COLUMN, 'records') else round(value, PRICE_DECIMALS)
+            row.append(value)
+        writer.writerow(row)
+    return csv_output.getvalue()
+
 
 def lambda_handler(event, context):
     stationname = ""
-    
+    options = event
+
     if("stationName" in event):
         stationname = event["stationName"]
     else:
-        stationname = json.loads(event['node']['inputs'][0]['value'])['station']
-        
+        options = json.loads(event['node']['inputs'][0]['value'])
+        stationname = options['station']
+
+    # Optional epoch range and resolution ('raw', 'daily', 'weekly' or 'monthly')
+    start = options.get('start')
+    end = options.get('end')
+    resolution = options.get('resolution')
+    # Optional list of columns to read, and output format ('csv' or 'compact')
+    columns = parse_columns(options.get('columns'))
+    output_format = options.get('format', 'csv')
+
     # Query station data
     try:
-        response = table.query(
-        KeyConditionExpression=Key('station').eq(stationname),
-        ScanIndexForward=False,  
-        Limit=5)
-    
-        items = response.get('Items')
-        
-        # Convert to CSV
-        csv_output = io.StringIO()
-        fieldnames = items[0].keys()  # Get column headers from the first item
-        writer = csv.DictWriter(csv_output, fieldnames=fieldnames)
-        writer.writeheader()
-        for item in items:
-            # Convert Decimal to float for CSV compatibility
-            for key, value in item.items():
-                if isinstance(value, Decimal):
-                    item[key] = float(value)
-                if key == 'timestamp':
-                    item[key] = datetime.fromtimestamp(item[key]).strftime("%Y-%m-%d %H:%M:%S")
-
-            writer.writerow(item)
-        csv_string = csv_output.getvalue()
-
-        return csv_string
+        if start is None and end is None and resolution is None:
+            query_args = {}
+            if columns:
+                query_args['ExpressionAttributeNames'] = {f'#p{index}': name for index, name in enumerate(columns)}
+                query_args['ProjectionExpression'] = ', '.join(query_args['ExpressionAttributeNames'])
+            response = dynamodb.query(
+            TableName=table_name,
+            KeyConditionExpression='station = :station',
+            ExpressionAttributeValues={':station': {'S': stationname}},
+            ScanIndexForward=False,
+            Limit=5,
+            **query_args)
+
+            items = decode_items(response.get('Items'))
+        else:
+            items = query_price_history(dynamodb, table_name, stationname, start, end, resolution or 'raw', columns)
+            if columns and resolution not in (None, 'raw'):
+                items = select_columns(items, columns)
+
+        if not items:
+            return "No data available"
+
+        if output_format == 'compact':
+            return to_compact(items)
+        return to_csv(items)
     except Exception as e:
         print(str(e))
-        return "No data available"
\ No newline at end of file
+        return "No data available"
@@ -0,0 +1,52 @@
+"""Fixtures running the bedrock_async handler against the in-process AWS stand-ins.
+
+The environment, seed data and events of benchmarks/bench_handlers.py are reused, without
+injected latency. Run from the cdk-stacks/lambdas directory:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import json
+import pytest
+
+LAMBDAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(LAMBDAS_DIR, 'benchmarks'))
+
+from aws_stand_ins import StandIns, DEFAULT_LATENCY_MS
+from bench_handlers import ENVIRONMENT, TABLE_NAMES, LambdaContext, make_event, seed_data
+
+STATIONS = 3
+DAYS = 10
+HISTORY = 4
+
+
+@pytest.fixture(scope='session')
+def stand_ins():
+    """Stand-ins installed in place of boto3.client, seeded with the benchmark data."""
+    os.environ.update(ENVIRONMENT)
+    stand_ins = StandIns({service: 0 for service in DEFAULT_LATENCY_MS}, TABLE_NAMES)
+    stand_ins.install()
+    stand_ins['apigatewaymanagementapi'].record_frames = True
+    seed_data(stand_ins, STATIONS, DAYS, HISTORY)
+    return stand_ins
+
+
+@pytest.fixture(scope='session')
+def handler(stand_ins):
+    from lambda_function import lambda_handler
+    return lambda_handler
+
+
+@pytest.fixture
+def send(stand_ins, handler):
+    """Handle one websocket message, returning the response and the frames sent back."""
+    api_gateway = stand_ins['apigatewaymanagementapi']
+
+    def send(body):
+        api_gateway.frames.clear()
+        rejected_frames = api_gateway.rejected_frames
+        response = handler(make_event(body), LambdaContext())
+        assert api_gateway.rejected_frames == rejected_frames, 'a frame was rejected by API Gateway'
+        return response, [json.loads(frame) for frame in api_gateway.frames]
+
+    return send
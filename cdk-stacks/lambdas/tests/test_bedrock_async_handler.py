@@ -0,0 +1,164 @@
+import json
+import time
+from bench_handlers import TABLE_NAMES
+
+# API Gateway rejects websocket frames over 128 KB
+MAX_FRAME_BYTES = 128 * 1024
+
+
+def seed_recommendations(stand_ins, station_names, text):
+    now = int(time.time())
+    stand_ins['dynamodb'].seed(TABLE_NAMES['AI_RECOMMENDATION_TABLE'], [
+        {'station': {'S': name}, 'timestamp': {'N': str(now)}, 'message': {'S': text}}
+        for name in station_names
+    ])
+
+
+def test_dashboard_with_long_recommendations_is_split_across_frames(stand_ins, send):
+    # The flow writes recommendations of up to 1000 output tokens
+    station_names = [f"Dashboard Station {index}" for index in range(50)]
+    text = "Raise premium by two cents before the weekend. " * 125
+    seed_recommendations(stand_ins, station_names, text)
+
+    response, frames = send({'type': 'dashboard', 'stations': station_names})
+
+    assert response['statusCode'] == 200
+    assert len(frames) > 1
+    assert all(len(json.dumps(frame).encode()) < MAX_FRAME_BYTES for frame in frames)
+    assert [frame['part'] for frame in frames] == list(range(1, len(frames) + 1))
+    assert {frame['parts'] for frame in frames} == {len(frames)}
+    stations = [station for frame in frames for station in frame['stations']]
+    assert [station['station'] for station in stations] == station_names
+    assert all(station['recommendation']['message'] == text for station in stations)
+
+
+def test_short_dashboard_is_one_frame(stand_ins, send):
+    station_names = ["Station 1", "Station 2"]
+
+    response, frames = send({'type': 'dashboard', 'stations': station_names})
+
+    assert response['statusCode'] == 200
+    assert len(frames) == 1
+    assert [station['station'] for station in frames[0]['stations']] == station_names
+
+
+def station_item(name, station_id, address):
+    return {
+        'station': {'S': name},
+        'id': {'N': str(station_id)},
+        'address': {'S': address},
+        'city': {'S': 'Amarillo, TX'},
+        'state': {'S': 'In Service'},
+    }
+
+
+def test_stations_refresh_reloads_the_cached_station_list(stand_ins, send):
+    stations_table = TABLE_NAMES['FUEL_STATIONS_TABLE']
+    _, frames = send({'type': 'stations'})
+    cached = [station['station'] for station in frames[0]['stations']]
+
+    stand_ins['dynamodb'].seed(stations_table, [station_item("Station 99", 99, "1 Main Street")])
+    try:
+        _, frames = send({'type': 'stations'})
+        assert [station['station'] for station in frames[0]['stations']] == cached
+
+        _, frames = send({'type': 'stations', 'refresh': True})
+        assert [station['station'] for station in frames[0]['stations']] == cached + ["Station 99"]
+    finally:
+        stand_ins['dynamodb'].clear(stations_table, "Station 99")
+        send({'type': 'stations', 'refresh': True})
+
+
+def test_station_detail_refresh_reloads_the_cached_station(stand_ins, send):
+    stations_table = TABLE_NAMES['FUEL_STATIONS_TABLE']
+    _, frames = send({'type': 'station_detail', 'station': "Station 2"})
+    original = frames[0]['station']
+
+    stand_ins['dynamodb'].seed(stations_table, [station_item("Station 2", 2, "9 New Road")])
+    try:
+        _, frames = send({'type': 'station_detail', 'station': "Station 2"})
+        assert frames[0]['station']['address'] == original['address']
+
+        _, frames = send({'type': 'station_detail', 'station': "Station 2", 'refresh': True})
+        assert frames[0]['station']['address'] == "9 New Road"
+    finally:
+        stand_ins['dynamodb'].seed(stations_table, [station_item("Station 2", 2, original['address'])])
+        send({'type': 'station_detail', 'station': "Station 2", 'refresh': True})
+
+
+def test_stations_pages_read_one_page_of_the_table_each(stand_ins, send):
+    _, frames = send({'type': 'stations', 'refresh': True})
+    all_stations = sorted(station['station'] for station in frames[0]['stations'])
+
+    paged = []
+    cursor = None
+    for _ in range(len(all_stations)):
+        stand_ins.recorder.reset()
+        _, frames = send({'type': 'stations', 'page_size': 2, 'cursor': cursor})
+        counts, _ = stand_ins.recorder.snapshot()
+        assert counts['dynamodb.scan'] == 1
+        assert len(frames[0]['stations']) <= 2
+        paged.extend(station['station'] for station in frames[0]['stations'])
+        cursor = frames[0]['next_cursor']
+        if cursor is None:
+            break
+
+    assert cursor is None
+    assert sorted(paged) == all_stations
+
+
+def test_stations_page_with_an_invalid_cursor_starts_over(send):
+    _, first = send({'type': 'stations', 'page_size': 2})
+    _, frames = send({'type': 'stations', 'page_size': 2, 'cursor': 'not-a-cursor'})
+
+    assert frames[0]['stations'] == first[0]['stations']
+
+
+def test_historical_prices_with_an_invalid_range_send_an_error_frame(send):
+    response, frames = send({'type': 'historical_fuel_prices', 'station': "Station 1", 'start': '2024-01-01'})
+
+    assert response['statusCode'] == 200
+    assert frames == [{'type': 'error', 'error': "Invalid start '2024-01-01', expected epoch seconds"}]
+
+
+def test_historical_prices_with_start_after_end_send_an_error_frame(send):
+    now = int(time.time())
+    response, frames = send({'type': 'historical_fuel_prices', 'station': "Station 1", 'start': now, 'end': now - 86400})
+
+    assert response['statusCode'] == 200
+    assert frames == [{'type': 'error', 'error': "Invalid range, start is after end"}]
+
+
+def test_historical_prices_with_an_invalid_resolution_send_an_error_frame(send):
+    response, frames = send({'type': 'historical_fuel_prices', 'station': "Station 1",
+                             'start': int(time.time()) - 7 * 86400, 'resolution': 'hourly'})
+
+    assert response['statusCode'] == 200
+    assert len(frames) == 1
+    assert frames[0]['type'] == 'error'
+    assert "Unsupported resolution 'hourly'" in frames[0]['error']
+
+
+def test_historical_prices_accept_numeric_string_bounds(send):
+    now = int(time.time())
+    response, frames = send({'type': 'historical_fuel_prices', 'station': "Station 1",
+                             'start': str(now - 5 * 86400), 'end': str(now), 'resolution': 'daily'})
+
+    assert response['statusCode'] == 200
+    assert frames[0]['type'] == 'historical_fuel_prices'
+    assert frames[0]['resolution'] == 'daily'
+    assert len(frames[0]['prices']) == 5
+
+
+def test_historical_prices_reply_with_null_prices_when_the_query_fails(stand_ins, send, monkeypatch):
+    def failing_query(**kwargs):
+        raise stand_ins['dynamodb'].exceptions.error('InternalServerError')
+
+    monkeypatch.setattr(stand_ins['dynamodb'], 'query', failing_query)
+    response, frames = send({'type': 'historical_fuel_prices', 'station': "Station 1",
+                             'start': int(time.time()) - 7 * 86400})
+
+    assert response['statusCode'] == 200
+    assert len(frames) == 1
+    assert frames[0]['type'] == 'historical_fuel_prices'
+    assert frames[0]['prices'] is None
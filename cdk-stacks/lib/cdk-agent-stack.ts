@@ -241,6 +241,18 @@ export class CdkAgentStack extends cdk.Stack {
       removalPolicy: RemovalPolicy.DESTROY
     });
 
+    const dynamodbConversationTurnsTable = new dynamodb.Table(this, 'dynamodb_conversation_turns_table', {
+      partitionKey: {
+        name: 'session_id',
+        type: dynamodb.AttributeType.STRING,
+      },
+      sortKey: {
+        name: 'seq',
+        type: dynamodb.AttributeType.NUMBER
+      },
+      removalPolicy: RemovalPolicy.DESTROY
+    });
+
     const dynamodbFuelStations = new dynamodb.Table(this, 'dynamodb_fuel_stations', {
       partitionKey: {
         name: 'station',
@@ -279,6 +291,38 @@ export class CdkAgentStack extends cdk.Stack {
       removalPolicy: RemovalPolicy.DESTROY
     });
 
+    // Daily, weekly and monthly price aggregates, e.g. bucket 'daily#2024-07-24'
+    const dynamodbPriceRollups = new dynamodb.Table(this, 'dynamodb_price_rollups', {
+      partitionKey: {
+        name: 'station',
+        type: dynamodb.AttributeType.STRING,
+      },
+      sortKey: {
+        name: 'bucket',
+        type: dynamodb.AttributeType.STRING
+      },
+      removalPolicy: RemovalPolicy.DESTROY
+    });
+
+    // Progress of the resumable backfill jobs of the data generator
+    const dynamodbBackfillCheckpoints = new dynamodb.Table(this, 'dynamodb_backfill_checkpoints', {
+      partitionKey: {
+        name: 'job_id',
+        type: dynamodb.AttributeType.STRING,
+      },
+      timeToLiveAttribute: 'expirationtime',
+      removalPolicy: RemovalPolicy.DESTROY
+    });
+
+    const dynamodbCacheTable = new dynamodb.Table(this, 'dynamodb_cache_table', {
+      partitionKey: {
+        name: 'cache_key',
+        type: dynamodb.AttributeType.STRING,
+      },
+      timeToLiveAttribute: 'expirationtime',
+      removalPolicy: RemovalPolicy.DESTROY
+    });
+
     // Create a Lambda layer for the Boto3 library
     const boto3Layer = new python.PythonLayerVersion(this, 'Boto3Layer', {
       entry: 'lambdas/layers/boto3',
@@ -292,6 +336,28 @@ export class CdkAgentStack extends cdk.Stack {
       },
     });
 
+    // Create a Lambda layer for NumPy, used by the seeded bulk data generator only. The
+    // wheels are native, so they are installed for the architecture of the functions.
+    const numpyLayer = new python.PythonLayerVersion(this, 'NumpyLayer', {
+      entry: 'lambdas/layers/numpy',
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      compatibleArchitectures: [lambda.Architecture.ARM_64],
+      bundling: {
+        command: [
+          'bash',
+          '-c',
+          'pip install -r requirements.txt -t /asset-output/python',
+        ],
+      },
+    });
+
+    // Create a Lambda layer for the modules shared by the Python functions
+    const commonLayer = new lambda.LayerVersion(this, 'CommonLayer', {
+      code: lambda.Code.fromAsset('lambdas/layers/common'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      description: 'Modules shared by the energy pricing assistant Python functions',
+    });
+
     // Add Powertools layer
     const powertoolsLayer = lambda.LayerVersion.fromLayerVersionArn(
       this,
@@ -365,7 +431,7 @@ export class CdkAgentStack extends cdk.Stack {
       tracing: lambda.Tracing.ACTIVE,
       memorySize: 1024,
       logRetention: logs.RetentionDays.FIVE_DAYS,
-      layers: [boto3Layer, powertoolsLayer],
+      layers: [boto3Layer, powertoolsLayer, commonLayer],
       environment: {
         DYNAMODB_TABLE_NAME: dynamodbSyntheticStationData.tableName,
       },
@@ -396,7 +462,7 @@ export class CdkAgentStack extends cdk.Stack {
       architecture: lambda.Architecture.ARM_64,
       tracing: lambda.Tracing.ACTIVE,
       memorySize: 1024,
-      layers: [boto3Layer, powertoolsLayer],
+      layers: [boto3Layer, powertoolsLayer, commonLayer],
       logRetention: logs.RetentionDays.FIVE_DAYS,
       environment: {
         AI_RECOMMENDATION_TABLE: dynamodbAIRecommendations.tableName,
@@ -404,11 +470,17 @@ export class CdkAgentStack extends cdk.Stack {
         FLOW_IDENTIFIER: FLOW_IDENTIFIER,
         FUEL_PRICES_TABLE: dynamodbSyntheticStationData.tableName,
         FUEL_STATIONS_TABLE: dynamodbFuelStations.tableName,
+        PRICE_ROLLUPS_TABLE: dynamodbPriceRollups.tableName,
         DYNAMODB_TABLE: dynamodbConversationsTable.tableName,
+        CONVERSATION_TURNS_TABLE: dynamodbConversationTurnsTable.tableName,
+        HISTORY_STORAGE_MODE: 'turns',
+        HISTORY_TOKEN_BUDGET: '6000',
         CONVERSATION_HISTORY_BUCKET: conversationHistoryBucket.bucketName,
         WEBSOCKET_API_ENDPOINT: websocketApiEndpoint,
         REGION: this.region,
         POWERTOOLS_SERVICE_NAME: 'BEDROCK_ASYNC_SERVICE',
+        POWERTOOLS_METRICS_NAMESPACE: 'EnergyPricingAssistant',
+        CACHE_TABLE: dynamodbCacheTable.tableName,
         USER_POOL_ID: userPool.userPoolId,
         USER_POOL_CLIENT_ID: userPoolClient.userPoolClientId,
         KNOWLEDGE_BASE_ID: props.knowledgeBaseId,
@@ -450,9 +522,12 @@ export class CdkAgentStack extends cdk.Stack {
       iam.ManagedPolicy.fromAwsManagedPolicyName('AmazonAPIGatewayInvokeFullAccess')
     );
     dynamodbConversationsTable.grantReadWriteData(lambdaFnAsync);
+    dynamodbConversationTurnsTable.grantReadWriteData(lambdaFnAsync);
+    dynamodbCacheTable.grantReadWriteData(lambdaFnAsync);
     dynamodbAIRecommendations.grantReadWriteData(lambdaFnAsync);
     dynamodbFuelStations.grantReadWriteData(lambdaFnAsync);
     dynamodbSyntheticStationData.grantReadWriteData(lambdaFnAsync);
+    dynamodbPriceRollups.grantReadData(lambdaFnAsync);
     conversationHistoryBucket.grantReadWrite(lambdaFnAsync);
 
     // Create the Lambda function to generate synthetic data
@@ -465,20 +540,38 @@ export class CdkAgentStack extends cdk.Stack {
       tracing: lambda.Tracing.ACTIVE,
       memorySize: 1024,
       logRetention: logs.RetentionDays.FIVE_DAYS,
-      layers: [boto3Layer, powertoolsLayer],
+      layers: [boto3Layer, powertoolsLayer, commonLayer, numpyLayer],
       environment: {
         DYNAMODB_AI_RECOMMENDATIONS_TABLE_NAME: dynamodbAIRecommendations.tableName,
         DYNAMODB_PRICES_TABLE_NAME: dynamodbSyntheticStationData.tableName,
         DYNAMODB_STATIONS_TABLE_NAME: dynamodbFuelStations.tableName,
+        DYNAMODB_ROLLUPS_TABLE_NAME: dynamodbPriceRollups.tableName,
+        DYNAMODB_CHECKPOINTS_TABLE_NAME: dynamodbBackfillCheckpoints.tableName,
         FLOW_ALIAS: FLOW_ALIAS_IDENTIFIER,
         FLOW_IDENTIFIER: FLOW_IDENTIFIER,
-        MODEL_ID: novaModel
+        MODEL_ID: novaModel,
+        MAX_CONCURRENCY: '8'
       },
     });
     lambdaFnGenerateData.role?.attachInlinePolicy(customBedrockPolicy);
     dynamodbAIRecommendations.grantReadWriteData(lambdaFnGenerateData);
     dynamodbFuelStations.grantReadWriteData(lambdaFnGenerateData);
     dynamodbSyntheticStationData.grantReadWriteData(lambdaFnGenerateData);
+    dynamodbPriceRollups.grantReadWriteData(lambdaFnGenerateData);
+    dynamodbBackfillCheckpoints.grantReadWriteData(lambdaFnGenerateData);
+
+    // Backfill jobs reinvoke the generator before the timeout. A standalone policy avoids a
+    // circular dependency between the function and its role.
+    const generateDataSelfInvokePolicy = new iam.Policy(this, 'StationDataGeneratorSelfInvokePolicy', {
+      statements: [
+        new iam.PolicyStatement({
+          effect: iam.Effect.ALLOW,
+          actions: ['lambda:InvokeFunction'],
+          resources: [lambdaFnGenerateData.functionArn],
+        }),
+      ],
+    });
+    lambdaFnGenerateData.role?.attachInlinePolicy(generateDataSelfInvokePolicy);
 
     const rule = new events.Rule(this, "DailyStationDataGenerationRule", {
       schedule: events.Schedule.cron({ minute: "0", hour: "12" }), // Run at 12 PM